@@ -0,0 +1,5 @@
+"""
+Apple OCR ツール - ベンチマーク
+
+合成した日本語のOCR結果を使って、後処理の各段階とバッチ処理の性能を計測します。
+"""
@@ -0,0 +1,67 @@
+"""
+出力の確認モジュール
+
+合成コーパスを使って、位置情報からの表の検出が次のとおり動作することを確認します。
+
+- 2段・3段組みの文章は、どの変換レベルでも表に変換されず、表の検出を無効にした場合と同じ結果になる
+- 区切り文字を含まない表は、各変換レベルで表として検出される
+
+確認に失敗した項目があれば終了コード1を返します。
+
+使用例:
+    python -m benchmarks.check
+"""
+
+import argparse
+import sys
+
+from ocr.core import render_observations
+
+from .corpus import generate_column_prose, generate_grid_table
+
+CONVERSION_LEVELS = ('conservative', 'moderate', 'aggressive')
+
+def iter_checks(seeds):
+    """確認項目を (名前, 確認に成功したかどうかを返す関数) の組で返す"""
+    for seed in range(seeds):
+        for columns in (2, 3):
+            observations = generate_column_prose(columns, 6 + seed, seed)
+            for level in CONVERSION_LEVELS:
+                yield (f'prose[columns={columns},seed={seed}][{level}]',
+                       lambda observations=observations, level=level: _renders_unchanged(observations, level))
+        for columns in (2, 3, 4):
+            observations, cells = generate_grid_table(4, columns, seed)
+            for level in CONVERSION_LEVELS:
+                if level == 'conservative' and columns < 3:
+                    continue
+                yield (f'table[columns={columns},seed={seed}][{level}]',
+                       lambda observations=observations, cells=cells, level=level:
+                           _detects_table(observations, cells, level))
+
+def _renders_unchanged(observations, level):
+    with_tables = render_observations(observations, True, True, False, level)
+    return with_tables == render_observations(observations, True, False, False, level)
+
+def _detects_table(observations, cells, level):
+    lines = render_observations(observations, True, True, False, level).splitlines()
+    return all(any(line.startswith('|') and all(text in line for text in row) for line in lines) for row in cells)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='合成コーパスを使って表の検出の結果を確認する')
+    parser.add_argument('--seeds', type=int, default=5, help='確認に使用するシード値の数（デフォルト: 5）')
+    args = parser.parse_args(argv)
+
+    failures = []
+    for name, check in iter_checks(args.seeds):
+        ok = check()
+        print(f"{name:<44}{'OK' if ok else '失敗'}")
+        if not ok:
+            failures.append(name)
+    if failures:
+        print(f"\n確認に失敗した項目: {', '.join(failures)}")
+        return 1
+    print("\nすべての確認に成功しました。")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+"""
+合成コーパス生成モジュール
+
+ベンチマーク用に、OCRバックエンドが返す観測値と同じ形式のデータを生成します。
+日本語の文章、見出し（第1章など）、箇条書き（・）、区切り文字や空白で区切られた表、
+インデントされたブロックを混在させ、後処理の各段階に現実的な負荷をかけます。
+同じシード値からは常に同じデータが生成されます。
+"""
+
+import os
+import random
+
+from ocr.backend import save_observations
+
+# 文章の生成に使用する語句
+_WORDS = (
+    '本日', 'の', '会議', 'では', '新しい', '製品', 'について', '説明', 'が', 'あり', 'ました',
+    '売上', 'は', '前年', 'と', '比べて', '増加', 'して', 'います', '顧客', 'から', '意見',
+    'を', '集め', '改善', '点', '検討', 'する', '必要', 'あります', '資料', '作成', '担当者',
+    '確認', 'お願い', 'します', '今後', '予定', '東京', '大阪', '支店', '開発', '部門', '品質',
+)
+_SENTENCE_ENDS = ('。', '。', '、', '！', '？', '')
+_HEADING_TITLES = ('はじめに', '概要', '背景', '方法', '結果', '考察', 'まとめ', '付録')
+_TABLE_HEADERS = ('項目', '数量', '単価', '金額', '備考', '担当', '期限')
+
+# 1行の高さ（正規化座標）と、ページの左端の位置
+_LINE_HEIGHT = 0.012
+_LEFT_MARGIN = 0.08
+
+def generate_observations(line_count, seed=0):
+    """
+    1ページ分の合成観測値を生成する
+
+    Parameters:
+    -----------
+    line_count : int
+        生成する観測値（行）のおおよその数
+    seed : int
+        乱数のシード値
+
+    Returns:
+    --------
+    list
+        観測値（辞書）のリスト（上の行から順）
+    """
+    rng = random.Random(seed)
+    generators = (_prose, _prose, _heading, _bullets, _delimited_table, _spaced_table, _indented_block)
+    rows = []
+    chapter = 0
+    while len(rows) < line_count:
+        generator = rng.choice(generators)
+        if generator is _heading:
+            chapter += 1
+            rows.extend(_heading(rng, chapter))
+        else:
+            rows.extend(generator(rng))
+        rows.append(None)  # ブロックの間の空き
+
+    return _layout(rows[:line_count], rng)
+
+def generate_column_prose(columns, line_count, seed=0):
+    """
+    段組み（columns 段）の文章の合成観測値を生成する
+
+    各段の行は段の幅をほぼ埋める長さにし、行の高さをそろえて配置する（表として検出されないことの確認用）。
+
+    Returns:
+    --------
+    list
+        観測値（辞書）のリスト（段ごとに上の行から順）
+    """
+    rng = random.Random(seed)
+    pitch = (1.0 - _LEFT_MARGIN * 2) / columns
+    line_width = pitch - 0.04
+    chars = max(1, int(line_width / 0.012))
+    observations = []
+    for column in range(columns):
+        y = 0.97
+        for line in range(line_count):
+            y -= _LINE_HEIGHT * 1.5
+            # 段落の最後の行は短くする
+            last = rng.random() < 0.15
+            text = _sentence(rng, 20, 30)[:max(1, chars // 3) if last else chars]
+            observations.append({
+                'text': text,
+                'x': _LEFT_MARGIN + column * pitch + rng.uniform(-0.002, 0.002),
+                'y': y,
+                'width': min(line_width, len(text) * 0.012),
+                'height': _LINE_HEIGHT,
+                'confidence': rng.uniform(0.6, 1.0)
+            })
+    return observations
+
+def generate_grid_table(rows, columns, seed=0):
+    """
+    区切り文字を含まない表（セルごとに1つの観測値）の合成観測値を生成する
+
+    Returns:
+    --------
+    tuple
+        (観測値（辞書）のリスト, セルのテキストの行ごとのリスト)
+    """
+    rng = random.Random(seed)
+    pitch = (1.0 - _LEFT_MARGIN * 2) / columns
+    header = rng.sample(_TABLE_HEADERS, columns)
+    cells = [header] + [[str(rng.randint(1, 9999)) for _ in range(columns)] for _ in range(rows - 1)]
+    observations = []
+    y = 0.97
+    for row in cells:
+        y -= _LINE_HEIGHT * 1.5
+        for column, text in enumerate(row):
+            observations.append({
+                'text': text,
+                'x': _LEFT_MARGIN + column * pitch + rng.uniform(-0.002, 0.002),
+                'y': y + rng.uniform(-0.001, 0.001),
+                'width': len(text) * 0.012,
+                'height': _LINE_HEIGHT,
+                'confidence': rng.uniform(0.6, 1.0)
+            })
+    return observations, cells
+
+def generate_text(line_count, seed=0):
+    """観測値のテキストを1行ずつ結合したテキスト（OCR結果の生テキスト）を生成する"""
+    return "".join(observation['text'] + "\n" for observation in generate_observations(line_count, seed))
+
+def write_corpus(image_dir, record_dir, pages, line_count, seed=0):
+    """
+    ReplayBackend で再生できる合成コーパスを書き出す
+
+    image_dir には中身が空の画像ファイル（page0001.png など）を、
+    record_dir には対応する観測値のJSONLファイルを作成する。
+
+    Parameters:
+    -----------
+    image_dir : str
+        画像ファイルの作成先
+    record_dir : str
+        観測値ファイルの作成先
+    pages : int
+        ページ（画像）の数
+    line_count : int
+        1ページあたりの観測値の数
+    seed : int
+        乱数のシード値（ページごとに seed + ページ番号 を使用する）
+    """
+    os.makedirs(image_dir, exist_ok=True)
+    os.makedirs(record_dir, exist_ok=True)
+    for number in range(1, pages + 1):
+        name = f"page{number:04d}"
+        open(os.path.join(image_dir, f"{name}.png"), 'wb').close()
+        save_observations(os.path.join(record_dir, f"{name}.jsonl"),
+                          generate_observations(line_count, seed + number))
+
+def _layout(rows, rng):
+    """(テキスト, インデント) の行を、上から順に観測値として配置する"""
+    observations = []
+    y = 0.97
+    for row in rows:
+        if row is None:
+            y -= _LINE_HEIGHT
+            continue
+        text, indent = row
+        y -= _LINE_HEIGHT * 1.5
+        observations.append({
+            'text': text,
+            'x': _LEFT_MARGIN + indent + rng.uniform(-0.002, 0.002),
+            'y': y,
+            'width': min(0.9 - indent, len(text) * 0.012),
+            'height': _LINE_HEIGHT,
+            'confidence': rng.uniform(0.6, 1.0)
+        })
+        if y < 0.03:
+            y = 0.97
+    return observations
+
+def _sentence(rng, min_words=4, max_words=18):
+    return ''.join(rng.choice(_WORDS) for _ in range(rng.randint(min_words, max_words))) + rng.choice(_SENTENCE_ENDS)
+
+def _prose(rng):
+    return [(_sentence(rng), 0.0) for _ in range(rng.randint(2, 8))]
+
+def _heading(rng, chapter):
+    style = rng.randrange(3)
+    title = rng.choice(_HEADING_TITLES)
+    if style == 0:
+        return [(f"第{chapter}章 {title}", 0.0)]
+    if style == 1:
+        return [(f"{chapter}. {title}", 0.0)]
+    return [(f"■{title}", 0.0)]
+
+def _bullets(rng):
+    return [(f"・{_sentence(rng, 2, 6)}", 0.0) for _ in range(rng.randint(2, 6))]
+
+def _delimited_table(rng):
+    delimiter = rng.choice(('|', '\t', ','))
+    columns = rng.randint(2, 5)
+    header = rng.sample(_TABLE_HEADERS, columns)
+    rows = [delimiter.join(header)]
+    for _ in range(rng.randint(2, 12)):
+        rows.append(delimiter.join(str(rng.randint(1, 9999)) for _ in range(columns)))
+    return [(row, 0.0) for row in rows]
+
+def _spaced_table(rng):
+    columns = rng.randint(2, 4)
+    header = rng.sample(_TABLE_HEADERS, columns)
+    rows = ['    '.join(header)]
+    for _ in range(rng.randint(2, 8)):
+        rows.append('    '.join(rng.choice(_WORDS) + str(rng.randint(1, 99)) for _ in range(columns)))
+    return [(row, 0.0) for row in rows]
+
+def _indented_block(rng):
+    # 枠で囲まれた注記など、左端より右に配置されたブロック
+    indent = rng.choice((0.05, 0.1, 0.15))
+    lines = [("┌" + "─" * 10 + "┐", indent)]
+    lines.extend((_sentence(rng, 2, 8), indent) for _ in range(rng.randint(1, 4)))
+    lines.append(("└" + "─" * 10 + "┘", indent))
+    return lines
@@ -0,0 +1,356 @@
+"""
+ベンチマーク実行モジュール
+
+合成コーパスを使って後処理の各段階と main.py のバッチ処理を計測し、結果をJSONで保存します。
+バッチ処理は実行方式（--executor）ごとに計測し、認識処理はリプレイの待機時間で模擬します。
+また、CLIの起動時間と、ワーカープロセスの起動方法ごとのプールの起動時間、
+スタブの認識処理で起動したサーバーモード（main.py serve）のリクエストごとの遅延を計測します。
+保存済みの結果（ベースライン）を指定すると比較を行い、しきい値を超えて遅くなった
+ベンチマークがあれば終了コード1を返します。
+
+使用例:
+    python -m benchmarks.run --save benchmarks/baseline.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json
+    python -m benchmarks.run --no-stages --executors process,thread,hybrid --recognize-delay 0.05
+    python -m benchmarks.run --filter "serve[" --serve-clients 16 --recognize-delay 0.02
+"""
+
+import argparse
+import datetime
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from ocr.formatter import format_ocr_text
+from ocr.table import detect_and_convert_tables
+from ocr.layout import analyze_and_convert_layout
+from ocr.markdown import convert_to_markdown
+from ocr.core import render_observations, initialize_worker
+from ocr.backend import ReplayBackend
+from ocr.scheduler import get_process_context
+from ocr.metrics import percentile
+
+from .corpus import generate_observations, write_corpus
+
+CONVERSION_LEVELS = ('conservative', 'moderate', 'aggressive')
+EXECUTORS = ('process', 'thread', 'hybrid')
+
+# 比較の既定のしきい値（ベースラインに対して何割遅くなったら回帰とみなすか）
+# 比較には、他のプロセスの影響を受けにくい最小値を使用する
+DEFAULT_THRESHOLD = 0.25
+
+# 実行時間のばらつきが大きいベンチマークのしきい値
+_THRESHOLDS = {'batch': 0.5, 'startup': 0.5, 'spinup': 0.5, 'serve': 0.5}
+
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_MAIN_SCRIPT = os.path.join(_ROOT_DIR, 'main.py')
+
+def measure(fn, repeat=5):
+    """
+    関数の1回あたりの実行時間を計測する
+
+    1回の計測が0.2秒以上になるよう繰り返し回数を自動で決め、それを repeat 回行う。
+
+    Returns:
+    --------
+    dict
+        'median', 'min'（1回あたりの秒数）, 'loops', 'repeat' を含む辞書
+    """
+    timer = timeit.Timer(fn)
+    loops, _ = timer.autorange()
+    times = [elapsed / loops for elapsed in timer.repeat(repeat=repeat, number=loops)]
+    return {'median': statistics.median(times), 'min': min(times), 'loops': loops, 'repeat': repeat}
+
+def iter_stage_benchmarks(line_count, seed):
+    """
+    後処理の各段階のベンチマークを (名前, 関数) の組で返す
+
+    表・レイアウト・Markdownの変換には、実際の処理と同じく整形済みのテキストを渡す。
+    """
+    observations = generate_observations(line_count, seed)
+    raw_text = "".join(observation['text'] + "\n" for observation in observations)
+    formatted_text = format_ocr_text(raw_text)
+
+    yield 'format_ocr_text', lambda: format_ocr_text(raw_text)
+    yield 'convert_to_markdown', lambda: convert_to_markdown(formatted_text)
+    for level in CONVERSION_LEVELS:
+        yield (f'detect_and_convert_tables[{level}]',
+               lambda level=level: detect_and_convert_tables(formatted_text, level))
+        yield (f'analyze_and_convert_layout[{level}]',
+               lambda level=level: analyze_and_convert_layout(formatted_text, observations, level))
+        yield (f'render_observations[{level}]',
+               lambda level=level: render_observations(observations, True, True, True, level))
+
+def run_batch(pages, line_count, seed, workers, repeat=3, executor='process', delay=0.0):
+    """
+    合成コーパスを ReplayBackend で再生し、main.py のバッチ処理全体の実行時間を計測する
+
+    インタプリタの起動とワーカープロセスの作成を含めて計測するため、別プロセスで実行する。
+    delay を指定すると、認識1回ごとにその秒数だけ待機し（GILを解放する）、認識処理を模擬する。
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        image_dir = os.path.join(work_dir, 'images')
+        record_dir = os.path.join(work_dir, 'records')
+        write_corpus(image_dir, record_dir, pages, line_count, seed)
+
+        times = []
+        for attempt in range(repeat):
+            command = [sys.executable, _MAIN_SCRIPT, image_dir,
+                       '--replay-dir', record_dir, '--replay-delay', str(delay), '--executor', executor,
+                       '--combine', '--detect-tables', '--analyze-layout', '--quiet',
+                       '--output_dir', os.path.join(work_dir, f'output{attempt}')]
+            if workers:
+                command += ['--workers', str(workers)]
+            started_at = timeit.default_timer()
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+            times.append(timeit.default_timer() - started_at)
+    return {'median': statistics.median(times), 'min': min(times), 'loops': 1, 'repeat': repeat}
+
+def run_command(command, repeat=5):
+    """コマンドの実行時間（インタプリタの起動を含む）を計測する"""
+    times = []
+    for _ in range(repeat):
+        started_at = timeit.default_timer()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, cwd=_ROOT_DIR)
+        times.append(timeit.default_timer() - started_at)
+    return {'median': statistics.median(times), 'min': min(times), 'loops': 1, 'repeat': repeat}
+
+def run_spin_up(start_method, workers, repeat=5):
+    """
+    ワーカープロセスのプールの起動時間を計測する
+
+    main.py と同じく、フォークサーバーの起動（forkserverの場合）を含めて計測するため、
+    計測ごとに別プロセスで spin_up() を実行し、その中で計測した時間を使用する。
+    """
+    code = f"from benchmarks.run import spin_up; print(spin_up({start_method!r}, {workers}))"
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True,
+                                text=True, cwd=_ROOT_DIR).stdout
+        times.append(float(output.split()[-1]))
+    return {'median': statistics.median(times), 'min': min(times), 'loops': 1, 'repeat': repeat}
+
+def spin_up(start_method, workers):
+    """プールを作成し、すべてのワーカーがバックエンドを準備して最初のタスクを返すまでの秒数を返す"""
+    started_at = timeit.default_timer()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_process_context(start_method),
+                             initializer=initialize_worker, initargs=(ReplayBackend(_ROOT_DIR),)) as executor:
+        list(executor.map(_ready, range(workers)))
+    return timeit.default_timer() - started_at
+
+def _ready(_):
+    return os.getpid()
+
+def iter_startup_benchmarks(workers):
+    """起動時間のベンチマークを (名前, 計測する関数) の組で返す"""
+    yield 'startup[import]', lambda repeat: run_command([sys.executable, '-c', 'import ocr'], repeat)
+    yield 'startup[help]', lambda repeat: run_command([sys.executable, _MAIN_SCRIPT, '--help'], repeat)
+    for start_method in multiprocessing.get_all_start_methods():
+        yield f'spinup[{start_method}]', lambda repeat, start_method=start_method: run_spin_up(start_method, workers, repeat)
+
+def run_serve_load(workers, clients, requests, delay=0.0, repeat=3):
+    """
+    サーバーモードをスタブの認識処理で起動し、同時に clients 件ずつリクエストを送って遅延を計測する
+
+    遅延はクライアント側で、リクエストの送信から応答の受信までを計測する。
+    計測ごとに requests 件のリクエストを送り、p50 を結果の値（median, min）とする。
+
+    Returns:
+    --------
+    dict
+        'median', 'min'（p50の秒数）, 'p95', 'max', 'loops'（1回の計測のリクエスト数）, 'repeat' を含む辞書
+    """
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    with tempfile.TemporaryDirectory() as work_dir:
+        # スタブはファイルの存在だけを確認するため、内容は画像でなくてよい
+        image_path = os.path.join(work_dir, 'image.png')
+        with open(image_path, 'wb') as f:
+            f.write(b'\x89PNG\r\n\x1a\n')
+        command = [sys.executable, _MAIN_SCRIPT, 'serve', '--stub', '--replay-delay', str(delay),
+                   '--port', str(port), '--quiet']
+        if workers:
+            command += ['--workers', str(workers)]
+        process = subprocess.Popen(command, cwd=_ROOT_DIR, stdout=subprocess.DEVNULL)
+        try:
+            _wait_for_server(port)
+            body = json.dumps({'path': image_path})
+            p50s, p95s, maxima = [], [], []
+            with ThreadPoolExecutor(max_workers=clients) as executor:
+                for _ in range(repeat):
+                    latencies = sorted(executor.map(lambda _: _post_latency(port, body), range(requests)))
+                    p50s.append(percentile(latencies, 0.5))
+                    p95s.append(percentile(latencies, 0.95))
+                    maxima.append(latencies[-1])
+        finally:
+            process.terminate()
+            process.wait()
+    return {'median': statistics.median(p50s), 'min': min(p50s), 'p95': statistics.median(p95s),
+            'max': max(maxima), 'loops': requests, 'repeat': repeat}
+
+def _wait_for_server(port, timeout=30.0):
+    """サーバーが /health に応答するまで待つ"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/health')
+            if connection.getresponse().status == 200:
+                connection.close()
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+        time.sleep(0.05)
+
+def _post_latency(port, body):
+    """1件のリクエストを送り、応答を受け取るまでの秒数を返す"""
+    started_at = timeit.default_timer()
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    connection.request('POST', '/ocr', body, {'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    if response.status != 200:
+        raise RuntimeError(f"サーバーがエラーを返しました: {response.status}")
+    return timeit.default_timer() - started_at
+
+def threshold_for(name, thresholds):
+    """ベンチマーク名に対応するしきい値を返す（名前の '[' より前の部分でも検索する）"""
+    for key in (name, name.split('[')[0]):
+        if key in thresholds:
+            return thresholds[key]
+    return thresholds.get('default', DEFAULT_THRESHOLD)
+
+def compare(results, baseline):
+    """
+    結果をベースラインと比較し、比較結果を表示する
+
+    Returns:
+    --------
+    list
+        しきい値を超えて遅くなったベンチマークの名前のリスト
+    """
+    thresholds = baseline.get('thresholds', {})
+    regressions = []
+    print(f"\n{'benchmark':<44}{'baseline':>14}{'current':>14}{'ratio':>8}")
+    for name, result in results.items():
+        base = baseline.get('results', {}).get(name)
+        if base is None:
+            print(f"{name:<44}{'-':>14}{result['min'] * 1000:>12.2f}ms{'新規':>8}")
+            continue
+        ratio = result['min'] / base['min'] if base['min'] > 0 else float('inf')
+        limit = 1 + threshold_for(name, thresholds)
+        mark = "  回帰" if ratio > limit else ""
+        print(f"{name:<44}{base['min'] * 1000:>12.2f}ms{result['min'] * 1000:>12.2f}ms{ratio:>8.2f}{mark}")
+        if ratio > limit:
+            regressions.append(name)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='合成コーパスを使って後処理とバッチ処理の性能を計測する')
+    parser.add_argument('--lines', type=int, default=2000, help='1ページあたりの観測値の数（デフォルト: 2000）')
+    parser.add_argument('--pages', type=int, default=50, help='バッチ処理の計測に使用するページ数（デフォルト: 50）')
+    parser.add_argument('--seed', type=int, default=0, help='合成コーパスのシード値（デフォルト: 0）')
+    parser.add_argument('--repeat', type=int, default=5, help='各ベンチマークの計測回数（デフォルト: 5）')
+    parser.add_argument('--workers', type=int, default=0, help='バッチ処理のワーカー数（デフォルト: CPUコア数）')
+    parser.add_argument('--filter', help='名前にこの文字列を含むベンチマークだけを実行する')
+    parser.add_argument('--no-batch', action='store_true', help='main.py のバッチ処理を計測しない')
+    parser.add_argument('--no-stages', action='store_true', help='後処理の各段階を計測しない')
+    parser.add_argument('--no-startup', action='store_true', help='起動時間を計測しない')
+    parser.add_argument('--no-serve', action='store_true', help='サーバーモードの遅延を計測しない')
+    parser.add_argument('--serve-clients', type=int, default=8,
+                        help='サーバーモードの計測で同時にリクエストを送るクライアント数（デフォルト: 8）')
+    parser.add_argument('--serve-requests', type=int, default=200,
+                        help='サーバーモードの1回の計測で送るリクエスト数（デフォルト: 200）')
+    parser.add_argument('--executors', default='process',
+                        help='バッチ処理を計測する実行方式（カンマ区切り、デフォルト: process）')
+    parser.add_argument('--recognize-delay', type=float, default=0.0,
+                        help='バッチ処理で認識1回ごとに待機する秒数（認識処理の模擬、デフォルト: 0）')
+    parser.add_argument('--save', help='結果を保存するJSONファイル')
+    parser.add_argument('--baseline', help='比較するベースラインのJSONファイル')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='保存する結果に記録する既定のしきい値（デフォルト: 0.25 = 25%%遅くなったら回帰）')
+    args = parser.parse_args(argv)
+
+    executors = [name.strip() for name in args.executors.split(',') if name.strip()]
+    for executor in executors:
+        if executor not in EXECUTORS:
+            parser.error(f"不明な実行方式です: {executor}（{', '.join(EXECUTORS)} から選択してください）")
+
+    results = {}
+    if not args.no_stages:
+        for name, fn in iter_stage_benchmarks(args.lines, args.seed):
+            if args.filter and args.filter not in name:
+                continue
+            results[name] = measure(fn, args.repeat)
+            print(f"{name:<44}{results[name]['min'] * 1000:>10.2f}ms")
+
+    if not args.no_startup:
+        for name, fn in iter_startup_benchmarks(args.workers or os.cpu_count()):
+            if args.filter and args.filter not in name:
+                continue
+            results[name] = fn(args.repeat)
+            print(f"{name:<44}{results[name]['min'] * 1000:>10.2f}ms")
+
+    if not args.no_batch:
+        for executor in executors:
+            name = f'batch[{executor}]'
+            if args.filter and args.filter not in name:
+                continue
+            results[name] = run_batch(args.pages, args.lines // 10, args.seed, args.workers,
+                                      executor=executor, delay=args.recognize_delay)
+            print(f"{name:<44}{results[name]['min'] * 1000:>10.2f}ms")
+
+    if not args.no_serve:
+        name = f'serve[clients={args.serve_clients}]'
+        if not args.filter or args.filter in name:
+            results[name] = run_serve_load(args.workers, args.serve_clients, args.serve_requests,
+                                           delay=args.recognize_delay)
+            print(f"{name:<44}{results[name]['min'] * 1000:>10.2f}ms"
+                  f"（p95 {results[name]['p95'] * 1000:.2f}ms）")
+
+    report = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(),
+            'cpu_count': os.cpu_count()
+        },
+        'parameters': {'lines': args.lines, 'pages': args.pages, 'seed': args.seed,
+                       'recognize_delay': args.recognize_delay},
+        'results': results,
+        'thresholds': dict(_THRESHOLDS, default=args.threshold)
+    }
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n結果を保存しました: {args.save}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('parameters') != report['parameters']:
+            print("警告: ベースラインと計測条件（--lines, --pages, --seed, --recognize-delay）が異なります")
+        regressions = compare(results, baseline)
+        if regressions:
+            print(f"\n性能が低下したベンチマーク: {', '.join(regressions)}")
+            return 1
+        print("\n性能の低下は検出されませんでした。")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
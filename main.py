@@ -2,16 +2,44 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import logging
 import os
+import signal
+import sys
 import time
-import shutil
 import datetime
+import itertools
+import functools
 import multiprocessing
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from ocr.core import process_image
-from utils import get_image_files
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from ocr.core import try_recognize_page, initialize_worker, prepare_backend, combine_pages
+from ocr.page import OCRPage
+from ocr.backend import VisionBackend, ReplayBackend, RecordingBackend, StubBackend
+from ocr.cache import ObservationCache, CachedBackend, remember_file_digest
+from ocr.tiling import TiledBackend
+from ocr.normalize import NormalizingBackend
+from ocr.dedupe import group_duplicates, perceptual_available, DEFAULT_MAX_DISTANCE
+from ocr.sidecar import sidecar_path, write_sidecar, read_sidecar, iter_sidecar_documents
+from ocr.scheduler import BoundedScheduler, PipelineExecutor, MicroBatcher, prefetch, get_process_context, default_start_method
+from ocr import metrics
+from ocr.metrics import MetricsAggregator
+from utils import iter_image_files, MULTI_PAGE_EXTENSIONS
+from writer import ResultWriter
+from watcher import FolderWatcher
+from reporting import Reporter, initialize_worker_logging
 
-def process_single_image(args_dict):
+logger = logging.getLogger(__name__)
+
+def initialize_process(backend, log_queue, log_level):
+    """
+    ワーカープロセスの初期化処理（ログをメインプロセスに送るよう設定してから、バックエンドを準備する）
+    """
+    initialize_worker_logging(log_queue, log_level)
+    initialize_worker(backend)
+
+def process_single_image(args_dict, backend=None):
     """
     単一の画像を処理する関数（並列処理用）
     
@@ -19,87 +47,468 @@ def process_single_image(args_dict):
     -----------
     args_dict : dict
         処理に必要なパラメータを含む辞書
+    backend : OCRBackend
+        使用するOCRバックエンド（指定しない場合はワーカープロセスの既定のバックエンド）
     
     Returns:
     --------
     tuple
-        (index, image_file, text) のタプル
+        (index, image_file, text, record) のタプル
+        （record は段階ごとの処理時間の記録。計測しない場合はNone）
+    """
+    return render_single_image(recognize_single_image(args_dict, backend))
+
+def recognize_single_image(args_dict, backend=None):
+    """
+    単一の画像を認識する関数（複合モードではスレッドで実行する）
+    
+    backend は process_single_image を参照。
+    
+    Returns:
+    --------
+    tuple
+        (args_dict, result, record) のタプル
+        （result は OCRPage または失敗を示すテキスト、例外が発生した場合はNone）
     """
-    index = args_dict['index']
     image_file = args_dict['image_path']
-    print(f"処理中: {os.path.basename(image_file)}")
+    page = args_dict.get('page')
+    if page is None:
+        logger.debug(f"処理中: {os.path.basename(image_file)}")
+    else:
+        logger.debug(f"処理中: {os.path.basename(image_file)} (ページ {page + 1}/{args_dict['page_count']})")
     
+    if args_dict.get('collect_metrics'):
+        metrics.start_record(image_file, page)
+    if args_dict.get('digest'):
+        # 重複の検出で計算した内容ハッシュを再利用する（キャッシュや前処理でファイルを再び読み込まない）
+        remember_file_digest(args_dict['digest'])
     try:
         # OCR処理
-        text = process_image(
-            image_path=image_file,
-            format_text=args_dict['format_text'],
-            detect_tables=args_dict['detect_tables'],
-            analyze_layout=args_dict['analyze_layout'],
-            conversion_level=args_dict['conversion_level']
-        )
-        return (index, image_file, text)
+        result = try_recognize_page(image_file, backend, page)
     except Exception as e:
-        print(f"エラー: 画像 {os.path.basename(image_file)} の処理中に例外が発生しました: {str(e)}")
-        return (index, image_file, None)
+        logger.error(f"エラー: 画像 {os.path.basename(image_file)} の処理中に例外が発生しました: {str(e)}")
+        result = None
+    if result is not None and args_dict.get('sidecar_dir'):
+        save_sidecar(args_dict, result)
+    return (args_dict, result, metrics.finish_record())
 
-def main():
+def save_sidecar(args_dict, result):
     """
-    メイン関数：コマンドライン引数の処理とOCR処理の実行
+    認識結果をサイドカーとして保存する（rerender で後処理だけをやり直すため）
+    
+    認識に失敗した場合も、失敗を示すテキストを保存し、再作成した結果が元の結果と一致するようにする。
+    重複の検出で同じグループにまとめた画像（args_dict['duplicates']）にも、それぞれのパスで保存する。
+    """
+    page = args_dict.get('page')
+    for image_file in [args_dict['image_path']] + args_dict.get('duplicates', []):
+        path = sidecar_path(args_dict['sidecar_dir'], image_file, page, args_dict.get('sidecar_relative_to'))
+        try:
+            with metrics.stage('sidecar'):
+                if isinstance(result, OCRPage):
+                    if result.image_path != image_file:
+                        result = OCRPage(result.texts, result.x, result.y, result.width, result.height,
+                                         result.confidence, image_path=image_file, page=result.page)
+                    write_sidecar(path, result, args_dict.get('page_count'))
+                else:
+                    write_sidecar(path, None, args_dict.get('page_count'), image_file, page, message=result)
+        except Exception as e:
+            logger.warning(f"警告: サイドカーを保存できませんでした: {path}: {str(e)}")
+
+def render_single_image(recognized):
+    """
+    認識結果を後処理する関数（複合モードではプロセスで実行する）
+    
+    Parameters:
+    -----------
+    recognized : tuple
+        recognize_single_image の戻り値
+    
+    Returns:
+    --------
+    tuple
+        (index, image_file, text, record) のタプル
+    """
+    args_dict, result, record = recognized
+    image_file = args_dict['image_path']
+    if record is not None:
+        metrics.start_record(image_file, args_dict.get('page'), record)
+    text = result
+    if isinstance(result, OCRPage):
+        try:
+            text = result.render(args_dict['format_text'], args_dict['detect_tables'],
+                                 args_dict['analyze_layout'], args_dict['conversion_level'])
+        except Exception as e:
+            logger.error(f"エラー: 画像 {os.path.basename(image_file)} の処理中に例外が発生しました: {str(e)}")
+            text = None
+    return (args_dict['index'], image_file, text, metrics.finish_record())
+
+@contextmanager
+def open_executor(mode, num_workers, backend, reporter, render_workers=0, start_method=None):
+    """
+    実行方式に応じたExecutorと、各タスクで実行する関数を返す
+    
+    Parameters:
+    -----------
+    mode : str
+        'process'（認識と後処理をプロセスプールで実行）、
+        'thread'（認識と後処理をスレッドプールで実行し、バックエンドをスレッド間で共有）、
+        'hybrid'（認識をスレッドプール、後処理をプロセスプールで実行）
+    num_workers : int
+        ワーカー数（hybridの場合は認識のスレッド数）
+    backend : OCRBackend
+        使用するOCRバックエンド
+    reporter : Reporter
+        ワーカープロセスのログの送り先
+    render_workers : int
+        hybridの場合の後処理のプロセス数（0の場合はCPUコア数の半分）
+    start_method : str
+        ワーカープロセスの起動方法（get_process_context を参照）
+    
+    Yields:
+    -------
+    tuple
+        (executor, fn) のタプル（BoundedScheduler に渡す）
+    """
+    if mode == 'process':
+        # 各ワーカーはinitializerでバックエンドとログの転送を準備し、すべての画像で再利用する
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=get_process_context(start_method),
+                                 initializer=initialize_process,
+                                 initargs=(backend, reporter.log_queue, reporter.level)) as executor:
+            yield executor, process_single_image
+        return
+    
+    # 認識はネイティブの処理でGILを解放するため、スレッドで並列に実行できる
+    # バックエンド（フレームワークと認識モデル）は1つだけ準備し、このExecutorのタスクに渡して共有する
+    # （プロセス内の既定のバックエンドは変更しない）
+    backend = prepare_backend(backend)
+    with ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='ocr') as threads:
+        if mode == 'thread':
+            yield threads, functools.partial(process_single_image, backend=backend)
+            return
+        # CPUを使う後処理は、GILの影響を受けないよう少数のプロセスで実行する
+        render_workers = render_workers or max(1, multiprocessing.cpu_count() // 2)
+        with ProcessPoolExecutor(max_workers=render_workers, mp_context=get_process_context(start_method),
+                                 initializer=initialize_worker_logging,
+                                 initargs=(reporter.log_queue, reporter.level)) as processes:
+            yield (PipelineExecutor(threads, processes, render_single_image),
+                   functools.partial(recognize_single_image, backend=backend))
+
+def rerender_page(path, args_dict):
+    """
+    サイドカーから1ページ分の結果を読み込み、後処理をやり直す
+    
+    Returns:
+    --------
+    tuple
+        (header, text, record) のタプル
+        （サイドカーを読み込めなかった場合、header はNone。後処理に失敗した場合、text はNone）
+    """
+    try:
+        page, header = read_sidecar(path)
+    except Exception as e:
+        logger.warning(f"警告: サイドカーを読み込めませんでした: {path}: {str(e)}")
+        return None, None, None
+    if args_dict.get('collect_metrics'):
+        metrics.start_record(header['image_path'], header['page'])
+    text = header['message']
+    if text is None:
+        try:
+            text = page.render(args_dict['format_text'], args_dict['detect_tables'],
+                               args_dict['analyze_layout'], args_dict['conversion_level'])
+        except Exception as e:
+            logger.error(f"エラー: 画像 {os.path.basename(header['image_path'])} の処理中に例外が発生しました: {str(e)}")
+            text = None
+    return header, text, metrics.finish_record()
+
+def rerender_documents(args_dict):
+    """
+    サイドカーの結果の後処理をまとめてやり直す関数（並列処理用）
+    
+    認識を行わないため1件あたりの処理は短く、タスクごとの受け渡しの負荷を抑えるよう
+    複数の文書（画像）をまとめて1つのタスクとして処理する。
+    
+    Parameters:
+    -----------
+    args_dict : dict
+        後処理のパラメータと、'documents'（(index, 相対ディレクトリ, サイドカーのパスのリスト) のリスト）を含む辞書
+    
+    Returns:
+    --------
+    list
+        文書ごとの (index, image_file, text, relative_dir, records) のタプルのリスト
+    """
+    results = []
+    for index, relative_dir, paths in args_dict['documents']:
+        image_file = None
+        text = None
+        page_texts = None
+        records = []
+        for path in paths:
+            header, page_text, record = rerender_page(path, args_dict)
+            if header is None:
+                continue
+            image_file = header['image_path']
+            if record is not None:
+                records.append(record)
+            if header['page'] is None:
+                text = page_text
+                continue
+            # 複数ページの画像は、すべてのページを1つの結果にまとめる（サイドカーのないページは失敗として扱う）
+            if page_texts is None:
+                page_texts = [None] * max(header['page_count'] or 0, header['page'] + 1)
+            elif header['page'] >= len(page_texts):
+                page_texts.extend([None] * (header['page'] + 1 - len(page_texts)))
+            page_texts[header['page']] = page_text
+        if page_texts is not None and any(page_text is not None for page_text in page_texts):
+            text = combine_pages(page_texts)
+        results.append((index, image_file or paths[0], text, relative_dir, records))
+    return results
+
+def find_duplicates(image_files, perceptual, max_distance, num_workers):
+    """
+    画像を同じ内容のグループにまとめ、認識する代表の画像と、結果を共有する画像を返す
+    
+    Returns:
+    --------
+    tuple
+        (代表の画像の (インデックス, 画像ファイル) のリスト,
+         代表の画像のインデックス -> 同じグループの (インデックス, 画像ファイル) のリスト の辞書,
+         画像 -> 内容ハッシュの記録（file_digest_record の結果）の辞書)
+    """
+    if perceptual and not perceptual_available():
+        logger.warning("警告: 知覚ハッシュにはQuartzが必要です。内容が完全に一致する画像だけをまとめます")
+        perceptual = False
+    started_at = time.perf_counter()
+    digests = {}
+    groups = group_duplicates(image_files, perceptual, max_distance, max_workers=num_workers * 2, digests=digests)
+    indexes = {image_file: i for i, image_file in enumerate(image_files)}
+    representatives = []
+    duplicates = {}
+    for group in groups:
+        index = indexes[group[0]]
+        representatives.append((index, group[0]))
+        if len(group) > 1:
+            duplicates[index] = [(indexes[image_file], image_file) for image_file in group[1:]]
+    logger.info(f"重複の検出: {len(image_files)}件の画像のうち、{len(image_files) - len(groups)}件は"
+                f"他の画像と同じ内容のため認識を省略します（{time.perf_counter() - started_at:.2f}秒）")
+    return representatives, duplicates, digests
+
+def count_pages(backend, image_file):
+    """
+    画像のページ数を返す（複数ページを含む可能性のない形式や、取得に失敗した場合は1）
+    """
+    if os.path.splitext(image_file)[1].lower() not in MULTI_PAGE_EXTENSIONS:
+        return 1
+    try:
+        return max(1, backend.page_count(image_file))
+    except Exception as e:
+        logger.warning(f"警告: ページ数を取得できませんでした: {os.path.basename(image_file)}: {str(e)}")
+        return 1
+
+def add_render_arguments(parser):
+    """
+    後処理（整形・表・レイアウト・Markdown）の設定のコマンドライン引数を追加する
     """
-    # コマンドライン引数の設定
-    parser = argparse.ArgumentParser(description='AppleのVisionフレームワークを使ったOCR')
-    parser.add_argument('input_dir', help='画像ファイルが含まれるディレクトリ')
-    parser.add_argument('--output_dir', help='テキストファイルの出力先ディレクトリ（指定しない場合は入力ディレクトリ直下の日時フォルダ）')
     parser.add_argument('--raw', action='store_true', help='OCR結果をそのまま出力（テキスト整形を行わない）')
-    parser.add_argument('--combine', action='store_true', help='すべての画像のOCR結果を1つのファイルに統合する')
-    parser.add_argument('--combine_file', help='統合ファイルの名前（指定しない場合は日時分秒）')
-    parser.add_argument('--with-headers', action='store_true', help='統合ファイルにファイル名のヘッダーを追加する')
-    parser.add_argument('--with-separators', action='store_true', help='統合ファイルにセパレータ（罫線）を追加する')
-    parser.add_argument('--move-processed', action='store_true', help='処理済みの画像を_processedフォルダに移動する')
     
     # 第3段階の機能のオプション
     parser.add_argument('--detect-tables', action='store_true', help='表の検出と変換を有効にする')
     parser.add_argument('--analyze-layout', action='store_true', help='複雑なレイアウト解析を有効にする')
     parser.add_argument('--conversion-level', choices=['conservative', 'moderate', 'aggressive'], 
                         default='conservative', help='変換の積極性レベル（デフォルト: conservative）')
-    
-    # 並列処理のオプション
+
+def add_worker_arguments(parser):
+    """
+    ワーカープロセスのコマンドライン引数を追加する
+    """
     parser.add_argument('--workers', type=int, default=0, 
                         help='並列処理に使用するワーカー数（デフォルト: CPUコア数）')
+    parser.add_argument('--start-method', choices=multiprocessing.get_all_start_methods(), default=default_start_method(),
+                        help=f'ワーカープロセスの起動方法（デフォルト: {default_start_method()}。'
+                             'forkserverの場合は、モジュールを読み込み済みのプロセスからワーカーを起動する）')
+
+def add_logging_arguments(parser):
+    """
+    メッセージの出力量のコマンドライン引数を追加する
+    """
+    parser.add_argument('-q', '--quiet', action='store_true', help='警告とエラーだけを出力する（進捗を表示しない）')
+    parser.add_argument('-v', '--verbose', action='store_true', help='画像ごとの処理状況も出力する')
+
+def add_output_arguments(parser):
+    """
+    後処理と出力に関するコマンドライン引数（ファイルに出力するすべてのコマンドで共通）を追加する
+    """
+    parser.add_argument('--output_dir', help='テキストファイルの出力先ディレクトリ（指定しない場合は入力ディレクトリ直下の日時フォルダ）')
+    parser.add_argument('--combine', action='store_true', help='すべての画像のOCR結果を1つのファイルに統合する')
+    parser.add_argument('--combine_file', help='統合ファイルの名前（指定しない場合は日時分秒）')
+    parser.add_argument('--with-headers', action='store_true', help='統合ファイルにファイル名のヘッダーを追加する')
+    parser.add_argument('--with-separators', action='store_true', help='統合ファイルにセパレータ（罫線）を追加する')
+    add_render_arguments(parser)
+    
+    # 並列処理のオプション
+    add_worker_arguments(parser)
     
-    args = parser.parse_args()
+    # 出力のオプション
+    add_logging_arguments(parser)
+    parser.add_argument('--events', metavar='PATH',
+                        help='処理のイベントをJSONL形式で出力するファイル（- の場合は標準出力。その他の出力は標準エラー出力になる）')
     
-    # 入力ディレクトリの確認
-    if not os.path.isdir(args.input_dir):
-        print(f"エラー: 指定されたディレクトリが存在しません: {args.input_dir}")
-        return 1
+    # 処理時間の計測のオプション
+    parser.add_argument('--metrics-json', help='段階ごとの処理時間（p50/p95/最大）の集計結果を保存するJSONファイル')
+    parser.add_argument('--metrics-prom', help='集計結果をPrometheusのテキスト形式で保存するファイル（node_exporterのtextfileコレクタ用）')
+
+def add_backend_arguments(parser):
+    """
+    OCRバックエンド（認識・キャッシュ・前処理・タイル分割）のコマンドライン引数を追加する
+    """
+    parser.add_argument('--replay-dir', help='Visionの代わりに、このディレクトリに記録された観測値（JSONL）を使用する')
+    parser.add_argument('--stub', action='store_true',
+                        help='Visionの代わりに、画像にかかわらず固定の観測値を返すスタブを使用する（負荷試験・遅延の計測用）')
+    parser.add_argument('--replay-delay', type=float, default=0.0,
+                        help='リプレイ・スタブ時に認識1回ごとに待機する秒数（認識時間を模擬するベンチマーク用、デフォルト: 0）')
+    parser.add_argument('--record-dir', help='認識した観測値をこのディレクトリにJSONL形式で記録する')
+    parser.add_argument('--cache-dir', help='観測値キャッシュのディレクトリ（同じ画像・設定の再認識を省略する）')
+    parser.add_argument('--cache-size-mb', type=int, default=1024,
+                        help='観測値キャッシュの上限サイズ（MB、デフォルト: 1024）')
     
-    # 画像ファイルの取得
-    image_files = get_image_files(args.input_dir)
+    # 前処理（大きな画像の縮小）のオプション
+    parser.add_argument('--normalize-dir', help='大きな画像を縮小した派生画像の保存先（指定すると認識前に縮小する）')
+    parser.add_argument('--max-dimension', type=int, default=4096,
+                        help='縮小後の長辺の上限（ピクセル、デフォルト: 4096、0 = 長辺では縮小しない）')
+    parser.add_argument('--target-dpi', type=int, default=0,
+                        help='解像度がこの値を超える画像を縮小する（デフォルト: 0 = 解像度では縮小しない）')
+    parser.add_argument('--keep-color', action='store_true', help='派生画像をグレースケールに変換しない')
     
-    if not image_files:
-        print(f"警告: 指定されたディレクトリに画像ファイルが見つかりませんでした: {args.input_dir}")
-        return 0
+    # 大きな画像のタイル分割のオプション
+    parser.add_argument('--tile-size', type=int, default=0,
+                        help='幅または高さがこの大きさ（ピクセル）を超える画像をタイルに分割して認識する（デフォルト: 0 = 分割しない）')
+    parser.add_argument('--tile-overlap', type=int, default=256,
+                        help='隣り合うタイルの重なりの幅（ピクセル、デフォルト: 256）')
+    parser.add_argument('--tile-workers', type=int, default=0,
+                        help='1枚の画像で同時に認識するタイルの最大数（デフォルト: CPUコア数）')
+
+def add_processing_arguments(parser):
+    """
+    バッチ処理と監視モードで共通のコマンドライン引数を追加する
+    """
+    add_output_arguments(parser)
+    parser.add_argument('--move-processed', action='store_true', help='処理済みの画像を_processedフォルダに移動する')
     
-    # 現在の日時を取得（フォルダ名とファイル名に使用）
-    now = datetime.datetime.now()
-    timestamp = now.strftime("%Y%m%d_%H%M%S")
+    # 並列処理のオプション
+    parser.add_argument('--in-flight-per-worker', type=int, default=2,
+                        help='ワーカー1つあたりの同時投入タスク数の上限（デフォルト: 2）')
+    parser.add_argument('--executor', choices=['process', 'thread', 'hybrid'], default='process',
+                        help='実行方式（process: プロセスプール、thread: スレッドプール、'
+                             'hybrid: 認識はスレッド・後処理はプロセス、デフォルト: process）')
+    parser.add_argument('--render-workers', type=int, default=0,
+                        help='hybridの場合の後処理のプロセス数（デフォルト: CPUコア数の半分）')
+    
+    # OCRバックエンドのオプション
+    add_backend_arguments(parser)
+    
+    # サイドカーのオプション
+    parser.add_argument('--sidecar-dir',
+                        help='認識結果（テキスト・位置・信頼度）をサイドカーとして保存するディレクトリ'
+                             '（rerender コマンドで認識せずに後処理だけをやり直せる）')
+
+def create_backend(args):
+    """
+    コマンドライン引数からOCRバックエンドを作成する
+    
+    Returns:
+    --------
+    tuple
+        (backend, cache) のタプル（キャッシュを使用しない場合、cacheはNone）
+    """
+    if args.replay_dir:
+        backend = ReplayBackend(args.replay_dir, delay=args.replay_delay)
+        logger.info(f"リプレイモード: {args.replay_dir} の観測値を使用します")
+    elif args.stub:
+        backend = StubBackend(delay=args.replay_delay)
+        logger.info(f"スタブモード: 固定の観測値を返します（待機時間: {args.replay_delay}秒）")
+    else:
+        backend = VisionBackend()
+        if args.normalize_dir:
+            backend = NormalizingBackend(backend, args.normalize_dir, max_dimension=args.max_dimension or None,
+                                         target_dpi=args.target_dpi or None, grayscale=not args.keep_color)
+            logger.info(f"前処理: 大きな画像を縮小した派生画像を {args.normalize_dir} に保存して認識します")
+    if args.record_dir:
+        backend = RecordingBackend(backend, args.record_dir)
+        logger.info(f"観測値の記録: {args.record_dir}")
+    if args.tile_size > 0:
+        backend = TiledBackend(backend, tile_size=args.tile_size, overlap=args.tile_overlap,
+                               max_workers=args.tile_workers or None)
+        logger.info(f"タイル分割: {args.tile_size}pxを超える画像を、重なり{args.tile_overlap}pxのタイルに分割して認識します")
+    cache = None
+    if args.cache_dir:
+        cache = ObservationCache(args.cache_dir, max_bytes=args.cache_size_mb * 1024 * 1024)
+        cache.reset_stats()
+        backend = CachedBackend(backend, cache)
+        logger.info(f"観測値キャッシュ: {cache.path}")
+    return backend, cache
+
+def build_process_args(args):
+    """
+    コマンドライン引数から、各画像の処理パラメータを作成する
+    """
+    return {
+        'format_text': not args.raw,
+        'detect_tables': args.detect_tables,
+        'analyze_layout': args.analyze_layout,
+        'conversion_level': args.conversion_level,
+        'collect_metrics': bool(args.metrics_json or args.metrics_prom),
+        'sidecar_dir': args.sidecar_dir,
+        # サブディレクトリを探索する場合は、サイドカーも入力ディレクトリからの相対ディレクトリ構成で保存する
+        'sidecar_relative_to': args.input_dir if getattr(args, 'recursive', False) else None
+    }
+
+def write_metrics_reports(aggregator, args, extra):
+    """
+    処理時間の集計結果を、指定されたファイルに保存する
+    """
+    try:
+        if args.metrics_json:
+            aggregator.write_json(args.metrics_json, extra)
+        if args.metrics_prom:
+            aggregator.write_prometheus(args.metrics_prom)
+    except Exception as e:
+        logger.warning(f"警告: 処理時間の集計結果を保存できませんでした: {str(e)}")
+
+def print_metrics_summary(aggregator):
+    """
+    段階ごとの処理時間の集計結果を表示する
+    """
+    summary = aggregator.summary()
+    logger.info(f"\n段階ごとの処理時間（{summary['images']}件）:")
+    logger.info(f"  {'stage':<10}{'p50':>10}{'p95':>10}{'max':>10}{'total':>10}")
+    for name, values in summary['stages'].items():
+        logger.info(f"  {name:<10}{values['p50'] * 1000:>8.1f}ms{values['p95'] * 1000:>8.1f}ms"
+              f"{values['max'] * 1000:>8.1f}ms{values['total']:>9.2f}s")
+
+def prepare_output_dirs(input_dir, output_dir_arg, move_processed, timestamp):
+    """
+    出力ディレクトリを作成する
     
+    Returns:
+    --------
+    tuple
+        (timestamp_dir, output_dir, processed_dir) のタプル
+        （処理済み画像を移動しない場合、processed_dirはNone）
+    """
     # 出力ディレクトリの設定
-    if args.output_dir:
+    if output_dir_arg:
         # ユーザー指定の出力ディレクトリを使用
-        base_output_dir = args.output_dir
+        base_output_dir = output_dir_arg
         timestamp_dir = base_output_dir  # タイムスタンプディレクトリは作成しない
     else:
         # デフォルトは入力ディレクトリ直下の日時フォルダ
-        base_output_dir = os.path.join(args.input_dir, timestamp)
+        base_output_dir = os.path.join(input_dir, timestamp)
         timestamp_dir = base_output_dir
         
         # タイムスタンプディレクトリが存在しない場合は作成
         if not os.path.exists(timestamp_dir):
             os.makedirs(timestamp_dir)
-            print(f"タイムスタンプディレクトリを作成しました: {timestamp_dir}")
+            logger.info(f"タイムスタンプディレクトリを作成しました: {timestamp_dir}")
     
     # 出力テキストディレクトリの設定
     output_dir = os.path.join(timestamp_dir, "_output_texts")
@@ -107,34 +516,130 @@ def main():
     # 出力テキストディレクトリが存在しない場合は作成
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-        print(f"出力テキストディレクトリを作成しました: {output_dir}")
+        logger.info(f"出力テキストディレクトリを作成しました: {output_dir}")
     
     # 処理済み画像の移動先ディレクトリ
     processed_dir = None
-    if args.move_processed:
+    if move_processed:
         processed_dir = os.path.join(timestamp_dir, "_processed")
         if not os.path.exists(processed_dir):
             os.makedirs(processed_dir)
-            print(f"処理済み画像ディレクトリを作成しました: {processed_dir}")
+            logger.info(f"処理済み画像ディレクトリを作成しました: {processed_dir}")
+    
+    return timestamp_dir, output_dir, processed_dir
+
+def main(argv=None):
+    """
+    メイン関数：コマンドライン引数の処理とOCR処理の実行
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    
+    # サブコマンドの振り分け
+    if argv and argv[0] == 'watch':
+        return watch_main(argv[1:])
+    if argv and argv[0] == 'rerender':
+        return rerender_main(argv[1:])
+    if argv and argv[0] == 'serve':
+        return serve_main(argv[1:])
+    
+    # コマンドライン引数の設定
+    parser = argparse.ArgumentParser(description='AppleのVisionフレームワークを使ったOCR')
+    parser.add_argument('input_dir', help='画像ファイルが含まれるディレクトリ')
+    add_processing_arguments(parser)
+    
+    # ファイル探索のオプション
+    parser.add_argument('--recursive', action='store_true', help='サブディレクトリの画像も処理する')
+    parser.add_argument('--include', action='append', metavar='PATTERN',
+                        help='処理対象とするファイルのパターン（入力ディレクトリからの相対パス、複数指定可）')
+    parser.add_argument('--exclude', action='append', metavar='PATTERN',
+                        help='除外するファイル・ディレクトリのパターン（入力ディレクトリからの相対パス、複数指定可）')
+    
+    # 重複の検出のオプション
+    parser.add_argument('--dedupe', choices=['exact', 'perceptual'],
+                        help='同じ内容の画像をまとめ、1枚だけを認識して結果を全員の出力に使う'
+                             '（exact: 内容が完全に一致する画像、perceptual: 再圧縮などで見た目だけが一致する画像も含める）')
+    parser.add_argument('--dedupe-distance', type=int, default=DEFAULT_MAX_DISTANCE,
+                        help=f'perceptualの場合に同じ画像とみなす知覚ハッシュの差の上限（256ビット中、デフォルト: {DEFAULT_MAX_DISTANCE}）')
+    
+    args = parser.parse_args(argv)
+    if args.tile_size > 0 and args.tile_overlap >= args.tile_size:
+        parser.error('--tile-overlap は --tile-size より小さくしてください')
+    if args.dedupe_distance < 0:
+        parser.error('--dedupe-distance には0以上の値を指定してください')
+    
+    reporter = Reporter(quiet=args.quiet, verbose=args.verbose, events_path=args.events,
+                        context=get_process_context(args.start_method))
+    try:
+        return run_batch(args, reporter)
+    finally:
+        reporter.close()
+
+def run_batch(args, reporter):
+    """
+    入力ディレクトリの画像をOCR処理する
+    """
+    # 入力ディレクトリの確認
+    if not os.path.isdir(args.input_dir):
+        logger.error(f"エラー: 指定されたディレクトリが存在しません: {args.input_dir}")
+        return 1
+    
+    # 画像ファイルの探索（バックグラウンドで探索し、見つかったものから処理する）
+    image_files = prefetch(iter_image_files(
+        args.input_dir, recursive=args.recursive, include=args.include, exclude=args.exclude,
+        exclude_dirs=[args.output_dir] if args.output_dir else None))
+    first_image = next(image_files, None)
+    
+    if first_image is None:
+        logger.warning(f"警告: 指定されたディレクトリに画像ファイルが見つかりませんでした: {args.input_dir}")
+        return 0
+    
+    # 現在の日時を取得（フォルダ名とファイル名に使用）
+    now = datetime.datetime.now()
+    timestamp = now.strftime("%Y%m%d_%H%M%S")
+    
+    timestamp_dir, output_dir, processed_dir = prepare_output_dirs(
+        args.input_dir, args.output_dir, args.move_processed, timestamp)
     
     # 処理開始時間
     start_time = time.time()
     
-    print(f"処理を開始します。画像ファイル数: {len(image_files)}")
+    logger.info(f"処理を開始します。")
     
     # 拡張機能の状態を表示
     if args.detect_tables:
-        print(f"表の検出と変換: 有効（変換レベル: {args.conversion_level}）")
+        logger.info(f"表の検出と変換: 有効（変換レベル: {args.conversion_level}）")
     if args.analyze_layout:
-        print(f"レイアウト解析: 有効（変換レベル: {args.conversion_level}）")
+        logger.info(f"レイアウト解析: 有効（変換レベル: {args.conversion_level}）")
+    if args.sidecar_dir:
+        logger.info(f"サイドカー: 認識結果を {args.sidecar_dir} に保存します")
     
     # 並列処理のワーカー数を設定
     num_workers = args.workers if args.workers > 0 else multiprocessing.cpu_count()
-    print(f"並列処理: 有効（ワーカー数: {num_workers}）")
+    logger.info(f"並列処理: 有効（ワーカー数: {num_workers}、実行方式: {args.executor}）")
+    
+    # 処理する画像ファイル
+    image_files = itertools.chain([first_image], image_files)
+    if args.combine or args.dedupe:
+        # 統合ファイルはパス順にまとめるため、探索を終えてからパス順に並べて処理する
+        # （インデックスがパス順になり、統合ファイルには並べ替えバッファを通して処理と並行して追記できる）
+        image_files = list(image_files)
+        if args.combine:
+            image_files.sort()
+    
+    # 画像ファイルとインデックス（元の順序を保持するためのインデックス）
+    indexed_files = enumerate(image_files)
+    
+    # 重複の検出（すべての画像のハッシュを先に計算し、グループの代表だけを認識する）
+    duplicates = {}  # 代表の画像のインデックス -> 同じグループの (インデックス, 画像ファイル) のリスト
+    digests = {}  # 代表の画像 -> 内容ハッシュの記録（ワーカーでファイルを再び読み込まないよう渡す）
+    if args.dedupe:
+        indexed_files, duplicates, digests = find_duplicates(
+            image_files, args.dedupe == 'perceptual', args.dedupe_distance, num_workers)
     
     # 統合モードの場合の準備
-    combined_text = ""
     combined_file = None
+    combined_header = ""
     if args.combine:
         # 統合ファイル名の設定（指定がない場合は日時分秒）
         if args.combine_file:
@@ -143,10 +648,10 @@ def main():
             combine_filename = f"{timestamp}.md"
         
         combined_file = os.path.join(output_dir, combine_filename)
-        print(f"統合モード: すべてのテキストを {combined_file} に保存します")
+        logger.info(f"統合モード: すべてのテキストを {combined_file} に保存します")
         
-        # 統合ファイルのMarkdownメタデータ
-        combined_text = f"""---
+        # 統合ファイルのMarkdownメタデータ（画像ファイル数は探索を終えた時点で確定している）
+        combined_header = f"""---
 title: OCR結果統合ファイル
 date: {now.strftime("%Y-%m-%d %H:%M:%S")}
 source_files: {len(image_files)}
@@ -155,108 +660,531 @@ source_files: {len(image_files)}
 """
     
     # 処理パラメータの準備
-    process_args = {
-        'format_text': not args.raw,
-        'detect_tables': args.detect_tables,
-        'analyze_layout': args.analyze_layout,
-        'conversion_level': args.conversion_level
-    }
+    process_args = build_process_args(args)
+    
+    # OCRバックエンドの設定
+    backend, cache = create_backend(args)
+    
+    # 段階ごとの処理時間の集計（ワーカーから結果とともに返された記録を集計する）
+    aggregator = MetricsAggregator() if process_args['collect_metrics'] else None
+    
+    # 結果の書き込みスレッド（完了した順に保存し、統合ファイルにはパス順で処理と並行して追記する）
+    writer = ResultWriter(
+        output_dir, now,
+        processed_dir=processed_dir,
+        combined_file=combined_file,
+        combined_header=combined_header,
+        with_headers=args.with_headers,
+        with_separators=args.with_separators,
+        relative_to=args.input_dir if args.recursive else None,
+        metrics=aggregator,
+        events=reporter.events
+    ).start()
+    
+    reporter.event('start', command='batch', input_dir=args.input_dir, output_dir=timestamp_dir,
+                   workers=num_workers, settings=process_args)
     
     # 並列処理の実行
-    results = []
-    with ProcessPoolExecutor(max_workers=num_workers) as executor:
-        # 各画像ファイルに対して処理を実行（インデックスを付与）
-        futures = []
-        for i, image_file in enumerate(image_files):
-            args_dict = process_args.copy()
-            args_dict['image_path'] = image_file
-            args_dict['index'] = i  # 元の順序を保持するためのインデックス
-            futures.append(executor.submit(process_single_image, args_dict))
+    success_count = 0
+    found_count = 0
+    completed_count = 0
+    discovered = False  # 画像の探索が完了したかどうか（進捗の総数が確定したかどうか）
+    documents = {}  # 複数ページの画像のインデックス -> ページごとの結果（処理中のもののみ）
+    with open_executor(args.executor, num_workers, backend, reporter, args.render_workers,
+                       args.start_method) as (executor, task):
+        # 各画像ファイルの処理パラメータ（インデックスを付与）を必要な分だけ作成する
+        # 複数ページのTIFFはページごとのタスクに分割し、ワーカー間で並列に処理する
+        def iter_tasks():
+            nonlocal found_count, discovered
+            for i, image_file in indexed_files:
+                found_count += 1 + len(duplicates.get(i, ()))
+                page_count = count_pages(backend, image_file)
+                if page_count > 1:
+                    documents[i] = {'texts': [None] * page_count, 'remaining': page_count}
+                for page in (range(page_count) if page_count > 1 else [None]):
+                    args_dict = process_args.copy()
+                    args_dict['image_path'] = image_file
+                    args_dict['index'] = i  # 元の順序を保持するためのインデックス
+                    if i in duplicates:
+                        args_dict['duplicates'] = [path for _, path in duplicates[i]]
+                    if image_file in digests:
+                        args_dict['digest'] = digests[image_file]
+                    if page is not None:
+                        args_dict['page'] = page
+                        args_dict['page_count'] = page_count
+                    yield args_dict
+            discovered = True
+        
+        # 同時に投入するタスク数を「ワーカー数 × 係数」に制限して処理を実行
+        scheduler = BoundedScheduler(executor, task, num_workers * max(1, args.in_flight_per_worker))
         
-        # 結果の収集
-        for i, future in enumerate(as_completed(futures), 1):
+        # 結果の収集（完了したものから書き込みスレッドに渡す）
+        for task, future in scheduler.run(iter_tasks()):
+            index, image_file = task['index'], task['image_path']
+            text = None
             try:
-                index, image_file, text = future.result()
+                index, image_file, text, record = future.result()
+                if aggregator is not None:
+                    aggregator.add_record(record)
+            except Exception as e:
+                logger.error(f"エラー: 処理結果の取得中に例外が発生しました: {str(e)}")
+            
+            # ページのタスクは、すべてのページがそろった時点で1つの結果にまとめる
+            if 'page' in task:
+                document = documents[index]
+                document['texts'][task['page']] = text
+                document['remaining'] -= 1
+                if document['remaining'] > 0:
+                    continue
+                del documents[index]
+                # すべてのページが失敗した場合は、画像全体を失敗として扱う
+                if any(page_text is not None for page_text in document['texts']):
+                    text = combine_pages(document['texts'])
+                else:
+                    text = None
+            
+            # 重複の検出で同じグループにまとめた画像にも、代表の画像の結果を保存する
+            for index, image_file in [(index, image_file)] + duplicates.pop(index, []):
+                completed_count += 1
                 if text is not None:
-                    results.append((index, image_file, text))
-                    print(f"[{i}/{len(image_files)}] 処理完了: {os.path.basename(image_file)}")
+                    success_count += 1
+                    logger.debug(f"[{completed_count}/{found_count}] 処理完了: {os.path.basename(image_file)}"
+                                 f"（実行中: {scheduler.in_flight}, {scheduler.throughput():.1f}タスク/秒）")
                 else:
-                    print(f"[{i}/{len(image_files)}] 処理失敗: {os.path.basename(image_file)}")
-            except Exception as e:
-                print(f"エラー: 処理結果の取得中に例外が発生しました: {str(e)}")
+                    logger.warning(f"[{completed_count}/{found_count}] 処理失敗: {os.path.basename(image_file)}")
+                writer.put(index, image_file, text)
+            reporter.progress.update(completed_count, found_count, completed_count - success_count, discovered)
     
-    # 結果を元の順序でソート
-    results.sort(key=lambda x: x[0])
+    reporter.progress.update(completed_count, found_count, completed_count - success_count, force=True)
+    reporter.progress.close()
+    writer.close()
     
-    # 個別ファイルの保存
-    for _, image_file, text in results:
-        try:
-            # 個別ファイルへの保存
-            base_name = os.path.splitext(os.path.basename(image_file))[0]
-            output_file = os.path.join(output_dir, f"{base_name}.md")
-            
-            # Markdownメタデータを追加
-            md_content = f"""---
-title: {base_name}
+    # 処理終了時間
+    end_time = time.time()
+    elapsed_time = end_time - start_time
+    
+    logger.info(f"\n処理が完了しました。")
+    logger.info(f"処理時間: {elapsed_time:.2f}秒")
+    logger.info(f"処理ファイル数: {success_count}/{found_count}")
+    reporter.event('finish', elapsed_seconds=round(elapsed_time, 3), files=found_count,
+                   succeeded=success_count, failed=found_count - success_count)
+    if aggregator is not None:
+        print_metrics_summary(aggregator)
+        write_metrics_reports(aggregator, args, {
+            'elapsed_seconds': elapsed_time,
+            'files': found_count,
+            'succeeded': success_count,
+            'workers': num_workers,
+            'settings': process_args
+        })
+    if cache:
+        stats = cache.stats()
+        logger.info(f"キャッシュ: ヒット {stats['hits']} / ミス {stats['misses']} / 削除 {stats['evictions']}"
+              f"（{stats['entries']}件, {stats['size_bytes'] / (1024 * 1024):.1f}MB）")
+    logger.info(f"結果は '{timestamp_dir}' ディレクトリに保存されました。")
+    
+    return 0
+
+def watch_main(argv):
+    """
+    監視モード：ディレクトリを監視し、追加・変更された画像を継続的にOCR処理する
+    
+    ワーカープロセスは起動したまま再利用されるため、画像ごとの起動コストがかからない。
+    Ctrl+Cで終了する（処理中の画像は完了を待ってから終了する）。
+    """
+    parser = argparse.ArgumentParser(prog='main.py watch',
+                                     description='ディレクトリを監視し、追加された画像を継続的にOCR処理する')
+    parser.add_argument('input_dir', help='監視するディレクトリ')
+    add_processing_arguments(parser)
+    parser.add_argument('--interval', type=float, default=2.0, help='ディレクトリを確認する間隔（秒、デフォルト: 2）')
+    parser.add_argument('--settle-seconds', type=float, default=2.0,
+                        help='ファイルサイズと更新時刻がこの秒数変化しなければ書き込み完了とみなす（デフォルト: 2）')
+    
+    args = parser.parse_args(argv)
+    if args.tile_size > 0 and args.tile_overlap >= args.tile_size:
+        parser.error('--tile-overlap は --tile-size より小さくしてください')
+    
+    reporter = Reporter(quiet=args.quiet, verbose=args.verbose, events_path=args.events,
+                        context=get_process_context(args.start_method))
+    try:
+        return run_watch(args, reporter)
+    finally:
+        reporter.close()
+
+def run_watch(args, reporter):
+    """
+    入力ディレクトリを監視し、追加・変更された画像をOCR処理する（Ctrl+Cで終了する）
+    """
+    # 入力ディレクトリの確認
+    if not os.path.isdir(args.input_dir):
+        logger.error(f"エラー: 指定されたディレクトリが存在しません: {args.input_dir}")
+        return 1
+    
+    now = datetime.datetime.now()
+    timestamp = now.strftime("%Y%m%d_%H%M%S")
+    timestamp_dir, output_dir, processed_dir = prepare_output_dirs(
+        args.input_dir, args.output_dir, args.move_processed, timestamp)
+    
+    # 統合モードの場合、到着した順に追記する
+    combined_file = None
+    combined_header = ""
+    if args.combine:
+        combined_file = os.path.join(output_dir, args.combine_file or f"{timestamp}.md")
+        logger.info(f"統合モード: すべてのテキストを {combined_file} に保存します")
+        combined_header = f"""---
+title: OCR結果統合ファイル
 date: {now.strftime("%Y-%m-%d %H:%M:%S")}
-source: {image_file}
 ---
 
-{text}
 """
-            
-            with open(output_file, 'w', encoding='utf-8') as f:
-                f.write(md_content)
-            
-            print(f"保存完了: {output_file}")
-            
-            # 処理済み画像の移動
-            if args.move_processed and processed_dir:
-                try:
-                    dest_file = os.path.join(processed_dir, os.path.basename(image_file))
-                    shutil.move(image_file, dest_file)
-                    print(f"画像を移動しました: {dest_file}")
-                except Exception as e:
-                    print(f"警告: 画像の移動中にエラーが発生しました: {str(e)}")
-            
+    
+    process_args = build_process_args(args)
+    backend, cache = create_backend(args)
+    # 長時間動作するため、保持する値の数を制限する（p50 / p95 は標本から計算する）
+    aggregator = MetricsAggregator(metrics.RESERVOIR_SIZE) if process_args['collect_metrics'] else None
+    
+    num_workers = args.workers if args.workers > 0 else multiprocessing.cpu_count()
+    max_in_flight = num_workers * max(1, args.in_flight_per_worker)
+    
+    # 処理済みファイルのインデックスは入力ディレクトリに保存し、再起動後も引き継ぐ
+    watcher = FolderWatcher(args.input_dir, os.path.join(args.input_dir, ".ocr_watch_index.json"),
+                            settle_seconds=args.settle_seconds)
+    
+    # 個別ファイルの日時は、画像ごとの処理時刻にする
+    writer = ResultWriter(
+        output_dir, None,
+        processed_dir=processed_dir,
+        combined_file=combined_file,
+        combined_header=combined_header,
+        with_headers=args.with_headers,
+        with_separators=args.with_separators,
+        metrics=aggregator,
+        events=reporter.events
+    ).start()
+    
+    reporter.event('start', command='watch', input_dir=args.input_dir, output_dir=timestamp_dir,
+                   workers=num_workers, settings=process_args)
+    logger.info(f"監視を開始します: {args.input_dir}（ワーカー数: {num_workers}、実行方式: {args.executor}、Ctrl+Cで終了）")
+    
+    backlog = deque()
+    in_flight = {}
+    next_index = 0
+    processed_count = 0
+    failed_count = 0
+    
+    def handle(future):
+        nonlocal processed_count, failed_count
+        index, image_file, key = in_flight.pop(future)
+        try:
+            _, _, text, record = future.result()
         except Exception as e:
-            print(f"エラー: ファイル保存中に例外が発生しました: {str(e)}")
+            # ワーカーの異常終了などの場合は、次回起動時に再処理できるよう記録しない
+            logger.error(f"エラー: 処理結果の取得中に例外が発生しました: {str(e)}")
+            writer.put(index, image_file, None)
+            failed_count += 1
+            return
+        watcher.mark_done(image_file, key)
+        writer.put(index, image_file, text)
+        if aggregator is not None:
+            aggregator.add_record(record)
+        if text is not None:
+            processed_count += 1
+            logger.debug(f"[{processed_count}] 処理完了: {os.path.basename(image_file)}（待機中: {len(backlog)}）")
+        else:
+            failed_count += 1
+            logger.warning(f"処理失敗: {os.path.basename(image_file)}")
+    
+    with open_executor(args.executor, num_workers, backend, reporter, args.render_workers,
+                       args.start_method) as (executor, task):
+        try:
+            while True:
+                backlog.extend(watcher.poll())
+                
+                # 実行中のタスク数が上限に達するまで投入
+                while backlog and len(in_flight) < max_in_flight:
+                    image_file, key = backlog.popleft()
+                    args_dict = process_args.copy()
+                    args_dict['image_path'] = image_file
+                    args_dict['index'] = next_index
+                    in_flight[executor.submit(task, args_dict)] = (next_index, image_file, key)
+                    next_index += 1
+                
+                if in_flight:
+                    done, _ = wait(in_flight, timeout=args.interval, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        handle(future)
+                    # 進捗の総数は、これまでに処理した画像と処理待ちの画像の合計
+                    done_count = processed_count + failed_count
+                    reporter.progress.update(done_count, done_count + len(in_flight) + len(backlog), failed_count)
+                    # すべての画像の処理が終わった時点で、処理時間の集計結果を更新する
+                    if aggregator is not None and not in_flight and not backlog:
+                        write_metrics_reports(aggregator, args, {'files': processed_count, 'workers': num_workers})
+                else:
+                    time.sleep(args.interval)
+                
+                watcher.save()
+        except KeyboardInterrupt:
+            logger.info("\n監視を終了します。処理中の画像の完了を待っています...")
+            for future in list(in_flight):
+                handle(future)
+    
+    reporter.progress.close()
+    writer.close()
+    watcher.save()
+    
+    logger.info(f"処理ファイル数: {processed_count}")
+    reporter.event('finish', files=processed_count + failed_count, succeeded=processed_count, failed=failed_count)
+    if aggregator is not None:
+        print_metrics_summary(aggregator)
+        write_metrics_reports(aggregator, args, {'files': processed_count, 'workers': num_workers})
+    if cache:
+        stats = cache.stats()
+        logger.info(f"キャッシュ: ヒット {stats['hits']} / ミス {stats['misses']} / 削除 {stats['evictions']}"
+              f"（{stats['entries']}件, {stats['size_bytes'] / (1024 * 1024):.1f}MB）")
+    logger.info(f"結果は '{timestamp_dir}' ディレクトリに保存されました。")
+    
+    return 0
+
+def rerender_main(argv):
+    """
+    再作成モード：保存したサイドカーから、認識を行わずに後処理（整形・表・レイアウト・Markdown）だけをやり直す
+    
+    変換レベルや表の検出・レイアウト解析の設定を変えて、アーカイブ全体の結果を作り直す場合に使用する。
+    """
+    parser = argparse.ArgumentParser(prog='main.py rerender',
+                                     description='サイドカーの認識結果から、認識せずにテキストを再作成する')
+    parser.add_argument('sidecar_dir', help='サイドカーのディレクトリ（--sidecar-dir で保存したもの）')
+    add_output_arguments(parser)
+    parser.add_argument('--batch-size', type=int, default=32,
+                        help='1つのタスクでまとめて処理する画像の数（デフォルト: 32）')
+    
+    args = parser.parse_args(argv)
+    
+    reporter = Reporter(quiet=args.quiet, verbose=args.verbose, events_path=args.events,
+                        context=get_process_context(args.start_method))
+    try:
+        return run_rerender(args, reporter)
+    finally:
+        reporter.close()
+
+def run_rerender(args, reporter):
+    """
+    サイドカーのディレクトリのすべての結果を、後処理からやり直して保存する
+    """
+    if not os.path.isdir(args.sidecar_dir):
+        logger.error(f"エラー: 指定されたディレクトリが存在しません: {args.sidecar_dir}")
+        return 1
     
-    # 統合モードの場合、元の順序でテキストを統合
+    documents = iter_sidecar_documents(args.sidecar_dir)
+    first_document = next(documents, None)
+    if first_document is None:
+        logger.warning(f"警告: 指定されたディレクトリにサイドカーが見つかりませんでした: {args.sidecar_dir}")
+        return 0
+    
+    now = datetime.datetime.now()
+    timestamp = now.strftime("%Y%m%d_%H%M%S")
+    timestamp_dir, output_dir, _ = prepare_output_dirs(args.sidecar_dir, args.output_dir, False, timestamp)
+    
+    start_time = time.time()
+    logger.info(f"再作成を開始します。")
+    
+    combined_file = None
     if args.combine:
-        for i, (_, image_file, text) in enumerate(results):
-            base_name = os.path.splitext(os.path.basename(image_file))[0]
-            
-            # ファイル名のヘッダーを追加（オプション）
-            if args.with_headers:
-                combined_text += f"# {base_name}\n\n"
-            
-            # テキストを追加
-            combined_text += text
-            
-            # セパレータを追加（オプション）- Markdown形式の水平線
-            if args.with_separators and i < len(results) - 1:  # 最後のファイルの後にはセパレータを追加しない
-                combined_text += "\n\n---\n\n"
-            else:
-                combined_text += "\n\n"
-        
-        # 統合ファイルを保存
-        if combined_text:
+        combined_file = os.path.join(output_dir, args.combine_file or f"{timestamp}.md")
+        logger.info(f"統合モード: すべてのテキストを {combined_file} に保存します")
+    
+    process_args = {
+        'format_text': not args.raw,
+        'detect_tables': args.detect_tables,
+        'analyze_layout': args.analyze_layout,
+        'conversion_level': args.conversion_level,
+        'collect_metrics': bool(args.metrics_json or args.metrics_prom)
+    }
+    aggregator = MetricsAggregator() if process_args['collect_metrics'] else None
+    num_workers = args.workers if args.workers > 0 else multiprocessing.cpu_count()
+    batch_size = max(1, args.batch_size)
+    
+    # 出力ファイルは、サイドカーのディレクトリ構成を保って保存する
+    writer = ResultWriter(
+        output_dir, now,
+        combined_file=combined_file,
+        with_headers=args.with_headers,
+        with_separators=args.with_separators,
+        sort_combined=True,
+        metrics=aggregator,
+        events=reporter.events
+    ).start()
+    
+    reporter.event('start', command='rerender', input_dir=args.sidecar_dir, output_dir=timestamp_dir,
+                   workers=num_workers, settings=process_args)
+    
+    found_count = 0
+    completed_count = 0
+    success_count = 0
+    discovered = False
+    
+    def iter_tasks():
+        # 文書をまとめたタスクを、必要な分だけ作成する
+        nonlocal found_count, discovered
+        batch = []
+        for index, (relative_dir, paths) in enumerate(itertools.chain([first_document], documents)):
+            found_count += 1
+            batch.append((index, relative_dir, paths))
+            if len(batch) >= batch_size:
+                yield dict(process_args, documents=batch)
+                batch = []
+        discovered = True
+        if batch:
+            yield dict(process_args, documents=batch)
+    
+    # 後処理はCPUを使うため、プロセスプールで並列に実行する（バックエンドは不要）
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=get_process_context(args.start_method),
+                             initializer=initialize_worker_logging,
+                             initargs=(reporter.log_queue, reporter.level)) as executor:
+        scheduler = BoundedScheduler(executor, rerender_documents, num_workers * 2)
+        for task, future in scheduler.run(iter_tasks()):
             try:
-                with open(combined_file, 'w', encoding='utf-8') as f:
-                    f.write(combined_text)
-                print(f"\n統合ファイルを保存しました: {combined_file}")
+                results = future.result()
             except Exception as e:
-                print(f"エラー: 統合ファイルの保存中に例外が発生しました: {str(e)}")
+                logger.error(f"エラー: 処理結果の取得中に例外が発生しました: {str(e)}")
+                results = [(index, paths[0], None, relative_dir, [])
+                           for index, relative_dir, paths in task['documents']]
+            for index, image_file, text, relative_dir, records in results:
+                completed_count += 1
+                if aggregator is not None:
+                    for record in records:
+                        aggregator.add_record(record)
+                if text is not None:
+                    success_count += 1
+                else:
+                    logger.warning(f"[{completed_count}/{found_count}] 処理失敗: {os.path.basename(image_file)}")
+                writer.put(index, image_file, text, relative_dir)
+            reporter.progress.update(completed_count, found_count, completed_count - success_count, discovered)
     
-    # 処理終了時間
-    end_time = time.time()
-    elapsed_time = end_time - start_time
+    reporter.progress.update(completed_count, found_count, completed_count - success_count, force=True)
+    reporter.progress.close()
+    
+    writer.combined_header = f"""---
+title: OCR結果統合ファイル
+date: {now.strftime("%Y-%m-%d %H:%M:%S")}
+source_files: {found_count}
+---
+
+"""
+    writer.close()
+    
+    elapsed_time = time.time() - start_time
+    logger.info(f"\n再作成が完了しました。")
+    logger.info(f"処理時間: {elapsed_time:.2f}秒")
+    logger.info(f"処理ファイル数: {success_count}/{found_count}")
+    reporter.event('finish', elapsed_seconds=round(elapsed_time, 3), files=found_count,
+                   succeeded=success_count, failed=found_count - success_count)
+    if aggregator is not None:
+        print_metrics_summary(aggregator)
+        write_metrics_reports(aggregator, args, {
+            'elapsed_seconds': elapsed_time,
+            'files': found_count,
+            'succeeded': success_count,
+            'workers': num_workers,
+            'settings': process_args
+        })
+    logger.info(f"結果は '{timestamp_dir}' ディレクトリに保存されました。")
+    
+    return 0
+
+def serve_main(argv):
+    """
+    サーバーモード：ワーカーを起動したまま、ローカルのHTTP（またはUnixドメインソケット）でOCRのリクエストを受け付ける
+    
+    画像を1〜2枚ずつ処理するツールから呼び出す場合に、インタプリタ・フレームワーク・ワーカーの起動を
+    リクエストごとに行わずに済む。同時に届いたリクエストはまとめてワーカーに渡す。Ctrl+Cで終了する。
+    """
+    parser = argparse.ArgumentParser(prog='main.py serve',
+                                     description='ワーカーを起動したまま、ローカルでOCRのリクエストを受け付ける')
+    parser.add_argument('--host', default='127.0.0.1', help='待ち受けるアドレス（デフォルト: 127.0.0.1）')
+    parser.add_argument('--port', type=int, default=8765, help='待ち受けるポート（デフォルト: 8765）')
+    parser.add_argument('--socket', metavar='PATH', help='TCPの代わりに、このパスのUnixドメインソケットで待ち受ける')
+    parser.add_argument('--max-batch-size', type=int, default=8,
+                        help='1つのタスクにまとめるリクエストの最大数（デフォルト: 8）')
+    parser.add_argument('--batch-wait-ms', type=float, default=2.0,
+                        help='最初のリクエストから、まとめる後続のリクエストを待つ時間（ミリ秒、デフォルト: 2）')
+    parser.add_argument('--request-timeout', type=float, default=300.0,
+                        help='1つのリクエストの結果を待つ最大の秒数（デフォルト: 300）')
+    add_render_arguments(parser)
+    add_worker_arguments(parser)
+    add_backend_arguments(parser)
+    add_logging_arguments(parser)
+    
+    args = parser.parse_args(argv)
+    if args.tile_size > 0 and args.tile_overlap >= args.tile_size:
+        parser.error('--tile-overlap は --tile-size より小さくしてください')
+    
+    reporter = Reporter(quiet=args.quiet, verbose=args.verbose,
+                        context=get_process_context(args.start_method))
+    try:
+        return run_serve(args, reporter)
+    finally:
+        reporter.close()
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+def run_serve(args, reporter):
+    """
+    ワーカーを起動し、Ctrl+Cで終了するまでリクエストを処理する
+    """
+    # HTTPサーバーのモジュールは読み込みに時間がかかるため、サーバーモードでのみ読み込む
+    from server import OCRService, create_server, recognize_batch, warm_up_worker
+    
+    backend, cache = create_backend(args)
+    num_workers = args.workers if args.workers > 0 else multiprocessing.cpu_count()
+    defaults = {
+        'format_text': not args.raw,
+        'detect_tables': args.detect_tables,
+        'analyze_layout': args.analyze_layout,
+        'conversion_level': args.conversion_level
+    }
+    
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=get_process_context(args.start_method),
+                             initializer=initialize_process,
+                             initargs=(backend, reporter.log_queue, reporter.level)) as executor:
+        # 最初のリクエストの前に、すべてのワーカーを起動してバックエンドを準備しておく
+        wait([executor.submit(warm_up_worker, 0.05) for _ in range(num_workers)])
+        
+        # 実行中のバッチはワーカー数まで。その間に届いたリクエストは次のバッチにまとめる
+        batcher = MicroBatcher(executor, recognize_batch, max_batch_size=args.max_batch_size,
+                               max_wait=args.batch_wait_ms / 1000, max_in_flight=num_workers).start()
+        service = OCRService(batcher, defaults, request_timeout=args.request_timeout)
+        server = create_server(service, args.host, args.port, args.socket)
+        if args.socket:
+            logger.info(f"サーバーを開始しました: unix:{args.socket}（ワーカー数: {num_workers}、Ctrl+Cで終了）")
+        else:
+            host, port = server.server_address[:2]
+            logger.info(f"サーバーを開始しました: http://{host}:{port}（ワーカー数: {num_workers}、Ctrl+Cで終了）")
+        # サービス管理ツールなどから SIGTERM で停止された場合も、Ctrl+C と同じく終了処理を行う
+        signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("\nサーバーを終了します。")
+        finally:
+            server.server_close()
+            batcher.close()
+            service.close()
+            if args.socket and os.path.exists(args.socket):
+                os.remove(args.socket)
     
-    print(f"\n処理が完了しました。")
-    print(f"処理時間: {elapsed_time:.2f}秒")
-    print(f"処理ファイル数: {len(results)}/{len(image_files)}")
-    print(f"結果は '{timestamp_dir}' ディレクトリに保存されました。")
+    stats = service.stats()
+    logger.info(f"処理リクエスト数: {stats['requests']}（失敗: {stats['failed']}、"
+                f"平均バッチサイズ: {stats['batching']['mean_batch_size']:.2f}）")
+    if stats['latency']:
+        latency = stats['latency']
+        logger.info(f"遅延: p50 {latency['p50'] * 1000:.1f}ms / p95 {latency['p95'] * 1000:.1f}ms / "
+                    f"最大 {latency['max'] * 1000:.1f}ms")
+    if cache:
+        stats = cache.stats()
+        logger.info(f"キャッシュ: ヒット {stats['hits']} / ミス {stats['misses']} / 削除 {stats['evictions']}"
+              f"（{stats['entries']}件, {stats['size_bytes'] / (1024 * 1024):.1f}MB）")
     
     return 0
 
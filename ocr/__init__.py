@@ -4,5 +4,39 @@ Apple OCR ツール - OCRパッケージ
 AppleのVisionフレームワークを使用して、画像からテキストを抽出するPythonツール
 """
 
+import importlib
+
 # 主要な関数をエクスポート
-from .core import process_image
+from .core import process_image, recognize_page, render_observations, combine_pages
+from .page import OCRPage
+from .backend import OCRBackend, VisionBackend, ReplayBackend, RecordingBackend, StubBackend
+
+# 最初に参照した時点で読み込むもの（名前 -> モジュール）
+# sqlite3 や multiprocessing などを読み込むため、使用しない場合は import ocr の時間に含めない
+# （フォークサーバーで事前に読み込む場合も同様）
+_LAZY_EXPORTS = {
+    'process_images': 'batch',
+    'ImageResult': 'batch',
+    'AsyncOCR': 'aio',
+    'aprocess_image': 'aio',
+    'aprocess_images': 'aio',
+    'ObservationCache': 'cache',
+    'CachedBackend': 'cache',
+    'TiledBackend': 'tiling',
+    'NormalizingBackend': 'normalize',
+}
+
+__all__ = ['process_image', 'recognize_page', 'render_observations', 'combine_pages', 'OCRPage',
+           'OCRBackend', 'VisionBackend', 'ReplayBackend', 'RecordingBackend', 'StubBackend',
+           *_LAZY_EXPORTS]
+
+def __getattr__(name):
+    module = _LAZY_EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f'.{module}', __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_EXPORTS))
@@ -0,0 +1,338 @@
+"""
+非同期処理モジュール
+
+asyncioのイベントループから、ブロックせずにOCR処理を行うための AsyncOCR と、
+既定の AsyncOCR を使う aprocess_image / aprocess_images を提供します。
+OCR処理はワーカーのプール（プロセスまたはスレッド）で実行し、同時に実行する数を
+セマフォで制限します。プールの作成とワーカーの準備（フレームワークの読み込みなど）は
+別のスレッドで行い、イベントループをブロックしません。呼び出しごとにタイムアウトを指定でき、取り消し（キャンセル）した
+呼び出しのうち、まだ開始していないものはプールからも取り除かれます。
+
+asyncioの読み込みには時間がかかるため、ocr パッケージの読み込み時には読み込まず、
+使用する時点で読み込みます。
+"""
+
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from .batch import ImageResult, _process_one
+from .core import initialize_worker, prepare_backend, process_image
+from .scheduler import get_process_context
+
+# タイムアウトした画像の結果に設定する理由
+TIMEOUT_MESSAGE = "タイムアウトしました"
+
+class AsyncOCR:
+    """
+    ワーカーのプールを管理し、OCR処理を非同期に実行する
+
+    ``async with AsyncOCR(...) as ocr:`` の形で使用すると、ブロックの開始時にプールを準備し、
+    終了時にプールを終了する（start() を呼ばない場合は、最初の呼び出し時に準備する）。
+    同時に実行する（プールに投入する）処理の数は max_concurrency までに制限し、
+    それを超える呼び出しはイベントループ上で待機する（プールのキューに溜まらない）。
+
+    Parameters:
+    -----------
+    workers : int
+        ワーカーの数（0の場合はCPUコア数）
+    backend : OCRBackend
+        使用するOCRバックエンド（指定しない場合はVisionBackend）
+    max_concurrency : int
+        同時に実行する処理の最大数（指定しない場合はワーカー数の2倍）
+    executor : str
+        'process'（プロセスプール）または 'thread'（スレッドプール、バックエンドをスレッド間で共有）
+    start_method : str
+        executor='process' の場合のワーカープロセスの起動方法（get_process_context を参照）
+    """
+
+    def __init__(self, workers=0, backend=None, max_concurrency=None, executor='process', start_method=None):
+        if executor not in ('process', 'thread'):
+            raise ValueError(f"executor には 'process' または 'thread' を指定してください: {executor}")
+        self.workers = workers if workers > 0 else multiprocessing.cpu_count()
+        self.backend = backend
+        self.max_concurrency = max(1, max_concurrency or self.workers * 2)
+        self.executor = executor
+        self.start_method = start_method
+        self._pool = None
+        self._starting = None  # プールの準備の完了を待つ Future（準備中または準備済みの場合）
+        self._lock = threading.Lock()
+        self._semaphore = None
+        self._loop = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.aclose()
+
+    async def start(self):
+        """
+        ワーカーのプールを作成し、すべてのワーカーの準備が終わるまで待つ
+
+        プロセスの起動（forkserver の起動と事前読み込みを含む）とバックエンドの準備は
+        別のスレッドで行うため、イベントループはブロックされない。
+        複数の呼び出しが同時に待機した場合も、プールは1回だけ作成する。
+        """
+        import asyncio
+        with self._lock:
+            if self._pool is not None:
+                return self._pool
+            starting = self._starting
+            if starting is None:
+                starting = self._starting = Future()
+                # 待機している呼び出しが取り消されても、準備自体は取り消さない
+                starting.set_running_or_notify_cancel()
+                threading.Thread(target=self._create_pool, args=(starting,), name='AsyncOCR-start',
+                                 daemon=True).start()
+        return await asyncio.wrap_future(starting)
+
+    def _create_pool(self, starting):
+        """プールを作成してワーカーを準備し、starting に結果を設定する（別のスレッドで実行する）"""
+        try:
+            if self.executor == 'process':
+                pool = ProcessPoolExecutor(max_workers=self.workers,
+                                           mp_context=get_process_context(self.start_method),
+                                           initializer=initialize_worker, initargs=(self.backend,))
+                # まとめて投入し、すべてのワーカーを起動して初期化（バックエンドの準備）を終えておく
+                for future in [pool.submit(_ready) for _ in range(self.workers)]:
+                    future.result()
+            else:
+                # 準備したバックエンドは _submit で各処理に渡す（プロセス内の既定のバックエンドは変更しない）
+                self.backend = prepare_backend(self.backend)
+                pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ocr')
+        except BaseException as e:
+            with self._lock:
+                if self._starting is starting:
+                    self._starting = None
+            starting.set_exception(e)
+            return
+        with self._lock:
+            if self._starting is starting:
+                self._pool = pool
+        starting.set_result(pool)
+
+    def _get_semaphore(self):
+        """実行中のイベントループのセマフォを返す（イベントループが変わった場合は作り直す）"""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def _submit(self, fn, *args, timeout=None, **kwargs):
+        """
+        fn をプールで実行し、結果を待つ
+
+        セマフォの枠は、プールでの実行が実際に終わった時点で解放する。
+        取り消しやタイムアウトの時点で実行中だった処理は途中で止められないため、
+        その処理が終わるまで枠を使用したままにし、同時に実行する数を超えないようにする。
+        スレッドプールの場合は、このインスタンスのバックエンドを fn の backend 引数に渡す
+        （プロセスプールの場合は、各ワーカーの初期化で設定した既定のバックエンドを使用する）。
+        """
+        import asyncio
+        semaphore = self._get_semaphore()
+        loop = asyncio.get_running_loop()
+        pool = await self.start()
+        if self.executor == 'thread':
+            kwargs['backend'] = self.backend
+        await semaphore.acquire()
+        try:
+            future = pool.submit(fn, *args, **kwargs)
+        except BaseException:
+            semaphore.release()
+            raise
+        future.add_done_callback(functools.partial(_release_soon, loop, semaphore))
+        # 待機を取り消した場合、開始前の処理はプールからも取り除かれる
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+
+    async def process_image(self, image_path, timeout=None, format_text=True, detect_tables=False,
+                            analyze_layout=False, conversion_level='conservative', page=None):
+        """
+        画像ファイルからテキストを抽出する（ocr.process_image の非同期版）
+
+        Parameters:
+        -----------
+        image_path : str
+            画像ファイルのパス
+        timeout : float
+            結果を待つ最大の秒数（Noneの場合は制限しない）
+        format_text, detect_tables, analyze_layout, conversion_level, page
+            process_image を参照
+
+        Returns:
+        --------
+        str
+            抽出されたテキスト
+
+        Raises:
+        -------
+        TimeoutError
+            timeout 秒以内に処理が終わらなかった場合
+        """
+        return await self._submit(process_image, os.fspath(image_path), format_text, detect_tables,
+                                  analyze_layout, conversion_level, page=page, timeout=timeout)
+
+    async def process_images(self, paths, ordered=True, timeout=None, format_text=True, detect_tables=False,
+                             analyze_layout=False, conversion_level='conservative'):
+        """
+        複数の画像を並列にOCR処理し、結果を1件ずつ返す非同期ジェネレータ（ocr.process_images の非同期版）
+
+        ``async for result in ocr.process_images(paths):`` の形で使用する。
+        入力のパスは必要な分だけ取り出し、同時に処理する画像は max_concurrency までに制限する。
+        途中でループを抜けた場合は、処理中の画像の待機を取り消す。
+
+        Parameters:
+        -----------
+        paths : iterable or async iterable
+            画像ファイルのパス
+        ordered : bool
+            Trueの場合は入力の順、Falseの場合は完了した順に結果を返す
+        timeout : float
+            画像ごとに結果を待つ最大の秒数（超えた場合は error を設定した結果を返す）
+        format_text, detect_tables, analyze_layout, conversion_level
+            process_image を参照
+
+        Yields:
+        -------
+        ImageResult
+            画像ごとの処理結果（失敗した場合も error を設定して返す）
+        """
+        import asyncio
+        options = {
+            'format_text': format_text,
+            'detect_tables': detect_tables,
+            'analyze_layout': analyze_layout,
+            'conversion_level': conversion_level
+        }
+
+        async def run(index, image_path):
+            try:
+                return await self._submit(_process_one, index, image_path, options, timeout=timeout)
+            except asyncio.TimeoutError:
+                return ImageResult(index, image_path, error=TIMEOUT_MESSAGE)
+            except Exception as e:
+                return ImageResult(index, image_path, error=f"{type(e).__name__}: {str(e)}")
+
+        pending = []
+        try:
+            index = 0
+            async for image_path in _aiter_paths(paths):
+                pending.append(asyncio.ensure_future(run(index, os.fspath(image_path))))
+                index += 1
+                while len(pending) >= self.max_concurrency:
+                    for result in await _next_results(pending, ordered):
+                        yield result
+            while pending:
+                for result in await _next_results(pending, ordered):
+                    yield result
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def aclose(self):
+        """プールを終了する（実行中の処理の完了を待つ。開始していない処理は取り消す）"""
+        import asyncio
+        with self._lock:
+            starting, self._starting = self._starting, None
+            self._pool = None
+        if starting is None:
+            return
+        try:
+            # 準備中の場合は、準備が終わってから終了する
+            pool = await asyncio.wrap_future(starting)
+        except Exception:
+            return
+        await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(pool.shutdown, wait=True, cancel_futures=True))
+
+def _ready():
+    """ワーカーの起動と初期化を待つための関数（ワーカーで実行する）"""
+
+def _release_soon(loop, semaphore, _future):
+    """プールのスレッドから、イベントループのスレッドでセマフォを解放する"""
+    try:
+        loop.call_soon_threadsafe(semaphore.release)
+    except RuntimeError:
+        # イベントループが終了している場合は、解放する必要がない
+        pass
+
+async def _aiter_paths(paths):
+    """イテラブルと非同期イテラブルのどちらからも、パスを1つずつ取り出す"""
+    if hasattr(paths, '__aiter__'):
+        async for path in paths:
+            yield path
+    else:
+        for path in paths:
+            yield path
+
+async def _next_results(pending, ordered):
+    """
+    実行中のタスクの結果を待ち、完了したものを pending から取り除いて返す
+
+    ordered=True の場合は先頭のタスクの結果だけを、それ以外の場合は完了したすべての結果を返す。
+    """
+    import asyncio
+    if ordered:
+        # 待機中に取り消された場合も、pending に残したタスクを呼び出し側で取り消せるようにする
+        result = await pending[0]
+        pending.pop(0)
+        return [result]
+    done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    results = []
+    for task in list(pending):
+        if task in done:
+            pending.remove(task)
+            results.append(task.result())
+    return results
+
+_default = None
+_default_lock = threading.Lock()
+
+def get_default():
+    """aprocess_image / aprocess_images が使用する既定の AsyncOCR を返す（最初の呼び出し時に作成する）"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = AsyncOCR()
+        return _default
+
+async def aprocess_image(image_path, timeout=None, **options):
+    """
+    既定の AsyncOCR で、画像ファイルからテキストを抽出する
+
+    Parameters:
+    -----------
+    image_path : str
+        画像ファイルのパス
+    timeout : float
+        結果を待つ最大の秒数（Noneの場合は制限しない）
+    **options
+        AsyncOCR.process_image を参照
+
+    Returns:
+    --------
+    str
+        抽出されたテキスト
+    """
+    return await get_default().process_image(image_path, timeout=timeout, **options)
+
+def aprocess_images(paths, ordered=True, timeout=None, **options):
+    """
+    既定の AsyncOCR で、複数の画像を並列にOCR処理する非同期ジェネレータを返す
+
+    AsyncOCR.process_images を参照。
+    """
+    return get_default().process_images(paths, ordered=ordered, timeout=timeout, **options)
+
+async def ashutdown():
+    """既定の AsyncOCR のプールを終了する"""
+    global _default
+    with _default_lock:
+        default, _default = _default, None
+    if default is not None:
+        await default.aclose()
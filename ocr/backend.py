@@ -0,0 +1,496 @@
+"""
+OCRバックエンドモジュール
+
+画像を受け取り、認識結果（観測値）のリストを返すバックエンドを提供します。
+観測値は以下のキーを持つ辞書です（座標はVisionと同じ左下原点の正規化座標）:
+
+- 'text'       : 認識されたテキスト
+- 'x', 'y'     : バウンディングボックスの原点
+- 'width'      : バウンディングボックスの幅
+- 'height'     : バウンディングボックスの高さ
+- 'confidence' : 認識の信頼度（0.0〜1.0）
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import metrics
+
+class OCRBackendError(Exception):
+    """OCRバックエンドで発生するエラーの基底クラス"""
+
+class ImageLoadError(OCRBackendError):
+    """画像の読み込みに失敗した場合のエラー"""
+
+class RecognitionError(OCRBackendError):
+    """テキスト認識に失敗した場合のエラー"""
+
+class OCRBackend:
+    """
+    OCRバックエンドの基底クラス
+
+    サブクラスは recognize() を実装し、観測値のリストを返す。
+    ワーカープロセスへ渡せるよう、インスタンスはpickle可能に保つこと。
+    """
+
+    def recognize(self, image_path, page=None):
+        """
+        画像からテキストを認識する
+
+        Parameters:
+        -----------
+        image_path : str
+            画像ファイルのパス
+        page : int
+            複数ページの画像（TIFFなど）の場合のページ番号（0始まり）。
+            Noneの場合は画像全体（単一ページの画像）として扱う
+
+        Returns:
+        --------
+        list
+            観測値（辞書）のリスト。テキストが検出されなかった場合は空のリスト
+
+        Raises:
+        -------
+        ImageLoadError
+            画像を読み込めなかった場合
+        RecognitionError
+            認識処理に失敗した場合
+        """
+        raise NotImplementedError
+
+    def page_count(self, image_path):
+        """
+        画像のページ数を返す（既定では1）
+
+        Parameters:
+        -----------
+        image_path : str
+            画像ファイルのパス
+
+        Returns:
+        --------
+        int
+            ページ数
+        """
+        return 1
+
+    def image_size(self, image_path, page=None):
+        """
+        画像の大きさ（ピクセル）を返す
+
+        Parameters:
+        -----------
+        image_path : str
+            画像ファイルのパス
+        page : int
+            複数ページの画像の場合のページ番号（0始まり）
+
+        Returns:
+        --------
+        tuple or None
+            (幅, 高さ) のタプル。大きさが分からない場合はNone
+        """
+        return None
+
+    def recognize_tiles(self, image_path, tiles, page=None, max_workers=None):
+        """
+        画像の複数の領域（タイル）からテキストを認識する
+
+        Parameters:
+        -----------
+        image_path : str
+            画像ファイルのパス
+        tiles : list
+            (x, y, 幅, 高さ) のタプルのリスト（左下原点のピクセル座標）
+        page : int
+            複数ページの画像の場合のページ番号（0始まり）
+        max_workers : int
+            同時に認識するタイルの最大数（Noneの場合はバックエンドの既定値）
+
+        Returns:
+        --------
+        list
+            タイルごとの観測値のリスト（座標は各タイル内の正規化座標）
+        """
+        raise NotImplementedError
+
+    def settings(self):
+        """
+        認識結果に影響する設定を返す（キャッシュのキーに使用）
+
+        Returns:
+        --------
+        dict
+            設定名と値の辞書
+        """
+        return {'backend': type(self).__name__}
+
+    def warm_up(self):
+        """
+        認識の準備（フレームワークの読み込みやモデルの初期化）を行う
+
+        ワーカープロセスの初期化時に呼び出され、最初の画像の待ち時間を減らす。
+        既定では何もしない。
+        """
+
+class VisionBackend(OCRBackend):
+    """
+    AppleのVisionフレームワークを使用するバックエンド
+
+    pyobjcのフレームワークは初回の認識時（または warm_up() 時）に読み込むため、
+    macOS以外の環境でもこのモジュール自体はインポートできる。
+    設定済みのOCRリクエストはスレッドごとに作成して再利用する。
+    """
+
+    def __init__(self, languages=("ja", "en"), recognition_level='accurate'):
+        self.languages = list(languages)
+        self.recognition_level = recognition_level
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def settings(self):
+        return {
+            'backend': type(self).__name__,
+            'level': self.recognition_level,
+            'languages': self.languages
+        }
+
+    def warm_up(self):
+        from Quartz import CIImage, CIColor, CGRectMake
+
+        # 小さな白い画像で認識を1回実行し、フレームワークとモデルを読み込んでおく
+        color = CIColor.colorWithRed_green_blue_(1.0, 1.0, 1.0)
+        image = CIImage.imageWithColor_(color).imageByCroppingToRect_(CGRectMake(0, 0, 64, 64))
+        try:
+            self.recognize_image(image, "<warm-up>")
+        except RecognitionError:
+            pass
+
+    def recognize(self, image_path, page=None):
+        with metrics.stage('load'):
+            image = self.load_image(image_path, page)
+        return self.recognize_image(image, image_path)
+
+    def page_count(self, image_path):
+        from Foundation import NSURL
+        from Quartz import CGImageSourceCreateWithURL, CGImageSourceGetCount
+
+        # CGImageSourceはヘッダーだけを読み込むため、ページの画像はデコードされない
+        source = CGImageSourceCreateWithURL(NSURL.fileURLWithPath_(image_path), None)
+        if source is None:
+            return 1
+        return max(1, CGImageSourceGetCount(source))
+
+    def image_size(self, image_path, page=None):
+        from Foundation import NSURL
+        from Quartz import (CGImageSourceCreateWithURL, CGImageSourceCopyPropertiesAtIndex,
+                            kCGImagePropertyPixelWidth, kCGImagePropertyPixelHeight)
+
+        source = CGImageSourceCreateWithURL(NSURL.fileURLWithPath_(image_path), None)
+        properties = CGImageSourceCopyPropertiesAtIndex(source, page or 0, None) if source is not None else None
+        if not properties:
+            return None
+        width = properties.get(kCGImagePropertyPixelWidth)
+        height = properties.get(kCGImagePropertyPixelHeight)
+        if width is None or height is None:
+            return None
+        return int(width), int(height)
+
+    def recognize_tiles(self, image_path, tiles, page=None, max_workers=None):
+        from Quartz import CGRectMake, CGAffineTransformMakeTranslation
+
+        # 画像は1回だけ読み込み、タイルごとに切り出して別々のスレッドで認識する
+        # （リクエストはスレッドごとに作成されるため、スレッド間で共有されない）
+        with metrics.stage('load'):
+            image = self.load_image(image_path, page)
+
+        def recognize_tile(tile):
+            x, y, width, height = tile
+            cropped = image.imageByCroppingToRect_(CGRectMake(x, y, width, height))
+            cropped = cropped.imageByApplyingTransform_(CGAffineTransformMakeTranslation(-x, -y))
+            return self.recognize_image(cropped, image_path)
+
+        with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+            return list(executor.map(recognize_tile, tiles))
+
+    def load_image(self, image_path, page=None):
+        """
+        画像ファイルをCIImageとして読み込む
+
+        Parameters:
+        -----------
+        image_path : str
+            画像ファイルのパス
+        page : int
+            読み込むページ番号（0始まり、Noneの場合は先頭の画像）
+
+        Raises:
+        -------
+        ImageLoadError
+            画像を読み込めなかった場合
+        """
+        from Foundation import NSURL
+        from Quartz import CIImage, CGImageSourceCreateWithURL, CGImageSourceCreateImageAtIndex
+
+        image_url = NSURL.fileURLWithPath_(image_path)
+        if page is None:
+            image = CIImage.imageWithContentsOfURL_(image_url)
+        else:
+            image = None
+            source = CGImageSourceCreateWithURL(image_url, None)
+            cg_image = CGImageSourceCreateImageAtIndex(source, page, None) if source is not None else None
+            if cg_image is not None:
+                image = CIImage.imageWithCGImage_(cg_image)
+
+        if image is None:
+            raise ImageLoadError(f"画像を読み込めませんでした: {image_path}")
+        return image
+
+    def recognize_image(self, image, image_path):
+        """
+        読み込み済みのCIImageからテキストを認識する
+
+        Parameters:
+        -----------
+        image : CIImage
+            認識対象の画像
+        image_path : str
+            エラーメッセージに使用する画像のパス
+
+        Returns:
+        --------
+        list
+            観測値（辞書）のリスト
+        """
+        from Vision import VNImageRequestHandler
+
+        request = self._get_request()
+
+        # OCR処理の実行
+        handler = VNImageRequestHandler.alloc().initWithCIImage_options_(image, None)
+        success = handler.performRequests_error_([request], None)
+
+        if not success:
+            raise RecognitionError(f"OCR処理に失敗しました: {image_path}")
+
+        observations = []
+        for observation in request.results() or []:
+            candidates = observation.topCandidates_(1)
+            if candidates and len(candidates) > 0:
+                candidate = candidates[0]
+                # boundingBoxはNSRectで、左下原点の座標系
+                bounding_box = observation.boundingBox()
+                observations.append({
+                    'text': candidate.string(),
+                    'x': bounding_box.origin.x,
+                    'y': bounding_box.origin.y,
+                    'width': bounding_box.size.width,
+                    'height': bounding_box.size.height,
+                    'confidence': float(candidate.confidence())
+                })
+
+        return observations
+
+    def _get_request(self):
+        """スレッドごとに設定済みのOCRリクエストを作成し、以降は再利用する"""
+        request = getattr(self._local, 'request', None)
+        if request is None:
+            from Vision import (VNRecognizeTextRequest,
+                                VNRequestTextRecognitionLevelAccurate, VNRequestTextRecognitionLevelFast)
+
+            request = VNRecognizeTextRequest.alloc().init()
+            if self.recognition_level == 'fast':
+                request.setRecognitionLevel_(VNRequestTextRecognitionLevelFast)
+            else:
+                request.setRecognitionLevel_(VNRequestTextRecognitionLevelAccurate)
+
+            # 日本語を含む言語をサポート
+            request.setRecognitionLanguages_(self.languages)
+            self._local.request = request
+        return request
+
+class ReplayBackend(OCRBackend):
+    """
+    記録済みの観測値をディスクから返すバックエンド
+
+    画像ファイル名（拡張子を除く）に対応する `<record_dir>/<name>.jsonl` を読み込む。
+    複数ページの画像の場合は、ページごとに `<record_dir>/<name>.page<番号>.jsonl`
+    （番号は1始まり）を読み込む。
+    タイルに分割して認識した場合は、タイルごとの `<name>.tile<x>_<y>_<幅>x<高さ>.jsonl` と
+    画像の大きさを記録した `<name>.size.json` を読み込む。
+    画像そのものは読み込まないため、macOS以外でも後処理や並列処理の
+    負荷試験・ベンチマークを実行できる。
+    delay を指定すると、認識1回ごとにその秒数だけ待機し、GILを解放する認識処理を模擬する
+    （実行方式の比較などのベンチマーク用）。
+    """
+
+    def __init__(self, record_dir, delay=0.0):
+        self.record_dir = record_dir
+        self.delay = delay
+
+    def settings(self):
+        return {'backend': type(self).__name__, 'record_dir': os.path.abspath(self.record_dir)}
+
+    def record_path(self, image_path, page=None, tile=None):
+        """画像パス（とページ番号、タイル）に対応する記録ファイルのパスを返す"""
+        return self._base_path(image_path, page, tile) + ".jsonl"
+
+    def size_path(self, image_path, page=None):
+        """画像の大きさを記録するファイルのパスを返す"""
+        return self._base_path(image_path, page) + ".size.json"
+
+    def _base_path(self, image_path, page=None, tile=None):
+        base_name = os.path.splitext(os.path.basename(image_path))[0]
+        if page is not None:
+            base_name += f".page{page + 1}"
+        if tile is not None:
+            base_name += ".tile{}_{}_{}x{}".format(*tile)
+        return os.path.join(self.record_dir, base_name)
+
+    def page_count(self, image_path):
+        count = 0
+        while os.path.exists(self.record_path(image_path, count)):
+            count += 1
+        return max(1, count)
+
+    def recognize(self, image_path, page=None):
+        record_path = self.record_path(image_path, page)
+        if not os.path.exists(record_path):
+            raise ImageLoadError(f"記録された観測値が見つかりませんでした: {record_path}")
+        if self.delay:
+            time.sleep(self.delay)
+        return load_observations(record_path)
+
+    def image_size(self, image_path, page=None):
+        size_path = self.size_path(image_path, page)
+        if not os.path.exists(size_path):
+            return None
+        with open(size_path, 'r', encoding='utf-8') as f:
+            size = json.load(f)
+        return size['width'], size['height']
+
+    def recognize_tiles(self, image_path, tiles, page=None, max_workers=None):
+        results = []
+        for tile in tiles:
+            record_path = self.record_path(image_path, page, tile)
+            if not os.path.exists(record_path):
+                raise ImageLoadError(f"記録された観測値が見つかりませんでした: {record_path}")
+            if self.delay:
+                time.sleep(self.delay)
+            results.append(load_observations(record_path))
+        return results
+
+class StubBackend(OCRBackend):
+    """
+    画像の内容にかかわらず、固定の観測値を返すバックエンド
+
+    画像ファイルが存在することだけを確認し、画像は読み込まない。記録済みの観測値も不要なため、
+    任意の画像（サーバーに送られた画像のデータなど）で、認識以外の処理の負荷試験や
+    遅延の計測を行う場合に使用する。delay を指定すると、認識1回ごとにその秒数だけ待機する。
+    """
+
+    def __init__(self, delay=0.0, observations=None):
+        self.delay = delay
+        self.observations = observations if observations is not None else [
+            {'text': "スタブの認識結果", 'x': 0.1, 'y': 0.8, 'width': 0.5, 'height': 0.05, 'confidence': 1.0}
+        ]
+
+    def settings(self):
+        return {'backend': type(self).__name__}
+
+    def recognize(self, image_path, page=None):
+        if not os.path.exists(image_path):
+            raise ImageLoadError(f"画像を読み込めませんでした: {image_path}")
+        if self.delay:
+            time.sleep(self.delay)
+        return [dict(observation) for observation in self.observations]
+
+class RecordingBackend(OCRBackend):
+    """
+    別のバックエンドの認識結果を記録しながら返すバックエンド
+
+    記録されたファイルは ReplayBackend でそのまま再生できる。
+    """
+
+    def __init__(self, backend, record_dir):
+        self.backend = backend
+        self.record_dir = record_dir
+
+    def settings(self):
+        return self.backend.settings()
+
+    def warm_up(self):
+        self.backend.warm_up()
+
+    def page_count(self, image_path):
+        return self.backend.page_count(image_path)
+
+    def recognize(self, image_path, page=None):
+        observations = self.backend.recognize(image_path, page)
+        os.makedirs(self.record_dir, exist_ok=True)
+        save_observations(ReplayBackend(self.record_dir).record_path(image_path, page), observations)
+        return observations
+
+    def image_size(self, image_path, page=None):
+        size = self.backend.image_size(image_path, page)
+        if size is not None:
+            os.makedirs(self.record_dir, exist_ok=True)
+            with open(ReplayBackend(self.record_dir).size_path(image_path, page), 'w', encoding='utf-8') as f:
+                json.dump({'width': size[0], 'height': size[1]}, f)
+        return size
+
+    def recognize_tiles(self, image_path, tiles, page=None, max_workers=None):
+        results = self.backend.recognize_tiles(image_path, tiles, page, max_workers)
+        replay = ReplayBackend(self.record_dir)
+        os.makedirs(self.record_dir, exist_ok=True)
+        for tile, observations in zip(tiles, results):
+            save_observations(replay.record_path(image_path, page, tile), observations)
+        return results
+
+def save_observations(path, observations):
+    """
+    観測値のリストをJSONL形式（1行に1観測値）で保存する
+
+    Parameters:
+    -----------
+    path : str
+        保存先のファイルパス
+    observations : list
+        観測値（辞書）のリスト
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        for observation in observations:
+            f.write(json.dumps(observation, ensure_ascii=False) + "\n")
+
+def load_observations(path):
+    """
+    JSONL形式で保存された観測値のリストを読み込む
+
+    Parameters:
+    -----------
+    path : str
+        読み込むファイルのパス
+
+    Returns:
+    --------
+    list
+        観測値（辞書）のリスト
+    """
+    observations = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                observations.append(json.loads(line))
+    return observations
@@ -0,0 +1,171 @@
+"""
+一括処理モジュール
+
+複数の画像を、ワーカープロセスのプールで並列にOCR処理する process_images を提供します。
+入力のパスは必要な分だけ取り出し、結果は完了したもの（または入力の順）から1件ずつ返すため、
+大量の画像を処理する場合も、入力と結果の全体をメモリに保持しません。
+"""
+
+import functools
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from .core import initialize_worker, combine_pages, recognize_page, _get_default_backend
+from .scheduler import BoundedScheduler, get_process_context
+
+class ImageResult:
+    """
+    process_images が返す1つの画像の処理結果
+
+    Attributes:
+    -----------
+    index : int
+        入力の順序を示すインデックス（0始まり）
+    image_path : str
+        画像ファイルのパス
+    text : str
+        後処理済みのテキスト（処理に失敗した場合はNone）
+    error : str
+        処理に失敗した場合の理由（成功した場合はNone）
+    """
+
+    __slots__ = ('index', 'image_path', 'text', 'error')
+
+    def __init__(self, index, image_path, text=None, error=None):
+        self.index = index
+        self.image_path = image_path
+        self.text = text
+        self.error = error
+
+    def __getstate__(self):
+        return (self.index, self.image_path, self.text, self.error)
+
+    def __setstate__(self, state):
+        self.index, self.image_path, self.text, self.error = state
+
+    @property
+    def ok(self):
+        """処理に成功したかどうか"""
+        return self.error is None
+
+    def __repr__(self):
+        status = 'ok' if self.ok else f"error={self.error!r}"
+        return f"ImageResult(index={self.index}, image_path={self.image_path!r}, {status})"
+
+def process_images(paths, workers=0, ordered=True, chunksize=1, backend=None, format_text=True,
+                   detect_tables=False, analyze_layout=False, conversion_level='conservative',
+                   max_in_flight=None, start_method=None):
+    """
+    複数の画像を並列にOCR処理し、結果を1件ずつ返すジェネレータ
+
+    ワーカープロセスのプールはジェネレータの中で作成し、すべての結果を返した時点
+    （または途中でジェネレータを閉じた時点）で終了する。各ワーカーはバックエンドを1回だけ
+    準備し、すべての画像で再利用する。複数ページの画像は、すべてのページを1つの結果にまとめる。
+
+    Parameters:
+    -----------
+    paths : iterable
+        画像ファイルのパス（必要な分だけ遅延して取り出される）
+    workers : int
+        ワーカープロセスの数（0の場合はCPUコア数）
+    ordered : bool
+        Trueの場合は入力の順、Falseの場合は完了した順に結果を返す
+    chunksize : int
+        1つのタスクでまとめて処理する画像の数（画像が小さく数が多い場合に大きくする）
+    backend : OCRBackend
+        使用するOCRバックエンド（指定しない場合はVisionBackend）
+    format_text, detect_tables, analyze_layout, conversion_level
+        後処理の設定（process_image を参照）
+    max_in_flight : int
+        同時に投入するタスクの最大数（指定しない場合はワーカー数の2倍）。
+        ordered=True の場合は、順番待ちの結果もこの数に含める
+    start_method : str
+        ワーカープロセスの起動方法（get_process_context を参照）
+
+    Yields:
+    -------
+    ImageResult
+        画像ごとの処理結果（失敗した場合も error を設定して返す）
+    """
+    workers = workers if workers > 0 else multiprocessing.cpu_count()
+    max_in_flight = max_in_flight or workers * 2
+    task = functools.partial(_process_chunk, options={
+        'format_text': format_text,
+        'detect_tables': detect_tables,
+        'analyze_layout': analyze_layout,
+        'conversion_level': conversion_level
+    })
+    chunks = _iter_chunks(paths, max(1, chunksize))
+
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=get_process_context(start_method),
+                                   initializer=initialize_worker, initargs=(backend,))
+    try:
+        if ordered:
+            # 先頭のタスクの完了を待って順に返す（順番待ちの結果が max_in_flight を超えて溜まらない）
+            pending = deque()
+            for chunk in chunks:
+                pending.append((chunk, executor.submit(task, chunk)))
+                if len(pending) >= max_in_flight:
+                    yield from _chunk_results(*pending.popleft())
+            while pending:
+                yield from _chunk_results(*pending.popleft())
+        else:
+            for chunk, future in BoundedScheduler(executor, task, max_in_flight).run(chunks):
+                yield from _chunk_results(chunk, future)
+    finally:
+        # 途中でジェネレータを閉じた場合は、開始していないタスクを取り消す
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def _iter_chunks(paths, chunksize):
+    """パスを (index, image_path) のリストにまとめて返す"""
+    chunk = []
+    for index, image_path in enumerate(paths):
+        chunk.append((index, os.fspath(image_path)))
+        if len(chunk) >= chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _chunk_results(chunk, future):
+    """タスクの結果を返す（ワーカーの異常終了などの場合は、タスクのすべての画像を失敗とする）"""
+    try:
+        results = future.result()
+    except Exception as e:
+        results = [ImageResult(index, image_path, error=f"{type(e).__name__}: {str(e)}")
+                   for index, image_path in chunk]
+    yield from results
+
+def _process_chunk(chunk, options):
+    """ワーカープロセスで、まとめた画像を順に処理する"""
+    return [_process_one(index, image_path, options) for index, image_path in chunk]
+
+def _process_one(index, image_path, options, backend=None):
+    if backend is None:
+        backend = _get_default_backend()
+    try:
+        page_count = backend.page_count(image_path)
+    except Exception:
+        page_count = 1
+
+    if page_count <= 1:
+        try:
+            text = recognize_page(image_path, backend).render(**options)
+        except Exception as e:
+            return ImageResult(index, image_path, error=str(e))
+        return ImageResult(index, image_path, text)
+
+    # 複数ページの画像は、失敗したページを除いて1つの結果にまとめる
+    page_texts = []
+    errors = []
+    for page in range(page_count):
+        try:
+            page_texts.append(recognize_page(image_path, backend, page).render(**options))
+        except Exception as e:
+            page_texts.append(None)
+            errors.append(f"ページ {page + 1}: {str(e)}")
+    if len(errors) == page_count:
+        return ImageResult(index, image_path, error="; ".join(errors))
+    return ImageResult(index, image_path, combine_pages(page_texts))
@@ -0,0 +1,339 @@
+"""
+観測値キャッシュモジュール
+
+画像の内容ハッシュと認識設定をキーとして、OCRバックエンドが返した観測値を
+SQLiteに永続化する機能を提供します。整形レベルや表検出の設定だけを変えて
+再実行する場合、認識処理を省略できます。
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from .backend import OCRBackend, ImageLoadError
+
+# キャッシュの既定の上限サイズ（バイト）
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+# 上限を超えた場合に、一度に削除の候補として読み込むエントリの数
+EVICT_BATCH_SIZE = 64
+
+# 内容ハッシュを再利用するファイルの数（プロセスごと）
+DIGEST_MEMO_SIZE = 256
+
+# ヒット数・ミス数などの統計のカウンタ（reset_stats でリセットする。合計サイズのカウンタは含まない）
+STATS_COUNTERS = ('hits', 'misses', 'evictions')
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """
+    ファイル内容のSHA-256ハッシュを返す
+
+    Parameters:
+    -----------
+    path : str
+        ファイルのパス
+    chunk_size : int
+        一度に読み込むバイト数
+
+    Returns:
+    --------
+    str
+        16進数表記のハッシュ値
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# (パス, サイズ, 更新時刻) -> 内容ハッシュ（最近使用した順）
+_digest_memo = OrderedDict()
+_digest_lock = threading.Lock()
+
+def memoized_file_digest(path):
+    """
+    file_digest() の結果を、ファイルのパス・サイズ・更新時刻（ナノ秒）が変わらない間は再利用して返す
+
+    1つの画像の認識で、前処理・画像の大きさの取得・キャッシュなど複数の層が内容ハッシュを
+    必要とする場合に、大きなファイルを何度も読み込まないようにする。
+    保持するハッシュは、最近使用した DIGEST_MEMO_SIZE 件まで。
+
+    Raises:
+    -------
+    OSError
+        ファイルを読み込めなかった場合
+    """
+    return file_digest_record(path)[3]
+
+def file_digest_record(path):
+    """
+    memoized_file_digest() と同じハッシュを、計算したときのファイルのサイズ・更新時刻とともに返す
+
+    別のプロセス（ワーカー）で remember_file_digest() に渡すと、そのプロセスの
+    memoized_file_digest() は、ファイルが変わっていなければ読み込まずにハッシュを返す。
+
+    Returns:
+    --------
+    tuple
+        (パス, サイズ, 更新時刻（ナノ秒）, ハッシュ) のタプル
+
+    Raises:
+    -------
+    OSError
+        ファイルを読み込めなかった場合
+    """
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        digest = _digest_memo.get(key)
+        if digest is not None:
+            _digest_memo.move_to_end(key)
+            return key + (digest,)
+    digest = file_digest(path)
+    remember_file_digest(key + (digest,))
+    return key + (digest,)
+
+def remember_file_digest(record):
+    """file_digest_record() の結果を、このプロセスの memoized_file_digest() の記録に加える"""
+    path, size, mtime_ns, digest = record
+    with _digest_lock:
+        _digest_memo[(path, size, mtime_ns)] = digest
+        _digest_memo.move_to_end((path, size, mtime_ns))
+        while len(_digest_memo) > DIGEST_MEMO_SIZE:
+            _digest_memo.popitem(last=False)
+
+def settings_digest(settings):
+    """認識設定の辞書から、キャッシュキー用のハッシュ値を返す"""
+    encoded = json.dumps(settings, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+class ObservationCache:
+    """
+    SQLiteを使った観測値キャッシュ
+
+    エントリは最終アクセス時刻を持ち、合計サイズが max_bytes を超えると
+    最も古くアクセスされたものから削除される（LRU）。合計サイズは counters テーブルの
+    'size_bytes' に保存と削除のたびに加減して保持するため、保存のたびにテーブル全体を集計しない。
+    ヒット数・ミス数はデータベースに記録されるため、複数のワーカープロセスから
+    使用した場合も合算される。
+
+    接続はスレッドごとに遅延して開くため、インスタンスはpickle可能で、
+    スレッドプールのワーカーからも使用できる。
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.path = os.path.join(cache_dir, 'observations.sqlite3')
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS observations (
+                    image_hash TEXT NOT NULL,
+                    settings_hash TEXT NOT NULL,
+                    data BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (image_hash, settings_hash)
+                )''')
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS observations_last_access ON observations (last_access)')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS counters (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )''')
+            # 合計サイズのカウンタがないデータベース（以前のバージョンで作成したもの）は、一度だけ集計する
+            connection.execute(
+                "INSERT OR IGNORE INTO counters (name, value) "
+                "SELECT 'size_bytes', COALESCE(SUM(size), 0) FROM observations "
+                "WHERE NOT EXISTS (SELECT 1 FROM counters WHERE name = 'size_bytes')")
+            self._local.connection = connection
+        return connection
+
+    def _increment(self, name, amount=1):
+        self._connect().execute(
+            'INSERT INTO counters (name, value) VALUES (?, ?) '
+            'ON CONFLICT(name) DO UPDATE SET value = value + ?', (name, amount, amount))
+
+    def _total_size(self):
+        row = self._connect().execute("SELECT value FROM counters WHERE name = 'size_bytes'").fetchone()
+        return row[0] if row else 0
+
+    def get(self, image_hash, settings_hash):
+        """
+        キャッシュから観測値を取得する
+
+        Parameters:
+        -----------
+        image_hash : str
+            画像内容のハッシュ値
+        settings_hash : str
+            認識設定のハッシュ値
+
+        Returns:
+        --------
+        list or None
+            観測値のリスト、またはキャッシュにない場合はNone
+        """
+        connection = self._connect()
+        row = connection.execute(
+            'SELECT data FROM observations WHERE image_hash = ? AND settings_hash = ?',
+            (image_hash, settings_hash)).fetchone()
+        if row is None:
+            self._increment('misses')
+            return None
+        connection.execute(
+            'UPDATE observations SET last_access = ? WHERE image_hash = ? AND settings_hash = ?',
+            (time.time(), image_hash, settings_hash))
+        self._increment('hits')
+        return json.loads(zlib.decompress(row[0]).decode('utf-8'))
+
+    def put(self, image_hash, settings_hash, observations):
+        """
+        観測値をキャッシュに保存し、必要に応じて古いエントリを削除する
+
+        Parameters:
+        -----------
+        image_hash : str
+            画像内容のハッシュ値
+        settings_hash : str
+            認識設定のハッシュ値
+        observations : list
+            観測値（辞書）のリスト
+        """
+        data = zlib.compress(json.dumps(observations, ensure_ascii=False).encode('utf-8'))
+        connection = self._connect()
+        # 置き換えるエントリのサイズと合計サイズの更新を、他のプロセスの保存と混ざらないようにする
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT size FROM observations WHERE image_hash = ? AND settings_hash = ?',
+                (image_hash, settings_hash)).fetchone()
+            connection.execute(
+                'INSERT OR REPLACE INTO observations (image_hash, settings_hash, data, size, last_access) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (image_hash, settings_hash, data, len(data), time.time()))
+            self._increment('size_bytes', len(data) - (row[0] if row else 0))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        if self._total_size() > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """合計サイズが上限以下になるまで、最終アクセスが古いエントリから削除する"""
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            total = self._total_size()
+            evicted = 0
+            while total > self.max_bytes:
+                # 最終アクセスの索引を使い、古いものから必要な分だけ読み込む
+                rows = connection.execute(
+                    'SELECT rowid, size FROM observations ORDER BY last_access LIMIT ?',
+                    (EVICT_BATCH_SIZE,)).fetchall()
+                if not rows:
+                    break
+                victims = []
+                for rowid, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    victims.append((rowid,))
+                    total -= size
+                connection.executemany('DELETE FROM observations WHERE rowid = ?', victims)
+                evicted += len(victims)
+            if evicted:
+                connection.execute("UPDATE counters SET value = ? WHERE name = 'size_bytes'", (max(total, 0),))
+                self._increment('evictions', evicted)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def stats(self):
+        """
+        キャッシュの統計情報を返す
+
+        Returns:
+        --------
+        dict
+            'hits', 'misses', 'evictions', 'entries', 'size_bytes' を含む辞書
+        """
+        connection = self._connect()
+        counters = dict(connection.execute('SELECT name, value FROM counters').fetchall())
+        entries = connection.execute('SELECT COUNT(*) FROM observations').fetchone()[0]
+        return {
+            'hits': counters.get('hits', 0),
+            'misses': counters.get('misses', 0),
+            'evictions': counters.get('evictions', 0),
+            'entries': entries,
+            'size_bytes': counters.get('size_bytes', 0)
+        }
+
+    def reset_stats(self):
+        """ヒット数・ミス数などのカウンタをリセットする（合計サイズは保持する）"""
+        self._connect().execute(
+            f"DELETE FROM counters WHERE name IN ({', '.join('?' * len(STATS_COUNTERS))})", STATS_COUNTERS)
+
+class CachedBackend(OCRBackend):
+    """
+    別のバックエンドの結果を ObservationCache 経由で返すバックエンド
+
+    キャッシュのキーは画像内容のハッシュと、バックエンドの settings()（とページ番号）の組み合わせ。
+    """
+
+    def __init__(self, backend, cache):
+        self.backend = backend
+        self.cache = cache
+
+    def settings(self):
+        return self.backend.settings()
+
+    def warm_up(self):
+        self.backend.warm_up()
+
+    def page_count(self, image_path):
+        return self.backend.page_count(image_path)
+
+    def image_size(self, image_path, page=None):
+        return self.backend.image_size(image_path, page)
+
+    def recognize_tiles(self, image_path, tiles, page=None, max_workers=None):
+        return self.backend.recognize_tiles(image_path, tiles, page, max_workers)
+
+    def recognize(self, image_path, page=None):
+        try:
+            image_hash = memoized_file_digest(image_path)
+        except OSError:
+            raise ImageLoadError(f"画像を読み込めませんでした: {image_path}")
+        settings = self.settings()
+        if page is not None:
+            settings = dict(settings, page=page)
+        settings_hash = settings_digest(settings)
+        observations = self.cache.get(image_hash, settings_hash)
+        if observations is None:
+            observations = self.backend.recognize(image_path, page)
+            self.cache.put(image_hash, settings_hash, observations)
+        return observations
@@ -1,21 +1,21 @@
 """
 OCR処理の中核モジュール
 
-AppleのVisionフレームワークを使用して、画像からテキストを抽出する機能を提供します。
+OCRバックエンド（既定ではAppleのVisionフレームワーク）を使用して、
+画像からテキストを抽出する機能を提供します。
 """
 
-from Foundation import NSURL
-from Vision import VNRecognizeTextRequest, VNImageRequestHandler, VNRequestTextRecognitionLevelAccurate
-from Quartz import CIImage
+import logging
 import os
 
 # 他のモジュールをインポート
-from .formatter import format_ocr_text
-from .markdown import convert_to_markdown
-from .table import detect_and_convert_tables
-from .layout import analyze_and_convert_layout
+from . import metrics
+from .page import OCRPage
+from .backend import VisionBackend, ImageLoadError, RecognitionError
 
-def process_image(image_path, format_text=True, detect_tables=False, analyze_layout=False, conversion_level='conservative'):
+logger = logging.getLogger(__name__)
+
+def process_image(image_path, format_text=True, detect_tables=False, analyze_layout=False, conversion_level='conservative', backend=None, page=None):
     """
     画像ファイルからテキストを抽出する
     
@@ -31,82 +31,199 @@ def process_image(image_path, format_text=True, detect_tables=False, analyze_lay
         複雑なレイアウト解析を行うかどうか
     conversion_level : str
         変換の積極性レベル ('conservative', 'moderate', 'aggressive')
+    backend : OCRBackend
+        使用するOCRバックエンド（指定しない場合はVisionBackend）
+    page : int
+        複数ページの画像の場合に処理するページ番号（0始まり）
     
     Returns:
     --------
     str
         抽出されたテキスト
     """
-    print(f"OCR処理開始: {os.path.basename(image_path)}")
+    result = try_recognize_page(image_path, backend, page)
+    if isinstance(result, str):
+        return result
+    return result.render(format_text, detect_tables, analyze_layout, conversion_level)
+
+def try_recognize_page(image_path, backend=None, page=None):
+    """
+    画像からテキストを認識する（process_image の認識部分）
     
-    # 画像の読み込み
-    image_url = NSURL.fileURLWithPath_(image_path)
-    image = CIImage.imageWithContentsOfURL_(image_url)
+    recognize_page と異なり、画像の読み込みや認識に失敗した場合は、例外の代わりに
+    失敗を示すテキストを返す。認識と後処理を別のスレッドやプロセスで行う場合に使用する。
+    
+    Parameters:
+    -----------
+    image_path : str
+        画像ファイルのパス
+    backend : OCRBackend
+        使用するOCRバックエンド（指定しない場合はVisionBackend）
+    page : int
+        複数ページの画像の場合に処理するページ番号（0始まり）
     
-    if image is None:
-        print(f"警告: 画像を読み込めませんでした: {image_path}")
+    Returns:
+    --------
+    OCRPage or str
+        認識結果。失敗した場合は失敗を示すテキスト
+    """
+    label = os.path.basename(image_path) if page is None else f"{os.path.basename(image_path)} (ページ {page + 1})"
+    logger.debug(f"OCR処理開始: {label}")
+    
+    try:
+        result = recognize_page(image_path, backend, page)
+    except ImageLoadError:
+        logger.warning(f"警告: 画像を読み込めませんでした: {image_path}")
         return "画像の読み込みに失敗しました。"
+    except RecognitionError:
+        logger.warning(f"警告: OCR処理に失敗しました: {image_path}")
+        return "OCR処理に失敗しました。"
     
-    # OCRリクエストの作成
-    request = VNRecognizeTextRequest.alloc().init()
-    request.setRecognitionLevel_(VNRequestTextRecognitionLevelAccurate)
+    if not result:
+        logger.warning(f"警告: テキストが検出されませんでした: {image_path}")
     
-    # 日本語を含む言語をサポート
-    request.setRecognitionLanguages_(["ja", "en"])
+    logger.debug(f"OCR処理完了: {label}")
     
-    # OCR処理の実行
-    handler = VNImageRequestHandler.alloc().initWithCIImage_options_(image, None)
-    success = handler.performRequests_error_([request], None)
+    return result
+
+def recognize_page(image_path, backend=None, page=None):
+    """
+    画像ファイルからテキストを認識し、位置情報を含むOCR結果を返す
     
-    if not success:
-        print(f"警告: OCR処理に失敗しました: {image_path}")
-        return "OCR処理に失敗しました。"
+    Parameters:
+    -----------
+    image_path : str
+        画像ファイルのパス
+    backend : OCRBackend
+        使用するOCRバックエンド（指定しない場合はVisionBackend）
+    page : int
+        複数ページの画像の場合に処理するページ番号（0始まり）
+    
+    Returns:
+    --------
+    OCRPage
+        OCR結果（render() で後処理したテキストを取得できる）
+    
+    Raises:
+    -------
+    ImageLoadError
+        画像を読み込めなかった場合
+    RecognitionError
+        認識処理に失敗した場合
+    """
+    if backend is None:
+        backend = _get_default_backend()
+    with metrics.stage('recognize'):
+        observations = backend.recognize(image_path, page)
+    
+    if metrics.is_recording():
+        metrics.count('observations', len(observations))
+        try:
+            metrics.count('image_bytes', os.path.getsize(image_path))
+            size = backend.image_size(image_path, page)
+        except Exception:
+            size = None
+        if size is not None:
+            metrics.count('image_pixels', size[0] * size[1])
+    
+    return OCRPage.from_observations(observations, image_path=image_path, page=page)
+
+def render_observations(observations, format_text=True, detect_tables=False, analyze_layout=False, conversion_level='conservative'):
+    """
+    観測値のリストからテキストを生成し、後処理を行う
+    
+    Parameters:
+    -----------
+    observations : list or OCRPage
+        OCRバックエンドが返した観測値（辞書）のリスト、またはOCR結果
+    format_text : bool
+        テキスト整形を行うかどうか
+    detect_tables : bool
+        表の検出と変換を行うかどうか
+    analyze_layout : bool
+        複雑なレイアウト解析を行うかどうか
+    conversion_level : str
+        変換の積極性レベル ('conservative', 'moderate', 'aggressive')
+    
+    Returns:
+    --------
+    str
+        後処理済みのテキスト
+    """
+    if not isinstance(observations, OCRPage):
+        observations = OCRPage.from_observations(observations)
+    return observations.render(format_text, detect_tables, analyze_layout, conversion_level)
+
+def combine_pages(page_texts):
+    """
+    ページごとに処理したテキストを、ページ順に1つのテキストへまとめる
     
-    # 結果の取得
-    results = request.results()
-    text = ""
-    
-    # 位置情報を含むテキスト行のリスト（レイアウト解析用）
-    text_lines_with_position = []
-    
-    if results:
-        for observation in results:
-            candidates = observation.topCandidates_(1)
-            if candidates and len(candidates) > 0:
-                candidate = candidates[0]
-                text += candidate.string() + "\n"
-                
-                # レイアウト解析が有効な場合、位置情報を保存
-                if analyze_layout:
-                    # boundingBoxはNSRectで、左下原点の座標系
-                    bounding_box = observation.boundingBox()
-                    text_lines_with_position.append({
-                        'text': candidate.string(),
-                        'x': bounding_box.origin.x,
-                        'y': bounding_box.origin.y,
-                        'width': bounding_box.size.width,
-                        'height': bounding_box.size.height
-                    })
-    else:
-        print(f"警告: テキストが検出されませんでした: {image_path}")
-        text = "テキストが検出されませんでした。"
-    
-    print(f"OCR処理完了: {os.path.basename(image_path)}")
-    
-    # テキストの後処理
-    if format_text:
-        # 基本的なテキスト整形
-        formatted_text = format_ocr_text(text)
-        
-        # 表の検出と変換
-        if detect_tables:
-            formatted_text = detect_and_convert_tables(formatted_text, conversion_level)
-        
-        # 複雑なレイアウト解析
-        if analyze_layout and text_lines_with_position:
-            formatted_text = analyze_and_convert_layout(formatted_text, text_lines_with_position, conversion_level)
-        
-        # Markdown形式に変換
-        return convert_to_markdown(formatted_text)
-    else:
-        return text
+    各ページの先頭には、ページ内リンク用のアンカー（<a id="page-N"></a>）を付ける。
+    
+    Parameters:
+    -----------
+    page_texts : list
+        ページ順のテキストのリスト（処理に失敗したページはNone）
+    
+    Returns:
+    --------
+    str
+        まとめたテキスト
+    """
+    parts = []
+    for number, text in enumerate(page_texts, 1):
+        if text is None:
+            text = f"ページ {number} の処理に失敗しました。"
+        parts.append(f'<a id="page-{number}"></a>\n\n{text}')
+    return "\n\n".join(parts)
+
+_default_backend = None
+
+def initialize_worker(backend=None):
+    """
+    ワーカープロセスの初期化処理（ProcessPoolExecutorのinitializerとして使用）
+    
+    バックエンドをプロセス内の既定のバックエンドとして設定し、フレームワークの
+    読み込みと認識モデルの準備を済ませておく。以降、このプロセスで backend を
+    指定せずに process_image を呼び出すと、このバックエンドが再利用される。
+    
+    プロセス内の既定を置き換えるため、ワーカープロセス専用。同じプロセスのスレッドで
+    認識する場合は prepare_backend() で準備したバックエンドを各呼び出しに渡す。
+    
+    Parameters:
+    -----------
+    backend : OCRBackend
+        使用するOCRバックエンド（指定しない場合はVisionBackend）
+    """
+    global _default_backend
+    _default_backend = prepare_backend(backend)
+
+def prepare_backend(backend=None):
+    """
+    フレームワークの読み込みと認識モデルの準備を済ませたバックエンドを返す
+    （プロセス内の既定のバックエンドは変更しない）
+    
+    Parameters:
+    -----------
+    backend : OCRBackend
+        使用するOCRバックエンド（指定しない場合はVisionBackend）
+    
+    Returns:
+    --------
+    OCRBackend
+        準備したバックエンド（準備に失敗した場合も返し、認識の時点でエラーにする）
+    """
+    if backend is None:
+        backend = VisionBackend()
+    try:
+        backend.warm_up()
+    except Exception as e:
+        logger.warning(f"警告: OCRバックエンドの準備中にエラーが発生しました: {str(e)}")
+    return backend
+
+def _get_default_backend():
+    """プロセス内で共有する既定のバックエンド（Vision）を返す"""
+    global _default_backend
+    if _default_backend is None:
+        _default_backend = VisionBackend()
+    return _default_backend
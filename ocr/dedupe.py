@@ -0,0 +1,316 @@
+"""
+重複画像の検出モジュール
+
+同じ内容の画像（ファイル名だけが異なるコピーなど）をまとめ、グループごとに1枚だけを
+認識するための機能を提供します。内容のハッシュが一致する画像に加えて、必要に応じて
+知覚ハッシュ（縮小したグレースケール画像の輝度の勾配から作るハッシュ）が近い画像も
+同じグループにまとめます（形式の変換や再圧縮で内容のハッシュが変わった画像など）。
+
+知覚ハッシュは文字の細部を区別できないため、レイアウトの似た別のページを誤ってまとめないよう、
+ピクセル数が同じ画像どうしで、ハッシュの差（ハミング距離）が小さい場合だけを候補とし、
+さらに高い解像度で縮小した画像をブロックごとに比べて、どのブロックの輝度の差も小さい場合だけをまとめます
+（数字が1文字異なるだけのページは、そのブロックの差が大きくなるため別のグループになります）。
+"""
+
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import file_digest_record
+
+# 知覚ハッシュの格子の大きさ（HASH_SIZE × HASH_SIZE ビット）
+HASH_SIZE = 16
+
+# 知覚ハッシュで同じ画像とみなす、ハミング距離の既定の上限
+DEFAULT_MAX_DISTANCE = 6
+
+# 知覚ハッシュが近い画像を比べる縮小画像の長辺のピクセル数
+VERIFY_SIZE = 512
+
+# 縮小画像を比べるブロックの大きさ（VERIFY_BLOCK × VERIFY_BLOCK ピクセル）
+VERIFY_BLOCK = 8
+
+# 同じ画像とみなす、ブロックごとの輝度の差（0〜255）の平均の上限
+MAX_BLOCK_DIFFERENCE = 12
+
+def difference_hash(pixels, hash_size=HASH_SIZE):
+    """
+    グレースケール画像の輝度から、差分ハッシュ（dHash）を作成する
+
+    各行で隣り合うピクセルの輝度を比べ、右が明るい場合に1とするビットを並べる。
+
+    Parameters:
+    -----------
+    pixels : bytes
+        (hash_size + 1) × hash_size ピクセルのグレースケール画像（行ごとに左から右、1ピクセル1バイト）
+    hash_size : int
+        格子の大きさ
+
+    Returns:
+    --------
+    int
+        hash_size × hash_size ビットのハッシュ値
+    """
+    width = hash_size + 1
+    if len(pixels) != width * hash_size:
+        raise ValueError(f"ピクセル数が正しくありません: {len(pixels)}（{width * hash_size} が必要）")
+    value = 0
+    for row in range(hash_size):
+        offset = row * width
+        for column in range(hash_size):
+            value = (value << 1) | (pixels[offset + column + 1] > pixels[offset + column])
+    return value
+
+def hamming_distance(a, b):
+    """2つのハッシュ値の異なるビットの数を返す"""
+    return bin(a ^ b).count('1')
+
+def perceptual_available():
+    """知覚ハッシュを計算できるかどうか（画像の縮小にQuartzを使用する）"""
+    return importlib.util.find_spec('Quartz') is not None
+
+def blocks_match(a, b, width, height, block=VERIFY_BLOCK, max_difference=MAX_BLOCK_DIFFERENCE):
+    """
+    同じ大きさの2つのグレースケール画像を、ブロックごとに比べる
+
+    画像全体の差の平均では、一部の文字だけが異なる画像を区別できないため、
+    block × block ピクセルのブロックごとに輝度の差の平均を求め、すべてが上限以下かどうかを返す。
+
+    Parameters:
+    -----------
+    a, b : bytes
+        width × height ピクセルのグレースケール画像（行ごとに左から右、1ピクセル1バイト）
+    width, height : int
+        画像の幅と高さ
+    block : int
+        ブロックの大きさ
+    max_difference : float
+        ブロックごとの輝度の差の平均の上限
+
+    Returns:
+    --------
+    bool
+        すべてのブロックの差が上限以下の場合はTrue
+    """
+    if len(a) != width * height or len(b) != width * height:
+        raise ValueError(f"ピクセル数が正しくありません: {len(a)}, {len(b)}（{width * height} が必要）")
+    for top in range(0, height, block):
+        rows = range(top, min(top + block, height))
+        for left in range(0, width, block):
+            right = min(left + block, width)
+            total = 0
+            for row in rows:
+                start = row * width
+                total += sum(abs(x - y) for x, y in zip(a[start + left:start + right], b[start + left:start + right]))
+            if total > max_difference * len(rows) * (right - left):
+                return False
+    return True
+
+def perceptual_hash(image_path, hash_size=HASH_SIZE):
+    """
+    画像の知覚ハッシュを返す
+
+    画像を縮小しながらデコードし（フル解像度で展開しない）、(hash_size + 1) × hash_size の
+    グレースケール画像に描画してから difference_hash() でハッシュを作成する。
+
+    Returns:
+    --------
+    tuple or None
+        (幅, 高さ, ハッシュ値) のタプル（幅と高さは元画像のピクセル数）。画像を読み込めない場合はNone
+    """
+    loaded = _load_thumbnail(image_path, hash_size * 8)
+    if loaded is None:
+        return None
+    width, height, image = loaded
+    pixels = _draw_grayscale(image, hash_size + 1, hash_size)
+    return width, height, difference_hash(pixels, hash_size)
+
+def verification_pixels(image_path, size=VERIFY_SIZE):
+    """
+    知覚ハッシュが近い画像を blocks_match() で比べるための、縮小したグレースケール画像を返す
+
+    長辺が size ピクセル（元画像の方が小さい場合は元の大きさ）になるよう、縦横比を保って縮小する。
+
+    Returns:
+    --------
+    tuple or None
+        (幅, 高さ, ピクセル) のタプル（幅と高さは縮小後のピクセル数）。画像を読み込めない場合はNone
+    """
+    loaded = _load_thumbnail(image_path, size)
+    if loaded is None:
+        return None
+    width, height, image = loaded
+    scale = min(1.0, size / max(width, height))
+    width, height = max(1, round(width * scale)), max(1, round(height * scale))
+    return width, height, _draw_grayscale(image, width, height)
+
+class NearDuplicateIndex:
+    """
+    ハミング距離が max_distance 以下のハッシュ値を検索する索引
+
+    ハッシュ値を max_distance + 1 個の区間に分けると、距離が max_distance 以下の2つの値は
+    少なくとも1つの区間が完全に一致する（鳩の巣原理）。区間ごとの辞書で候補を絞り込み、
+    候補だけの距離を計算するため、登録数が多い場合も全件と比較しない。
+    """
+
+    def __init__(self, max_distance=DEFAULT_MAX_DISTANCE, bits=HASH_SIZE * HASH_SIZE):
+        self.max_distance = max_distance
+        parts = max_distance + 1
+        bounds = [bits * i // parts for i in range(parts + 1)]
+        self._parts = [(start, (1 << (end - start)) - 1) for start, end in zip(bounds, bounds[1:])]
+        self._tables = [{} for _ in self._parts]
+        self._count = 0
+
+    def find(self, value):
+        """value との距離が max_distance 以下の登録済みの項目を返す（最も近いもの。ない場合はNone）"""
+        matches = self.matches(value)
+        return matches[0] if matches else None
+
+    def matches(self, value):
+        """value との距離が max_distance 以下の登録済みの項目を、近い順（同じ距離の場合は登録順）に返す"""
+        found = {}
+        for (start, mask), table in zip(self._parts, self._tables):
+            for order, (candidate, item) in table.get((value >> start) & mask, ()):
+                distance = hamming_distance(value, candidate)
+                if distance <= self.max_distance:
+                    found[order] = (distance, order, item)
+        return [item for _, _, item in sorted(found.values(), key=lambda entry: entry[:2])]
+
+    def add(self, value, item):
+        """ハッシュ値と項目を登録する"""
+        order = self._count
+        self._count += 1
+        for (start, mask), table in zip(self._parts, self._tables):
+            table.setdefault((value >> start) & mask, []).append((order, (value, item)))
+
+def group_duplicates(paths, perceptual=False, max_distance=DEFAULT_MAX_DISTANCE, max_workers=None, digests=None):
+    """
+    画像を、同じ内容のものどうしのグループにまとめる
+
+    ファイルの読み込みとハッシュの計算はスレッドで並列に行う。
+
+    Parameters:
+    -----------
+    paths : list
+        画像ファイルのパス
+    perceptual : bool
+        内容のハッシュが一致する画像に加えて、知覚ハッシュが近く、縮小画像を blocks_match() で
+        比べても一致する画像もまとめるかどうか
+    max_distance : int
+        知覚ハッシュで同じ画像とみなすハミング距離の上限
+    max_workers : int
+        ハッシュを計算するスレッドの数（Noneの場合は既定の数）
+    digests : dict
+        指定した場合は、各グループの代表の画像のパス -> file_digest_record() の結果を設定する
+        （認識するワーカーで remember_file_digest() に渡し、同じファイルを再び読み込まないようにする）
+
+    Returns:
+    --------
+    list
+        グループ（パスのリスト）のリスト。各グループの先頭は paths で最初に現れる画像（代表の画像）で、
+        グループは代表の画像の順に並ぶ。ハッシュを計算できなかった画像は、それぞれ1枚だけのグループになる
+    """
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='dedupe') as executor:
+        records = list(executor.map(_content_key, paths))
+        groups = []
+        by_digest = {}
+        for path, record in zip(paths, records):
+            digest = record[3] if record is not None else None
+            if digest is not None and digest in by_digest:
+                by_digest[digest].append(path)
+                continue
+            group = [path]
+            groups.append(group)
+            if digest is not None:
+                by_digest[digest] = group
+                if digests is not None:
+                    digests[path] = record
+        if not perceptual:
+            return groups
+
+        # 内容が異なるグループの代表どうしを、知覚ハッシュで比べてまとめる
+        hashes = list(executor.map(_perceptual_key, [group[0] for group in groups]))
+
+    merged = []
+    indexes = {}  # (幅, 高さ) -> NearDuplicateIndex
+    thumbnails = {}  # 代表の画像のパス -> verification_pixels() の結果（候補になった画像だけ読み込む）
+    for group, key in zip(groups, hashes):
+        if key is None:
+            merged.append(group)
+            continue
+        width, height, value = key
+        index = indexes.setdefault((width, height), NearDuplicateIndex(max_distance))
+        target = _verified_match(group[0], index.matches(value), thumbnails)
+        if target is not None:
+            target.extend(group)
+            continue
+        merged.append(group)
+        index.add(value, group)
+    return merged
+
+def _verified_match(path, candidates, thumbnails):
+    """知覚ハッシュが近いグループのうち、縮小画像のブロックごとの比較でも一致する最初のグループを返す"""
+    for candidate in candidates:
+        a = _cached_verification_pixels(path, thumbnails)
+        b = _cached_verification_pixels(candidate[0], thumbnails)
+        if a is None or b is None:
+            return None
+        if a[:2] == b[:2] and blocks_match(a[2], b[2], *a[:2]):
+            return candidate
+    return None
+
+def _cached_verification_pixels(path, thumbnails):
+    if path not in thumbnails:
+        try:
+            thumbnails[path] = verification_pixels(path)
+        except Exception:
+            thumbnails[path] = None
+    return thumbnails[path]
+
+def _load_thumbnail(image_path, max_pixel_size):
+    """画像を縮小しながらデコードし、(元の幅, 元の高さ, 縮小した画像) を返す（読み込めない場合はNone）"""
+    from Foundation import NSURL
+    from Quartz import (CGImageSourceCreateWithURL, CGImageSourceCopyPropertiesAtIndex,
+                        CGImageSourceCreateThumbnailAtIndex, kCGImageSourceCreateThumbnailFromImageAlways,
+                        kCGImageSourceThumbnailMaxPixelSize, kCGImagePropertyPixelWidth, kCGImagePropertyPixelHeight)
+
+    source = CGImageSourceCreateWithURL(NSURL.fileURLWithPath_(image_path), None)
+    if source is None:
+        return None
+    properties = CGImageSourceCopyPropertiesAtIndex(source, 0, None)
+    if not properties:
+        return None
+    width = properties.get(kCGImagePropertyPixelWidth)
+    height = properties.get(kCGImagePropertyPixelHeight)
+    options = {
+        kCGImageSourceCreateThumbnailFromImageAlways: True,
+        kCGImageSourceThumbnailMaxPixelSize: max_pixel_size
+    }
+    image = CGImageSourceCreateThumbnailAtIndex(source, 0, options)
+    if image is None or width is None or height is None:
+        return None
+    return int(width), int(height), image
+
+def _draw_grayscale(image, width, height):
+    """画像を width × height のグレースケール画像に描画し、輝度を読み出す（行の末尾の余白は除く）"""
+    from Quartz import (CGColorSpaceCreateDeviceGray, CGBitmapContextCreate, CGBitmapContextCreateImage,
+                        CGContextDrawImage, CGRectMake, kCGImageAlphaNone, CGImageGetBytesPerRow,
+                        CGImageGetDataProvider, CGDataProviderCopyData)
+
+    context = CGBitmapContextCreate(None, width, height, 8, 0, CGColorSpaceCreateDeviceGray(), kCGImageAlphaNone)
+    CGContextDrawImage(context, CGRectMake(0, 0, width, height), image)
+    drawn = CGBitmapContextCreateImage(context)
+    data = bytes(CGDataProviderCopyData(CGImageGetDataProvider(drawn)))
+    bytes_per_row = CGImageGetBytesPerRow(drawn)
+    return b''.join(data[row * bytes_per_row:row * bytes_per_row + width] for row in range(height))
+
+def _content_key(path):
+    try:
+        return file_digest_record(path)
+    except OSError:
+        return None
+
+def _perceptual_key(path):
+    try:
+        return perceptual_hash(path)
+    except Exception:
+        return None
@@ -6,6 +6,9 @@ OCR結果のテキストを整形する機能を提供します。
 
 import re
 
+# 段落の終わりとみなす行末の句読点
+_PARAGRAPH_END_PATTERN = re.compile(r'[。．.、，,!！?？]$')
+
 def format_ocr_text(text):
     """
     OCR結果のテキストを整形する
@@ -25,12 +28,30 @@ def format_ocr_text(text):
     if not text or text.isspace():
         return text
     
+    return '\n'.join(format_ocr_lines(text.splitlines()))
+
+def format_ocr_lines(lines):
+    """
+    OCR結果の行のリストを整形し、整形後のテキストの行のリストを返す
+    
+    format_ocr_text と同じ整形を行い、結果を '\n' で結合すると format_ocr_text の結果と一致する。
+    テキストを結合・再分割せずに、行のまま次の処理に渡す場合に使用する。
+    
+    Parameters:
+    -----------
+    lines : list
+        テキストの行のリスト（改行文字を含まない）
+    
+    Returns:
+    --------
+    list
+        整形されたテキストの行のリスト
+    """
     # 段落を検出して処理
     paragraphs = []
     current_paragraph = []
     
     # 行ごとに処理
-    lines = text.splitlines()
     for i, line in enumerate(lines):
         # 空行は段落の区切りとして扱う
         if not line or line.isspace():
@@ -41,7 +62,7 @@ def format_ocr_text(text):
             continue
         
         # 行末が句読点で終わる場合は段落の終わりとして扱う
-        if re.search(r'[。．.、，,!！?？]$', line):
+        if _PARAGRAPH_END_PATTERN.search(line):
             current_paragraph.append(line)
             paragraphs.append(' '.join(current_paragraph))
             current_paragraph = []
@@ -61,10 +82,19 @@ def format_ocr_text(text):
     if current_paragraph:
         paragraphs.append(' '.join(current_paragraph))
     
-    # 段落を改行で結合
-    formatted_text = '\n\n'.join(paragraphs)
-    
-    # 連続する空行を1つにまとめる
-    formatted_text = re.sub(r'\n{3,}', '\n\n', formatted_text)
-    
-    return formatted_text
+    # 段落を空行1つで区切る（連続する空行は1つにまとめ、先頭・末尾の空行は改行2つ分にする）
+    result = []
+    pending_blank = False
+    for paragraph in paragraphs:
+        if not paragraph:
+            pending_blank = True
+            continue
+        if result:
+            result.append('')
+        elif pending_blank:
+            result.extend(('', ''))
+        result.append(paragraph)
+        pending_blank = False
+    if pending_blank:
+        result.extend(('', ''))
+    return result or ['']
@@ -4,6 +4,8 @@
 テキストのレイアウトを解析し、適切なMarkdown形式に変換する機能を提供します。
 """
 
+from bisect import bisect_left
+
 def analyze_and_convert_layout(text, text_lines_with_position, conversion_level='conservative'):
     """
     テキストのレイアウトを解析し、適切なMarkdown形式に変換する
@@ -55,31 +57,21 @@ def detect_and_convert_indentation(lines, text_lines_with_position, conversion_l
     if not lines or not text_lines_with_position:
         return lines
     
-    # X座標でソートして、最も左にある行を基準とする
-    sorted_lines = sorted(text_lines_with_position, key=lambda x: x['x'])
-    base_x = sorted_lines[0]['x']
+    # 最も左にある行のX座標を基準とする
+    base_x = min(pos_line['x'] for pos_line in text_lines_with_position)
     
     # インデントレベルのしきい値（ピクセル単位）
     indent_threshold = 20
     
+    # 各行に対応する位置情報を求める
+    matching_lines = align_lines_to_positions(lines, text_lines_with_position)
+    
     # 各行のインデントレベルを計算
     result_lines = []
     
-    for i, line in enumerate(lines):
-        if not line.strip():
-            # 空行はそのまま追加
-            result_lines.append(line)
-            continue
-        
-        # 対応する位置情報を探す
-        matching_line = None
-        for pos_line in text_lines_with_position:
-            if pos_line['text'] in line:
-                matching_line = pos_line
-                break
-        
+    for line, matching_line in zip(lines, matching_lines):
         if not matching_line:
-            # 位置情報が見つからない場合はそのまま追加
+            # 空行や位置情報が見つからない行はそのまま追加
             result_lines.append(line)
             continue
         
@@ -94,3 +86,95 @@ def detect_and_convert_indentation(lines, text_lines_with_position, conversion_l
             result_lines.append(line)
     
     return result_lines
+
+def align_lines_to_positions(lines, text_lines_with_position, lookahead=32):
+    """
+    テキストの各行に対応する位置情報を、観測値の順序を保ったまま求める
+    
+    整形後の行は、OCRの観測値を出現順にスペースで連結したものになっている。
+    そのため、次の手順で線形時間で対応付ける。
+    1. 行全体と一致する観測値をテキストのハッシュで引く
+    2. 現在位置から lookahead 件以内で、行の先頭と一致する観測値を探し、
+       段落として連結された観測値の分だけ現在位置を進める
+    3. 見つからない場合は、行をスペース位置で区切った先頭部分をハッシュで引く
+    
+    Parameters:
+    -----------
+    lines : list
+        テキストの行のリスト
+    text_lines_with_position : list
+        位置情報を含むテキスト行のリスト（OCRの出現順）
+    lookahead : int
+        先頭一致を探す観測値の最大件数
+    
+    Returns:
+    --------
+    list
+        各行に対応する位置情報（辞書）、または対応するものがない場合はNone のリスト
+    """
+    positions = text_lines_with_position
+    
+    # テキストごとの観測値インデックス（昇順）
+    buckets = {}
+    for index, pos_line in enumerate(positions):
+        buckets.setdefault(pos_line['text'], []).append(index)
+    
+    def find_in_bucket(text, start):
+        indices = buckets.get(text)
+        if not indices:
+            return None
+        k = bisect_left(indices, start)
+        return indices[k] if k < len(indices) else indices[0]
+    
+    matches = []
+    cursor = 0
+    
+    for line in lines:
+        if not line.strip():
+            matches.append(None)
+            continue
+        
+        # 1. 行全体と一致する観測値
+        index = find_in_bucket(line, cursor)
+        if index is not None:
+            matches.append(positions[index])
+            if index >= cursor:
+                cursor = index + 1
+            continue
+        
+        # 2. 現在位置付近で行の先頭と一致する観測値
+        index = None
+        for candidate in range(cursor, min(cursor + lookahead, len(positions))):
+            text = positions[candidate]['text']
+            if text and line.startswith(text) and line.startswith(' ', len(text)):
+                index = candidate
+                break
+        
+        # 3. スペース位置で区切った先頭部分と一致する観測値
+        if index is None:
+            space = line.find(' ')
+            while space > 0:
+                index = find_in_bucket(line[:space], cursor)
+                if index is not None:
+                    break
+                space = line.find(' ', space + 1)
+        
+        if index is None:
+            matches.append(None)
+            continue
+        
+        matches.append(positions[index])
+        if index < cursor:
+            continue
+        
+        # 段落として連結された後続の観測値の分だけ現在位置を進める
+        offset = len(positions[index]['text'])
+        cursor = index + 1
+        while cursor < len(positions) and line.startswith(' ', offset):
+            text = positions[cursor]['text']
+            if not text or not line.startswith(text, offset + 1):
+                break
+            offset += 1 + len(text)
+            cursor += 1
+    
+    return matches
@@ -6,6 +6,27 @@ Markdown変換モジュール
 
 import re
 
+# 見出し・リストの判定に使用する正規表現（事前にコンパイルしておく）
+_NUMBER_PREFIX_PATTERN = re.compile(r'^(\d+[\.\)]) (.+)$')
+_CHAPTER_PATTERN = re.compile(r'^(第\s*\d+\s*[章節]|[０-９]+[．\.]) (.+)$')
+_PREFIX_PATTERN = re.compile(r'^(はじめに|概要|序論|結論|まとめ|目次|付録|参考文献)[:：]?\s*(.+)?$')
+_BULLET_PATTERN = re.compile(r'^[\s　]*([・\-\*•◦‣⁃]) (.+)$')
+_NUMBER_LIST_PATTERN = re.compile(r'^[\s　]*(\d+[\.\)]) (.+)$')
+
+# 行頭の1文字で、どのパターンを試す必要があるかを判定する
+_PREFIX_FIRST_CHARS = frozenset('は概序結ま目付参')
+_BULLET_CHARS = frozenset('・-*•◦‣⁃')
+
+# 強調の区切り文字: 文字 -> (種類, 開き(True)/閉じ(False)/両用(None))
+_EMPHASIS_CHAR_PATTERN = re.compile(r'[「」『』＊＿]')
+_EMPHASIS_DELIMITERS = {
+    '「': (0, True), '」': (0, False),
+    '『': (1, True), '』': (1, False),
+    '＊': (2, None),
+    '＿': (3, None),
+}
+_EMPHASIS_MARKERS = ('**', '*', '**', '*')
+
 def convert_to_markdown(text):
     """
     整形されたテキストをMarkdown形式に変換する
@@ -26,34 +47,97 @@ def convert_to_markdown(text):
     if not text:
         return text
     
-    # 行ごとに処理
-    lines = text.splitlines()
-    markdown_lines = []
+    return '\n'.join(iter_markdown_lines(text.splitlines()))
+
+def iter_markdown_lines(lines, table_rows=()):
+    """
+    行のイテラブルを受け取り、Markdown形式に変換した行を順に返す
+    
+    見出しの判定に次の行が必要なため、1行だけ先読みする。
+    大きなテキストを一度にメモリへ載せずに変換する場合に使用する。
     
-    # 前後の行のコンテキストを考慮して処理
-    for i, line in enumerate(lines):
-        # 空行はそのまま追加
-        if not line or line.isspace():
-            markdown_lines.append(line)
-            continue
-        
-        # 見出しの検出
-        heading_line = detect_heading(line, i, lines)
-        if heading_line != line:  # 見出しとして検出された場合
-            markdown_lines.append(heading_line)
-            continue
-        
-        # リストの検出
-        list_line = detect_list(line)
-        if list_line != line:  # リストとして検出された場合
-            markdown_lines.append(list_line)
-            continue
-        
-        # テキスト強調の検出
-        emphasized_line = detect_emphasis(line)
-        markdown_lines.append(emphasized_line)
+    Parameters:
+    -----------
+    lines : iterable
+        テキストの行（改行文字を含まない）
+    table_rows : collection
+        表の検出で作成したMarkdown形式の表の行の番号（0から）。
+        これらの行は見出し・リストとして扱わず、強調の検出だけを行う
+    
+    Yields:
+    -------
+    str
+        Markdown形式に変換された行
+    """
+    iterator = iter(lines)
+    line = next(iterator, None)
+    if line is None:
+        return
+    
+    index = 0
+    for next_line in iterator:
+        yield detect_emphasis(line) if index in table_rows else convert_line(line, not next_line.strip())
+        line = next_line
+        index += 1
     
-    return '\n'.join(markdown_lines)
+    yield detect_emphasis(line) if index in table_rows else convert_line(line, True)
+
+def convert_line(line, is_followed_by_empty):
+    """
+    1行をMarkdown形式に変換する
+    
+    行頭の文字で試すべきパターンを絞り込み、見出し・リスト・強調の順に判定する。
+    
+    Parameters:
+    -----------
+    line : str
+        変換対象の行
+    is_followed_by_empty : bool
+        次の行が空行または存在しないかどうか
+    
+    Returns:
+    --------
+    str
+        Markdown形式に変換された行
+    """
+    # 空行はそのまま返す
+    if not line or line.isspace():
+        return line
+    
+    stripped = line.strip()
+    first_char = stripped[0]
+    is_short = len(stripped) < 40
+    
+    is_number = first_char.isdecimal()
+    number_match = _NUMBER_PREFIX_PATTERN.match(stripped) if is_number else None
+    
+    # 見出しの検出
+    if number_match and is_short:
+        return f"## {stripped}"
+    if (is_number or first_char == '第') and _CHAPTER_PATTERN.match(stripped):
+        return f"# {stripped}"
+    if first_char in _PREFIX_FIRST_CHARS:
+        prefix_match = _PREFIX_PATTERN.match(stripped)
+        if prefix_match:
+            prefix, content = prefix_match.groups()
+            if content:
+                return f"## {prefix}：{content}"
+            return f"## {prefix}"
+    if is_short and is_followed_by_empty:
+        return f"## {line}"
+    
+    # リストの検出（変換結果が元の行と同じ場合は強調の検出に進む）
+    if first_char in _BULLET_CHARS:
+        bullet_match = _BULLET_PATTERN.match(stripped)
+        if bullet_match:
+            list_line = f"- {bullet_match.group(2)}"
+            if list_line != line:
+                return list_line
+    elif number_match and stripped != line:
+        return stripped
+    
+    # テキスト強調の検出
+    return detect_emphasis(line)
 
 def detect_heading(line, index, lines):
     """
@@ -79,13 +163,13 @@ def detect_heading(line, index, lines):
     is_followed_by_empty = (index == len(lines) - 1) or (not lines[index + 1].strip())
     
     # 数字+ドットで始まる行（例：「1. タイトル」）
-    number_prefix_match = re.match(r'^(\d+[\.\)]) (.+)$', line.strip())
+    number_prefix_match = _NUMBER_PREFIX_PATTERN.match(line.strip())
     
     # 章や節を示す可能性のある特定のパターン
-    chapter_match = re.match(r'^(第\s*\d+\s*[章節]|[０-９]+[．\.]) (.+)$', line.strip())
+    chapter_match = _CHAPTER_PATTERN.match(line.strip())
     
     # 特定の接頭辞を持つ行
-    prefix_match = re.match(r'^(はじめに|概要|序論|結論|まとめ|目次|付録|参考文献)[:：]?\s*(.+)?$', line.strip())
+    prefix_match = _PREFIX_PATTERN.match(line.strip())
     
     if number_prefix_match and is_short:
         # 数字+ドットの見出し（例：「1. タイトル」→「## 1. タイトル」）
@@ -125,10 +209,10 @@ def detect_list(line):
         そうでない場合は元の行
     """
     # 箇条書き記号で始まる行
-    bullet_match = re.match(r'^[\s　]*([・\-\*•◦‣⁃]) (.+)$', line.strip())
+    bullet_match = _BULLET_PATTERN.match(line.strip())
     
     # 数字+ドットで始まる行（番号付きリスト）
-    number_match = re.match(r'^[\s　]*(\d+[\.\)]) (.+)$', line.strip())
+    number_match = _NUMBER_LIST_PATTERN.match(line.strip())
     
     if bullet_match:
         # 箇条書きリスト（例：「・項目」→「- 項目」）
@@ -157,12 +241,45 @@ def detect_emphasis(line):
         テキスト強調が検出された場合はMarkdown形式の強調テキスト、
         そうでない場合は元の行
     """
-    # 「」や『』で囲まれたテキストを強調として検出
-    line = re.sub(r'「([^」]+)」', r'**\1**', line)
-    line = re.sub(r'『([^』]+)』', r'*\1*', line)
+    # 区切り文字を含まない行はそのまま返す
+    if not _EMPHASIS_CHAR_PATTERN.search(line):
+        return line
     
-    # 全角の*や_で囲まれたテキストも強調として検出
-    line = re.sub(r'＊([^＊]+)＊', r'**\1**', line)
-    line = re.sub(r'＿([^＿]+)＿', r'*\1*', line)
+    # 区切り文字を1回の走査で対応付ける
+    # - 「」『』: 開き文字から最初の閉じ文字までを強調とする（中身が空の場合は強調しない）
+    # - ＊＿: 同じ文字で挟まれた範囲を強調とする
+    # 種類ごとの対応付けは他の種類の区切り文字に影響されないため、
+    # 種類ごとに正規表現で置換した場合と同じ結果になる
+    pending = [None, None, None, None]
+    replacements = []
+    for match in _EMPHASIS_CHAR_PATTERN.finditer(line):
+        position = match.start()
+        kind, is_open = _EMPHASIS_DELIMITERS[match.group()]
+        start = pending[kind]
+        if start is None:
+            if is_open is not False:
+                pending[kind] = position
+        elif is_open:
+            # 開き文字の後の開き文字は強調の中身として扱う
+            continue
+        elif position - start > 1:
+            replacements.append((start, kind))
+            replacements.append((position, kind))
+            pending[kind] = None
+        else:
+            # 中身が空の場合、両用の区切り文字は新たな開き文字になる
+            pending[kind] = position if is_open is None else None
     
-    return line
+    if not replacements:
+        return line
+    
+    replacements.sort()
+    parts = []
+    last = 0
+    for position, kind in replacements:
+        parts.append(line[last:position])
+        parts.append(_EMPHASIS_MARKERS[kind])
+        last = position + 1
+    parts.append(line[last:])
+    
+    return ''.join(parts)
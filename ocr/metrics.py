@@ -0,0 +1,270 @@
+"""
+処理時間の計測モジュール
+
+画像ごとに、処理の段階（読み込み・認識・サイドカーの保存・整形・表・レイアウト・Markdown・書き込み）ごとの
+処理時間と、観測値の数・画像の大きさなどのカウンタを記録する機能を提供します。
+ワーカープロセスで作成した記録は結果とともにメインプロセスへ返し、
+MetricsAggregator で段階ごとの p50 / p95 / 最大値に集計します。
+
+記録はスレッドごとに保持するため、スレッドプールで複数の画像を同時に処理する場合も混ざりません。
+記録中でない場合、stage() と count() は何もしないため、計測を無効にした場合の負荷はほぼありません。
+"""
+
+import json
+import math
+import os
+import random
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+
+# 処理の段階（レポートに表示する順）
+STAGES = ('load', 'recognize', 'sidecar', 'format', 'tables', 'layout', 'markdown', 'write')
+
+# 長時間動作するプロセス（監視モード・サーバーモード）で、段階・カウンタごとに保持する値の数の上限
+RESERVOIR_SIZE = 4096
+
+# スレッドごとの、記録中の画像の記録（record）と実行中の段階のスタック（stack）
+_local = threading.local()
+
+def _current():
+    return getattr(_local, 'record', None)
+
+def start_record(image_path, page=None, record=None):
+    """
+    このスレッドで、1つの画像の記録を開始する
+
+    Parameters:
+    -----------
+    image_path : str
+        画像ファイルのパス
+    page : int
+        複数ページの画像の場合のページ番号（0始まり）
+    record : dict
+        続けて記録する記録（別のプロセスやスレッドで途中まで記録した finish_record() の戻り値）
+    """
+    if record is None:
+        record = {'image': image_path, 'page': page, 'stages': {}, 'counters': {}}
+    _local.record = record
+    _local.stack = []
+
+def finish_record():
+    """
+    記録を終了し、記録した内容を返す
+
+    Returns:
+    --------
+    dict or None
+        'image', 'page', 'stages'（段階名 -> 秒数）, 'counters'（カウンタ名 -> 値）を含む辞書。
+        記録中でなかった場合はNone
+    """
+    record = _current()
+    _local.record = None
+    _local.stack = []
+    return record
+
+def is_recording():
+    """このスレッドで記録中かどうか"""
+    return _current() is not None
+
+@contextmanager
+def stage(name):
+    """
+    with ブロックの処理時間を、段階 name の時間として記録する
+
+    段階は入れ子にでき、外側の段階には内側の段階の時間を含めない。
+    """
+    record = _current()
+    if record is None:
+        yield
+        return
+    stack = _local.stack
+    frame = [0.0]  # 内側の段階の合計時間
+    stack.append(frame)
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started_at
+        stack.pop()
+        if stack:
+            stack[-1][0] += elapsed
+        stages = record['stages']
+        stages[name] = stages.get(name, 0.0) + elapsed - frame[0]
+
+def count(name, value):
+    """カウンタ name に value を加算する（記録中でない場合は何もしない）"""
+    record = _current()
+    if record is not None:
+        counters = record['counters']
+        counters[name] = counters.get(name, 0) + value
+
+def percentile(sorted_values, fraction):
+    """並べ替え済みの値から、最近傍順位法でパーセンタイル値を返す"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, min(len(sorted_values), math.ceil(fraction * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+class _Series:
+    """
+    1つの段階またはカウンタの値
+
+    件数・合計・最大値は常に正確に保持する。max_samples を指定した場合、パーセンタイルの計算に使う値は
+    リザーバサンプリングで最大 max_samples 個の一様な標本に制限する（メモリと集計の時間が一定になる）。
+    """
+
+    __slots__ = ('values', 'count', 'total', 'maximum', 'max_samples', '_random')
+
+    def __init__(self, max_samples=None):
+        self.values = array('d')
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.max_samples = max_samples
+        self._random = random.Random(0) if max_samples else None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.maximum = value if self.count == 1 else max(self.maximum, value)
+        if self.max_samples is None or len(self.values) < self.max_samples:
+            self.values.append(value)
+            return
+        slot = self._random.randrange(self.count)
+        if slot < self.max_samples:
+            self.values[slot] = value
+
+    def snapshot(self):
+        return array('d', self.values), self.count, self.total, self.maximum
+
+class MetricsAggregator:
+    """
+    画像ごとの記録を集計する
+
+    値は段階・カウンタごとに array('d') に保持し、summary() の時点で並べ替えて集計する。
+    書き込みスレッドからも段階の時間を追加できるよう、操作はロックで保護する。
+
+    Parameters:
+    -----------
+    max_samples : int
+        段階・カウンタごとに保持する値の数の上限（Noneの場合はすべて保持する）。
+        長時間動作するプロセスで指定すると、件数・合計・最大値は正確なまま、
+        p50 / p95 は保持した標本から計算する
+    """
+
+    def __init__(self, max_samples=None):
+        self.images = 0
+        self.max_samples = max_samples
+        self._stages = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _series(self, table, name):
+        series = table.get(name)
+        if series is None:
+            series = table[name] = _Series(self.max_samples)
+        return series
+
+    def add_record(self, record):
+        """ワーカーから返された記録（finish_record() の戻り値）を追加する"""
+        if not record:
+            return
+        with self._lock:
+            self.images += 1
+            for name, seconds in record['stages'].items():
+                self._series(self._stages, name).add(seconds)
+            for name, value in record['counters'].items():
+                self._series(self._counters, name).add(value)
+
+    def add_stage(self, name, seconds):
+        """画像の記録に含まれない段階（書き込みなど）の時間を追加する"""
+        with self._lock:
+            self._series(self._stages, name).add(seconds)
+
+    def summary(self):
+        """
+        段階・カウンタごとの集計結果を返す
+
+        Returns:
+        --------
+        dict
+            'images'（記録した画像の数）, 'stages', 'counters' を含む辞書。
+            'stages' と 'counters' は名前ごとに 'count', 'total', 'p50', 'p95', 'max' を持つ
+        """
+        with self._lock:
+            stages = {name: series.snapshot() for name, series in self._stages.items()}
+            counters = {name: series.snapshot() for name, series in self._counters.items()}
+            images = self.images
+        ordered = sorted(stages, key=lambda name: (STAGES.index(name) if name in STAGES else len(STAGES), name))
+        return {
+            'images': images,
+            'stages': {name: _describe(*stages[name]) for name in ordered},
+            'counters': {name: _describe(*counters[name]) for name in sorted(counters)}
+        }
+
+    def write_json(self, path, extra=None):
+        """
+        集計結果をJSONファイルに保存する
+
+        Parameters:
+        -----------
+        path : str
+            保存先のファイルパス
+        extra : dict
+            レポートに追加する項目（処理時間や設定など）
+        """
+        report = dict(extra or {})
+        report.update(self.summary())
+        _write_atomic(path, json.dumps(report, ensure_ascii=False, indent=2) + "\n")
+
+    def write_prometheus(self, path, prefix='apple_ocr'):
+        """
+        集計結果をPrometheusのテキスト形式（node_exporterのtextfileコレクタ用）で保存する
+
+        段階ごとの時間はsummary型（quantile="0.5", "0.95", "1"）として出力する。
+        """
+        summary = self.summary()
+        lines = [
+            f"# HELP {prefix}_images_total Number of images with timing records.",
+            f"# TYPE {prefix}_images_total counter",
+            f"{prefix}_images_total {summary['images']}",
+            f"# HELP {prefix}_stage_seconds Time spent in each processing stage per image.",
+            f"# TYPE {prefix}_stage_seconds summary"
+        ]
+        for name, values in summary['stages'].items():
+            lines.extend(_summary_lines(f"{prefix}_stage_seconds", f'stage="{name}"', values))
+        for name, values in summary['counters'].items():
+            metric = f"{prefix}_{name}"
+            lines.append(f"# TYPE {metric} summary")
+            lines.extend(_summary_lines(metric, None, values))
+        _write_atomic(path, "\n".join(lines) + "\n")
+
+def _describe(values, count, total, maximum):
+    ordered = sorted(values)
+    return {
+        'count': count,
+        'total': total,
+        'p50': percentile(ordered, 0.5),
+        'p95': percentile(ordered, 0.95),
+        'max': maximum
+    }
+
+def _summary_lines(metric, label, values):
+    labels = f"{label}," if label else ""
+    suffix = f"{{{label}}}" if label else ""
+    return [
+        f'{metric}{{{labels}quantile="0.5"}} {values["p50"]:.6g}',
+        f'{metric}{{{labels}quantile="0.95"}} {values["p95"]:.6g}',
+        f'{metric}{{{labels}quantile="1"}} {values["max"]:.6g}',
+        f'{metric}_sum{suffix} {values["total"]:.6g}',
+        f'{metric}_count{suffix} {values["count"]}'
+    ]
+
+def _write_atomic(path, content):
+    """読み込み中のプロセスが書きかけのファイルを読まないよう、一時ファイルに書き込んでから置き換える"""
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(temp_path, path)
@@ -0,0 +1,210 @@
+"""
+画像の前処理モジュール
+
+認識の前に、大きすぎる画像（高解像度のスマートフォンの写真など）を縮小・グレースケール化した
+派生画像を作成し、ディスクにキャッシュする機能を提供します。
+派生画像は元画像の内容ハッシュと前処理の設定をキーとして保存されるため、
+同じ画像を再度処理する場合は、デコードと縮小を省略して派生画像を再利用できます。
+"""
+
+import os
+import threading
+
+from . import metrics
+from .backend import OCRBackend, ImageLoadError
+from .cache import memoized_file_digest, settings_digest
+
+# 長辺の既定の上限（ピクセル）
+DEFAULT_MAX_DIMENSION = 4096
+
+def derivative_scale(width, height, dpi=None, max_dimension=DEFAULT_MAX_DIMENSION, target_dpi=None):
+    """
+    派生画像の縮小率を返す
+
+    Parameters:
+    -----------
+    width : int
+        元画像の幅（ピクセル）
+    height : int
+        元画像の高さ（ピクセル）
+    dpi : float
+        元画像の解像度（メタデータにない場合はNone）
+    max_dimension : int
+        長辺の上限（ピクセル、Noneの場合は制限しない）
+    target_dpi : float
+        目標の解像度（Noneの場合は解像度で縮小しない）
+
+    Returns:
+    --------
+    float
+        縮小率（1.0の場合は縮小不要）
+    """
+    scale = 1.0
+    long_side = max(width, height)
+    if max_dimension and long_side > max_dimension:
+        scale = max_dimension / long_side
+    if target_dpi and dpi and dpi > target_dpi:
+        scale = min(scale, target_dpi / dpi)
+    return scale
+
+class NormalizingBackend(OCRBackend):
+    """
+    大きすぎる画像を縮小した派生画像で認識するバックエンド
+
+    長辺が max_dimension を超える画像、または解像度が target_dpi を超える画像について、
+    縮小（と必要に応じてグレースケール化）した派生画像を cache_dir に作成し、
+    内側のバックエンドには派生画像のパスを渡す。観測値は正規化座標のため、
+    縮小しても座標の変換は不要。それ以外の画像は、そのまま内側のバックエンドで認識する。
+
+    派生画像の作成にはImageIOの縮小デコードを使用するため、元画像を
+    フル解像度でメモリに展開しない。
+    """
+
+    def __init__(self, backend, cache_dir, max_dimension=DEFAULT_MAX_DIMENSION, target_dpi=None, grayscale=True):
+        self.backend = backend
+        self.cache_dir = cache_dir
+        self.max_dimension = max_dimension
+        self.target_dpi = target_dpi
+        self.grayscale = grayscale
+
+    def settings(self):
+        return dict(self.backend.settings(), normalize={
+            'max_dimension': self.max_dimension,
+            'target_dpi': self.target_dpi,
+            'grayscale': self.grayscale
+        })
+
+    def warm_up(self):
+        self.backend.warm_up()
+
+    def page_count(self, image_path):
+        return self.backend.page_count(image_path)
+
+    def image_size(self, image_path, page=None):
+        derivative_path = self.derivative(image_path, page)
+        if derivative_path is None:
+            return self.backend.image_size(image_path, page)
+        return self.backend.image_size(derivative_path)
+
+    def recognize(self, image_path, page=None):
+        derivative_path = self.derivative(image_path, page)
+        if derivative_path is None:
+            return self.backend.recognize(image_path, page)
+        return self.backend.recognize(derivative_path)
+
+    def recognize_tiles(self, image_path, tiles, page=None, max_workers=None):
+        derivative_path = self.derivative(image_path, page)
+        if derivative_path is None:
+            return self.backend.recognize_tiles(image_path, tiles, page, max_workers)
+        return self.backend.recognize_tiles(derivative_path, tiles, None, max_workers)
+
+    def derivative(self, image_path, page=None):
+        """
+        画像の派生画像のパスを返す（作成済みでなければ作成する）
+
+        Parameters:
+        -----------
+        image_path : str
+            元画像のパス
+        page : int
+            複数ページの画像の場合のページ番号（0始まり）
+
+        Returns:
+        --------
+        str or None
+            派生画像のパス。縮小が不要な画像の場合はNone
+
+        Raises:
+        -------
+        ImageLoadError
+            画像を読み込めなかった場合
+        """
+        properties = self.read_properties(image_path, page)
+        if properties is None:
+            return None
+        width, height, dpi = properties
+        scale = derivative_scale(width, height, dpi, self.max_dimension, self.target_dpi)
+        if scale >= 1.0:
+            return None
+
+        try:
+            image_hash = memoized_file_digest(image_path)
+        except OSError:
+            raise ImageLoadError(f"画像を読み込めませんでした: {image_path}")
+        max_pixel_size = max(1, round(max(width, height) * scale))
+        key = settings_digest({'page': page, 'max_pixel_size': max_pixel_size, 'grayscale': self.grayscale})
+        derivative_path = os.path.join(self.cache_dir, f"{image_hash[:32]}-{key[:16]}.png")
+
+        if not os.path.exists(derivative_path):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # 複数のワーカーが同じ派生画像を作成する場合に備え、一時ファイルに書き込んでから置き換える
+            temp_path = f"{derivative_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with metrics.stage('normalize'):
+                    self.create_derivative(image_path, page, temp_path, max_pixel_size)
+                os.replace(temp_path, derivative_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        return derivative_path
+
+    def read_properties(self, image_path, page=None):
+        """
+        画像のヘッダーから (幅, 高さ, 解像度) を読み込む（読み込めない場合はNone）
+
+        画像のピクセルはデコードしない。解像度がメタデータにない場合はNone。
+        """
+        from Foundation import NSURL
+        from Quartz import (CGImageSourceCreateWithURL, CGImageSourceCopyPropertiesAtIndex,
+                            kCGImagePropertyPixelWidth, kCGImagePropertyPixelHeight, kCGImagePropertyDPIWidth)
+
+        source = CGImageSourceCreateWithURL(NSURL.fileURLWithPath_(image_path), None)
+        properties = CGImageSourceCopyPropertiesAtIndex(source, page or 0, None) if source is not None else None
+        if not properties:
+            return None
+        width = properties.get(kCGImagePropertyPixelWidth)
+        height = properties.get(kCGImagePropertyPixelHeight)
+        if width is None or height is None:
+            return None
+        dpi = properties.get(kCGImagePropertyDPIWidth)
+        return int(width), int(height), float(dpi) if dpi else None
+
+    def create_derivative(self, image_path, page, output_path, max_pixel_size):
+        """
+        長辺が max_pixel_size の派生画像をPNG形式で作成する
+
+        Raises:
+        -------
+        ImageLoadError
+            画像を読み込めなかった場合
+        """
+        from Foundation import NSURL
+        from Quartz import (CGImageSourceCreateWithURL, CGImageSourceCreateThumbnailAtIndex,
+                            kCGImageSourceCreateThumbnailFromImageAlways, kCGImageSourceThumbnailMaxPixelSize,
+                            CGImageGetWidth, CGImageGetHeight, CGColorSpaceCreateDeviceGray,
+                            CGBitmapContextCreate, CGBitmapContextCreateImage, CGContextDrawImage,
+                            CGRectMake, kCGImageAlphaNone, CGImageDestinationCreateWithURL,
+                            CGImageDestinationAddImage, CGImageDestinationFinalize)
+
+        # 縮小しながらデコードする（JPEGなどは縮小デコードされ、フル解像度の画像を展開しない）
+        source = CGImageSourceCreateWithURL(NSURL.fileURLWithPath_(image_path), None)
+        options = {
+            kCGImageSourceCreateThumbnailFromImageAlways: True,
+            kCGImageSourceThumbnailMaxPixelSize: max_pixel_size
+        }
+        image = CGImageSourceCreateThumbnailAtIndex(source, page or 0, options) if source is not None else None
+        if image is None:
+            raise ImageLoadError(f"画像を読み込めませんでした: {image_path}")
+
+        if self.grayscale:
+            width, height = CGImageGetWidth(image), CGImageGetHeight(image)
+            context = CGBitmapContextCreate(None, width, height, 8, 0, CGColorSpaceCreateDeviceGray(), kCGImageAlphaNone)
+            CGContextDrawImage(context, CGRectMake(0, 0, width, height), image)
+            image = CGBitmapContextCreateImage(context)
+
+        destination = CGImageDestinationCreateWithURL(NSURL.fileURLWithPath_(output_path), "public.png", 1, None)
+        if destination is None:
+            raise ImageLoadError(f"派生画像を作成できませんでした: {output_path}")
+        CGImageDestinationAddImage(destination, image, None)
+        if not CGImageDestinationFinalize(destination):
+            raise ImageLoadError(f"派生画像を作成できませんでした: {output_path}")
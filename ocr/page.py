@@ -0,0 +1,250 @@
+"""
+OCR結果モジュール
+
+1ページ分のOCR結果（テキスト・バウンディングボックス・信頼度）を保持する
+OCRPage を提供します。観測値ごとの辞書を持たず、列ごとの配列に格納するため、
+観測値が多い場合もメモリ使用量が小さく、pickleによるプロセス間の受け渡しも軽量です。
+整形・表の変換・レイアウト解析・Markdown変換の結果は、必要になった時点で
+行のリストのまま順に処理して作成し、設定ごとに保持します。
+"""
+
+from array import array
+
+from . import metrics
+from .formatter import format_ocr_text, format_ocr_lines
+from .markdown import iter_markdown_lines
+from .table import iter_table_rows, split_observations_by_table
+from .layout import detect_and_convert_indentation
+
+# テキストが検出されなかった場合のテキスト
+NO_TEXT_MESSAGE = "テキストが検出されませんでした。"
+
+class OCRPage:
+    """
+    1ページ分のOCR結果
+
+    観測値の各項目を列として保持する（テキストはタプル、座標と信頼度は array('d')）。
+    座標はVisionと同じ左下原点の正規化座標。
+
+    Attributes:
+    -----------
+    texts : tuple
+        観測値のテキスト（認識された順）
+    x, y, width, height : array
+        バウンディングボックス
+    confidence : array
+        認識の信頼度（0.0〜1.0）
+    image_path : str
+        画像ファイルのパス（不明な場合はNone）
+    page : int
+        複数ページの画像の場合のページ番号（0始まり、それ以外はNone）
+    """
+
+    __slots__ = ('texts', 'x', 'y', 'width', 'height', 'confidence', 'image_path', 'page', '_views')
+
+    def __init__(self, texts=(), x=(), y=(), width=(), height=(), confidence=(), image_path=None, page=None):
+        self.texts = tuple(texts)
+        self.x = array('d', x)
+        self.y = array('d', y)
+        self.width = array('d', width)
+        self.height = array('d', height)
+        self.confidence = array('d', confidence)
+        self.image_path = image_path
+        self.page = page
+        self._views = {}
+        if not all(len(column) == len(self.texts)
+                   for column in (self.x, self.y, self.width, self.height, self.confidence)):
+            raise ValueError("すべての列の長さを揃えてください")
+
+    @classmethod
+    def from_observations(cls, observations, image_path=None, page=None):
+        """
+        観測値（辞書）のリストから OCRPage を作成する
+
+        Parameters:
+        -----------
+        observations : list
+            OCRバックエンドが返した観測値（辞書）のリスト
+        image_path : str
+            画像ファイルのパス
+        page : int
+            複数ページの画像の場合のページ番号（0始まり）
+
+        Returns:
+        --------
+        OCRPage
+            作成したOCR結果
+        """
+        return cls([o['text'] for o in observations],
+                   [o['x'] for o in observations],
+                   [o['y'] for o in observations],
+                   [o['width'] for o in observations],
+                   [o['height'] for o in observations],
+                   [o.get('confidence', 1.0) for o in observations],
+                   image_path=image_path, page=page)
+
+    def __getstate__(self):
+        # 作成済みの結果は受け渡さない（受け取った側で必要に応じて作成する）
+        return (self.texts, self.x, self.y, self.width, self.height, self.confidence,
+                self.image_path, self.page)
+
+    def __setstate__(self, state):
+        (self.texts, self.x, self.y, self.width, self.height, self.confidence,
+         self.image_path, self.page) = state
+        self._views = {}
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __getitem__(self, index):
+        return {
+            'text': self.texts[index],
+            'x': self.x[index],
+            'y': self.y[index],
+            'width': self.width[index],
+            'height': self.height[index],
+            'confidence': self.confidence[index]
+        }
+
+    def __iter__(self):
+        for index in range(len(self.texts)):
+            yield self[index]
+
+    def __repr__(self):
+        return f"OCRPage(image_path={self.image_path!r}, page={self.page!r}, observations={len(self)})"
+
+    def observations(self):
+        """観測値（辞書）のリストを返す（位置情報を使う処理のために1回だけ作成する）"""
+        observations = self._views.get('observations')
+        if observations is None:
+            observations = self._views['observations'] = list(self)
+        return observations
+
+    def to_numpy(self):
+        """
+        座標と信頼度の列をNumPy配列として返す（配列のメモリを共有し、コピーしない）
+
+        Returns:
+        --------
+        dict
+            'x', 'y', 'width', 'height', 'confidence' をキーとする float64 の配列の辞書
+        """
+        import numpy as np
+        return {name: np.frombuffer(getattr(self, name), dtype=np.float64)
+                for name in ('x', 'y', 'width', 'height', 'confidence')}
+
+    @property
+    def text(self):
+        """認識されたテキスト（観測値ごとに1行）"""
+        text = self._views.get('text')
+        if text is None:
+            if self.texts:
+                text = "".join(line + "\n" for line in self.texts)
+            else:
+                text = NO_TEXT_MESSAGE
+            self._views['text'] = text
+        return text
+
+    @property
+    def markdown(self):
+        """既定の設定で後処理したテキスト"""
+        return self.render()
+
+    def render(self, format_text=True, detect_tables=False, analyze_layout=False, conversion_level='conservative'):
+        """
+        後処理を行ったテキストを返す（同じ設定での2回目以降は保持している結果を返す）
+
+        Parameters:
+        -----------
+        format_text : bool
+            テキスト整形を行うかどうか
+        detect_tables : bool
+            表の検出と変換を行うかどうか
+        analyze_layout : bool
+            複雑なレイアウト解析を行うかどうか
+        conversion_level : str
+            変換の積極性レベル ('conservative', 'moderate', 'aggressive')
+
+        Returns:
+        --------
+        str
+            後処理済みのテキスト
+        """
+        if not format_text:
+            return self.text
+        key = ('render', detect_tables, analyze_layout, conversion_level)
+        rendered = self._views.get(key)
+        if rendered is None:
+            rendered = self._views[key] = self._render(detect_tables, analyze_layout, conversion_level)
+        return rendered
+
+    def _render(self, detect_tables, analyze_layout, conversion_level):
+        # 表の検出で作成した表の行の番号（Markdown形式への変換で見出し・リストとして扱わない）
+        table_rows = set()
+        if detect_tables and self.texts:
+            # 位置情報から検出した表はそのまま残し、表以外の部分だけを整形して
+            # 区切り文字による表の検出と変換を行う
+            parts = []
+            offset = 0  # '\n\n' で結合したときの、次の部分の先頭の行番号
+            with metrics.stage('tables'):
+                for kind, value in split_observations_by_table(self.observations(), conversion_level):
+                    if kind == 'table':
+                        part = value
+                        table_rows.update(range(offset, offset + len(part.splitlines())))
+                    else:
+                        with metrics.stage('format'):
+                            segment_text = format_ocr_text("".join(observation['text'] + "\n" for observation in value))
+                        rows = list(iter_table_rows(segment_text.splitlines(), conversion_level)) if segment_text else []
+                        part = '\n'.join(line for line, _ in rows) if rows else segment_text
+                        table_rows.update(offset + index for index, (_, is_table_row) in enumerate(rows) if is_table_row)
+                    parts.append(part)
+                    offset += len((part + '\n\n').splitlines())
+            lines = _to_lines('\n\n'.join(parts))
+        elif self.text.isspace():
+            # 空白だけのテキストは整形されない
+            lines = _to_lines(self.text)
+        else:
+            # 基本的なテキスト整形（観測値のテキストを結合・再分割せずに行のまま整形する）
+            with metrics.stage('format'):
+                lines = format_ocr_lines(self._raw_lines())
+            if detect_tables:
+                with metrics.stage('tables'):
+                    rows = _apply(lines, lambda view: iter_table_rows(view, conversion_level))
+                    if rows is not lines:
+                        lines = [line for line, _ in rows]
+                        table_rows.update(index for index, (_, is_table_row) in enumerate(rows) if is_table_row)
+
+        # 複雑なレイアウト解析（位置情報を含む観測値を使用）
+        if analyze_layout and self.texts:
+            with metrics.stage('layout'):
+                lines = _apply(lines, lambda view: detect_and_convert_indentation(
+                    view, self.observations(), conversion_level))
+
+        # Markdown形式に変換
+        with metrics.stage('markdown'):
+            return '\n'.join(_apply(lines, lambda view: iter_markdown_lines(view, table_rows)))
+
+    def _raw_lines(self):
+        """self.text.splitlines() と同じ行のリストを、テキストを結合せずに返す"""
+        if not self.texts:
+            return [NO_TEXT_MESSAGE]
+        lines = []
+        for text in self.texts:
+            lines.extend((text + "\n").splitlines())
+        return lines
+
+def _to_lines(text):
+    """テキストを、_apply で処理したときに text.splitlines() が渡される行のリストに変換する"""
+    return text.splitlines() + ['']
+
+def _apply(lines, stage):
+    """
+    行のリストに処理を適用する
+
+    各処理は '\\n' で結合したテキストを splitlines() で分割した行を受け取るため、
+    同じ行（末尾の空行を1つ除いたもの）を渡す。テキストが空の場合は処理しない。
+    """
+    if not lines or lines == ['']:
+        return lines
+    view = lines[:-1] if lines[-1] == '' else lines
+    return list(stage(view))
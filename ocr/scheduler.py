@@ -0,0 +1,330 @@
+"""
+タスクスケジューラモジュール
+
+実行中のタスク数に上限を設けて、Executorにタスクを少しずつ投入する機能を提供します。
+入力が非常に多い場合でも、Futureや引数を一度に作成しないため、
+呼び出し側のメモリ使用量が入力の数に依存しません。
+また、2つのExecutorをつないでタスクを2段階で実行する PipelineExecutor、
+同時に届いた項目をまとめて1つのタスクとして実行する MicroBatcher と、
+モジュールを読み込み済みのワーカープロセスを起動するための get_process_context を提供します。
+"""
+
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import CancelledError, Future, wait, FIRST_COMPLETED
+
+# 入力の終端を示す番兵
+_EXHAUSTED = object()
+
+# フォークサーバーで事前に読み込むモジュール
+# pyobjcのフレームワーク（Vision、Quartzなど）はfork後の使用が安全でないため含めず、各ワーカーで読み込む
+PRELOAD_MODULES = ('ocr', 'numpy')
+
+def default_start_method():
+    """ワーカープロセスの既定の起動方法（利用できる場合は 'forkserver'）を返す"""
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return 'forkserver'
+    return multiprocessing.get_start_method()
+
+def get_process_context(start_method=None):
+    """
+    ワーカープロセスの起動方法（multiprocessingのコンテキスト）を返す
+
+    'forkserver' の場合、フォークサーバーに PRELOAD_MODULES を1回だけ読み込ませ、
+    各ワーカーは読み込み済みのフォークサーバーからforkして起動する。
+    spawn のようにワーカーごとにインタプリタの起動とモジュールの読み込みを行わない。
+
+    Parameters:
+    -----------
+    start_method : str
+        'spawn', 'fork', 'forkserver' のいずれか（Noneの場合は default_start_method()）
+
+    Returns:
+    --------
+    multiprocessing.context.BaseContext
+        ProcessPoolExecutor の mp_context に渡すコンテキスト
+    """
+    context = multiprocessing.get_context(start_method or default_start_method())
+    if context.get_start_method() == 'forkserver':
+        context.set_forkserver_preload(list(PRELOAD_MODULES))
+    return context
+
+class BoundedScheduler:
+    """
+    実行中のタスク数を max_in_flight 以下に保つスケジューラ
+
+    タスクが完了するたびに、入力のイテレータから次の項目を取り出して投入する
+    （バックプレッシャー）。実行中のタスク数（キューの深さ）とスループットを参照できる。
+    """
+
+    def __init__(self, executor, fn, max_in_flight):
+        self.executor = executor
+        self.fn = fn
+        self.max_in_flight = max(1, max_in_flight)
+        self.submitted = 0
+        self.completed = 0
+        self.started_at = None
+        self._in_flight = {}
+
+    @property
+    def in_flight(self):
+        """実行中（投入済みで未完了）のタスク数"""
+        return len(self._in_flight)
+
+    def throughput(self):
+        """開始からの1秒あたりの完了タスク数"""
+        if self.started_at is None:
+            return 0.0
+        elapsed = time.time() - self.started_at
+        return self.completed / elapsed if elapsed > 0 else 0.0
+
+    def run(self, items):
+        """
+        項目を順に投入し、完了したものから返す
+
+        Parameters:
+        -----------
+        items : iterable
+            fn に渡す項目（必要な分だけ遅延して取り出される）
+
+        Yields:
+        -------
+        tuple
+            (項目, 完了したFuture) のタプル（完了順）
+        """
+        self.started_at = time.time()
+        iterator = iter(items)
+        exhausted = False
+
+        while True:
+            # 上限まで投入
+            while not exhausted and len(self._in_flight) < self.max_in_flight:
+                item = next(iterator, _EXHAUSTED)
+                if item is _EXHAUSTED:
+                    exhausted = True
+                    break
+                self._in_flight[self.executor.submit(self.fn, item)] = item
+                self.submitted += 1
+
+            if not self._in_flight:
+                break
+
+            done, _ = wait(self._in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = self._in_flight.pop(future)
+                self.completed += 1
+                yield item, future
+
+class PipelineExecutor:
+    """
+    2つのExecutorをつなぎ、タスクを2段階で実行するExecutor
+
+    submit(fn, item) は first で fn(item) を実行し、その結果を second で then(結果) として実行する。
+    返すFutureは2段階目の結果（またはいずれかの段階の例外）で完了するため、
+    BoundedScheduler や concurrent.futures.wait() でそのまま使用できる。
+    first と second の終了（shutdown）は呼び出し側で行う。
+    """
+
+    def __init__(self, first, second, then):
+        self.first = first
+        self.second = second
+        self.then = then
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        future.set_running_or_notify_cancel()
+
+        def forward(first_future):
+            try:
+                second_future = self.second.submit(self.then, first_future.result())
+            except BaseException as e:
+                future.set_exception(e)
+                return
+            second_future.add_done_callback(lambda done: _copy_result(done, future))
+
+        self.first.submit(fn, *args, **kwargs).add_done_callback(forward)
+        return future
+
+class MicroBatcher:
+    """
+    submit() で届いた項目をまとめ（マイクロバッチ）、1つのタスクとして Executor で実行する
+
+    最初の項目が届いてから max_wait 秒の間に届いた項目を、max_batch_size 件までまとめて
+    fn(項目のリスト) を実行する。fn は項目と同じ順で結果のリストを返す関数。
+    実行中のバッチが max_in_flight に達している間に届いた項目は待機させ、実行できるように
+    なった時点でまとめて投入するため、負荷が低い場合は1件ずつ（待ち時間なし）、
+    高い場合は大きなバッチで実行され、タスクごとの受け渡しの負荷が抑えられる。
+
+    Parameters:
+    -----------
+    executor : concurrent.futures.Executor
+        バッチを実行するExecutor
+    fn : callable
+        項目のリストを受け取り、結果のリストを返す関数（プロセスプールの場合はpickle可能なもの）
+    max_batch_size : int
+        1つのバッチにまとめる項目の最大数
+    max_wait : float
+        最初の項目が届いてから、後続の項目を待つ最大の秒数
+    max_in_flight : int
+        同時に実行するバッチの最大数
+    """
+
+    def __init__(self, executor, fn, max_batch_size=8, max_wait=0.002, max_in_flight=1):
+        self.executor = executor
+        self.fn = fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._slots = threading.BoundedSemaphore(max(1, max_in_flight))
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="MicroBatcher", daemon=True)
+
+    def start(self):
+        """バッチをまとめるスレッドを開始する"""
+        self._thread.start()
+        return self
+
+    def submit(self, item):
+        """
+        項目を追加し、その項目の結果で完了するFutureを返す
+
+        バッチの実行が例外で終了した場合は、バッチのすべての項目のFutureにその例外を設定する。
+        バッチに含める前であれば Future.cancel() で項目を取り消せる（取り消した項目は実行しない）。
+        バッチに含めた後は cancel() は False を返し、項目は最後まで実行される。
+        """
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def close(self):
+        """待機中の項目をすべて投入してから、スレッドを終了する（実行中のバッチの完了は待たない）"""
+        self._queue.put(_EXHAUSTED)
+        self._thread.join()
+
+    def stats(self):
+        """実行したバッチの数と、1バッチあたりの平均の項目数を返す"""
+        with self._lock:
+            return {'batches': self.batches, 'items': self.items,
+                    'mean_batch_size': self.items / self.batches if self.batches else 0.0}
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            entry = self._queue.get()
+            if entry is _EXHAUSTED:
+                break
+            batch = [entry]
+            # 最初の項目から max_wait 秒の間、後続の項目を集める
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is _EXHAUSTED:
+                    stopping = True
+                    break
+                batch.append(entry)
+
+            # 実行中のバッチが上限に達している間に届いた項目も、同じバッチにまとめる
+            self._slots.acquire()
+            while not stopping and len(batch) < self.max_batch_size:
+                try:
+                    entry = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is _EXHAUSTED:
+                    stopping = True
+                    break
+                batch.append(entry)
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        # 取り消された項目を除く（以降は取り消せない）
+        batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            self._slots.release()
+            return
+        items = [item for item, _ in batch]
+        futures = [future for _, future in batch]
+        with self._lock:
+            self.batches += 1
+            self.items += len(batch)
+        try:
+            task = self.executor.submit(self.fn, items)
+        except BaseException as e:
+            self._slots.release()
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        def deliver(done):
+            self._slots.release()
+            try:
+                results = done.result()
+            except BaseException as e:
+                for future in futures:
+                    future.set_exception(e)
+                return
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+        task.add_done_callback(deliver)
+
+def _copy_result(source, target):
+    """完了した source の結果（または例外）を target に設定する"""
+    if source.cancelled():
+        target.set_exception(CancelledError())
+        return
+    error = source.exception()
+    if error is not None:
+        target.set_exception(error)
+    else:
+        target.set_result(source.result())
+
+def prefetch(iterable, max_buffered=10000):
+    """
+    イテラブルをバックグラウンドのスレッドで先読みする
+    
+    ファイルの探索など、時間のかかる入力の生成をタスクの実行と並行して進めるために使用する。
+    先読みした項目が max_buffered 件に達すると、生成側のスレッドは待機する。
+    
+    Parameters:
+    -----------
+    iterable : iterable
+        先読みするイテラブル
+    max_buffered : int
+        先読みしておく項目の最大数
+    
+    Yields:
+    -------
+    object
+        iterable の項目（元の順序のまま）
+    """
+    buffer = queue.Queue(maxsize=max_buffered)
+    errors = []
+    
+    def produce():
+        try:
+            for item in iterable:
+                buffer.put(item)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            buffer.put(_EXHAUSTED)
+    
+    threading.Thread(target=produce, name="prefetch", daemon=True).start()
+    
+    while True:
+        item = buffer.get()
+        if item is _EXHAUSTED:
+            break
+        yield item
+    
+    if errors:
+        raise errors[0]
@@ -0,0 +1,237 @@
+"""
+観測値サイドカーモジュール
+
+画像ごとの認識結果（テキスト・バウンディングボックス・信頼度）を、列ごとに格納した
+コンパクトなバイナリファイル（サイドカー）として保存・読み込みする機能を提供します。
+サイドカーから OCRPage を復元すれば、認識を行わずに整形・表の変換・レイアウト解析・
+Markdown変換だけをやり直せます。
+
+ファイルの形式（数値はリトルエンディアン）:
+
+- マジックナンバー b'OCRP' と形式のバージョン（1バイト）
+- ヘッダーの長さ（uint32）とヘッダー（UTF-8のJSON: image_path, page, page_count, count, message）
+- 観測値ごとのテキストのバイト数（uint32 × count）と、UTF-8のテキストを連結したもの
+- x, y, width, height, confidence の各列（float64 × count）
+"""
+
+import json
+import os
+import struct
+import sys
+import threading
+from array import array
+
+from .page import OCRPage
+
+# サイドカーの拡張子
+SIDECAR_EXTENSION = '.ocrpage'
+
+_MAGIC = b'OCRP'
+_VERSION = 1
+_PREFIX = struct.Struct('<4sBI')
+_COLUMNS = ('x', 'y', 'width', 'height', 'confidence')
+
+def sidecar_path(sidecar_dir, image_path, page=None, relative_to=None):
+    """
+    画像（とページ）に対応するサイドカーのパスを返す
+
+    ファイル名は画像のファイル名（拡張子を含む）に SIDECAR_EXTENSION を付けたもの
+    （複数ページの画像は <画像のファイル名>.page<番号>.ocrpage）。拡張子を含めるため、
+    同じディレクトリの a.png と a.jpg のサイドカーが同じ名前にならない。
+    画像とページの対応はヘッダーに記録し、ファイル名からは判定しない。
+
+    Parameters:
+    -----------
+    sidecar_dir : str
+        サイドカーの保存先ディレクトリ
+    image_path : str
+        画像ファイルのパス
+    page : int
+        複数ページの画像の場合のページ番号（0始まり）
+    relative_to : str
+        指定した場合、このディレクトリからの相対ディレクトリ構成を保って保存する
+
+    Returns:
+    --------
+    str
+        サイドカーのパス
+    """
+    target_dir = sidecar_dir
+    if relative_to:
+        relative_dir = os.path.relpath(os.path.dirname(image_path), relative_to)
+        if relative_dir != os.curdir:
+            target_dir = os.path.join(sidecar_dir, relative_dir)
+    base_name = os.path.basename(image_path)
+    if page is not None:
+        base_name += f".page{page + 1}"
+    return os.path.join(target_dir, base_name + SIDECAR_EXTENSION)
+
+def write_sidecar(path, page, page_count=None, image_path=None, page_number=None, message=None):
+    """
+    認識結果をサイドカーとして保存する
+
+    Parameters:
+    -----------
+    path : str
+        保存先のファイルパス
+    page : OCRPage
+        認識結果（認識に失敗した場合はNone）
+    page_count : int
+        複数ページの画像の場合の総ページ数
+    image_path, page_number : str, int
+        page がNoneの場合に記録する画像のパスとページ番号（0始まり）
+    message : str
+        認識に失敗した場合の、失敗を示すテキスト
+    """
+    if page is None:
+        page = OCRPage(image_path=image_path, page=page_number)
+    header = json.dumps({
+        'image_path': page.image_path,
+        'page': page.page,
+        'page_count': page_count,
+        'count': len(page),
+        'message': message
+    }, ensure_ascii=False).encode('utf-8')
+
+    encoded = [text.encode('utf-8') for text in page.texts]
+    lengths = array('I', (len(data) for data in encoded))
+    columns = [array('d', getattr(page, name)) for name in _COLUMNS]
+    if sys.byteorder != 'little':
+        lengths.byteswap()
+        for column in columns:
+            column.byteswap()
+
+    os.makedirs(os.path.dirname(path) or os.curdir, exist_ok=True)
+    # 書き込み途中のファイルを読み込まないよう、一時ファイルに書き込んでから置き換える
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(_PREFIX.pack(_MAGIC, _VERSION, len(header)))
+            f.write(header)
+            f.write(lengths.tobytes())
+            f.write(b''.join(encoded))
+            for column in columns:
+                f.write(column.tobytes())
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def read_sidecar(path):
+    """
+    サイドカーを読み込む
+
+    Parameters:
+    -----------
+    path : str
+        サイドカーのパス
+
+    Returns:
+    --------
+    tuple
+        (page, header) のタプル。page は OCRPage、header は 'image_path', 'page',
+        'page_count', 'message'（認識に失敗した場合の失敗を示すテキスト、それ以外はNone）を含む辞書
+
+    Raises:
+    -------
+    ValueError
+        サイドカーの形式でない場合
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    header_size = _read_prefix(data, path)
+    offset = _PREFIX.size
+    header = json.loads(data[offset:offset + header_size].decode('utf-8'))
+    offset += header_size
+    count = header['count']
+
+    lengths = array('I')
+    lengths.frombytes(data[offset:offset + lengths.itemsize * count])
+    offset += lengths.itemsize * count
+    if sys.byteorder != 'little':
+        lengths.byteswap()
+    texts = []
+    for length in lengths:
+        texts.append(data[offset:offset + length].decode('utf-8'))
+        offset += length
+
+    columns = []
+    for _ in _COLUMNS:
+        column = array('d')
+        column.frombytes(data[offset:offset + column.itemsize * count])
+        offset += column.itemsize * count
+        if sys.byteorder != 'little':
+            column.byteswap()
+        columns.append(column)
+    if offset != len(data):
+        raise ValueError(f"サイドカーの長さが正しくありません: {path}")
+
+    page = OCRPage(texts, *columns, image_path=header['image_path'], page=header['page'])
+    return page, header
+
+def read_sidecar_header(path):
+    """
+    サイドカーのヘッダーだけを読み込む（観測値は読み込まない）
+
+    Returns:
+    --------
+    dict
+        read_sidecar() が返すものと同じヘッダー
+
+    Raises:
+    -------
+    ValueError
+        サイドカーの形式でない場合
+    """
+    with open(path, 'rb') as f:
+        prefix = f.read(_PREFIX.size)
+        header_size = _read_prefix(prefix, path)
+        data = f.read(header_size)
+    if len(data) != header_size:
+        raise ValueError(f"サイドカーの長さが正しくありません: {path}")
+    return json.loads(data.decode('utf-8'))
+
+def _read_prefix(data, path):
+    """マジックナンバーと形式のバージョンを確認し、ヘッダーの長さを返す"""
+    if len(data) < _PREFIX.size:
+        raise ValueError(f"サイドカーの形式ではありません: {path}")
+    magic, version, header_size = _PREFIX.unpack_from(data)
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError(f"サイドカーの形式ではありません: {path}")
+    return header_size
+
+def iter_sidecar_documents(sidecar_dir):
+    """
+    サイドカーを、画像（文書）ごとにまとめて返す
+
+    同じディレクトリの、ヘッダーの画像のパスが同じサイドカー（複数ページの画像のページ）は
+    1つの文書としてまとめ、ヘッダーのページ番号の順に並べる（ファイル名からは判定しない）。
+    ヘッダーを読み込めないサイドカーは、それぞれ1つの文書として返す。
+    ディレクトリはサブディレクトリも含めて、パス順に探索する。文書は、最初のサイドカーのファイル名の順に返す。
+
+    Parameters:
+    -----------
+    sidecar_dir : str
+        サイドカーのディレクトリ
+
+    Yields:
+    -------
+    tuple
+        (相対ディレクトリ, サイドカーのパスのリスト) のタプル（ページ順）
+    """
+    for current, dirs, files in os.walk(sidecar_dir):
+        dirs.sort()
+        relative_dir = os.path.relpath(current, sidecar_dir)
+        documents = {}  # 画像のパス -> (ページ番号, サイドカーのパス) のリスト（最初のサイドカーの順）
+        for name in sorted(files):
+            if not name.endswith(SIDECAR_EXTENSION):
+                continue
+            path = os.path.join(current, name)
+            try:
+                header = read_sidecar_header(path)
+                key, number = ('image', header['image_path']), header['page'] or 0
+            except (OSError, ValueError, KeyError):
+                key, number = ('file', path), 0
+            documents.setdefault(key, []).append((number, path))
+        for pages in documents.values():
+            yield relative_dir, [path for _, path in sorted(pages)]
@@ -5,6 +5,26 @@
 """
 
 import re
+from collections import deque
+
+# 表の区切り文字（優先順）
+_DELIMITERS = ('\t', '|', ',')
+
+# スペースが3つ以上連続している部分を区切りとみなす
+_SPACE_DELIMITER_PATTERN = re.compile(r'\s{3,}')
+
+# 行の終端を示す番兵
+_END = object()
+
+# 位置情報から表を検出する場合の、セルの判定の基準（座標は正規化座標）
+# 同じ行で、間隔がこれ未満の観測値は同じセル（1つの語句が分かれて認識されたもの）とみなす
+_CELL_GAP = 0.015
+# セルの幅が次の列の左端までの距離に占める割合の上限（行の中央値と、行の最大値）
+# 段組みの文章は各段の行が段の幅をほぼ埋めるため、これを超える
+_MAX_CELL_FILL = 0.6
+_MAX_CELL_FILL_ANY = 0.8
+# セルの文字数の上限（行の中央値）
+_MAX_CELL_CHARS = 24
 
 def detect_and_convert_tables(text, conversion_level='conservative'):
     """
@@ -25,121 +45,127 @@ def detect_and_convert_tables(text, conversion_level='conservative'):
     if not text:
         return text
     
-    # 行ごとに処理
-    lines = text.splitlines()
-    result_lines = []
+    return '\n'.join(iter_table_lines(text.splitlines(), conversion_level))
+
+def iter_table_lines(lines, conversion_level='conservative'):
+    """
+    行のイテラブルを1回走査し、表をMarkdown形式に変換した行を順に返す（iter_table_rows を参照）
+    """
+    for line, _ in iter_table_rows(lines, conversion_level):
+        yield line
+
+def iter_table_rows(lines, conversion_level='conservative'):
+    """
+    行のイテラブルを1回走査し、表をMarkdown形式に変換した行を、表の行かどうかとともに順に返す
+    
+    各行は一度だけ分割し、列数の状態を保持しながら表の範囲を延ばしていく。
+    表の行数に上限はない。表の条件（最小行数）を満たさなかった場合は、
+    先頭行をそのまま出力し、2行目以降を新たな表の先頭候補として再判定する。
     
-    # 表の検出と変換
-    i = 0
-    while i < len(lines):
-        # 表の候補となる連続した行を検出
-        table_candidate_lines = detect_table_candidate(lines, i, conversion_level)
-        
-        if table_candidate_lines:
-            # 表の候補が見つかった場合、Markdown形式の表に変換
-            table_markdown = convert_to_markdown_table(table_candidate_lines, conversion_level)
-            result_lines.append(table_markdown)
-            i += len(table_candidate_lines)
-        else:
-            # 表の候補でない場合は、そのまま追加
-            result_lines.append(lines[i])
-            i += 1
+    表の候補となる行の特徴
+    1. 複数の列を持つ（区切り文字やスペースで区切られている）
+    2. 各行の列数が先頭行の列数±1以内
+    3. 空行または短すぎる（3文字未満の）行で表が終了する
+    
+    Parameters:
+    -----------
+    lines : iterable
+        テキストの行（改行文字を含まない）
+    conversion_level : str
+        変換の積極性レベル ('conservative', 'moderate', 'aggressive')
     
-    return '\n'.join(result_lines)
+    Yields:
+    -------
+    tuple
+        (表が変換されたテキストの行, 変換したMarkdown形式の表の行かどうか) のタプル
+    """
+    # 最小行数（conservativeはヘッダー行 + データ行2行、moderate/aggressiveは2行）
+    if conversion_level == 'conservative':
+        min_table_rows = 3
+    elif conversion_level in ['moderate', 'aggressive']:
+        min_table_rows = 2
+    else:
+        min_table_rows = 1
+    
+    source = iter(lines)
+    pending = deque()  # 再判定する行
+    table = None       # (区切り文字, 列数, 元の行のリスト, (整形済みの行, 列)のリスト)
+    
+    while True:
+        line = pending.popleft() if pending else next(source, _END)
+        stripped = line.strip() if line is not _END else ''
+        
+        if table is not None:
+            delimiter, column_count, raw_lines, rows = table
+            
+            # 列数が大きく異ならなければ表を延長
+            if len(stripped) >= 3:
+                columns = _split_columns(stripped, delimiter)
+                if column_count - 1 <= len(columns) <= column_count + 1:
+                    raw_lines.append(line)
+                    rows.append((stripped, columns))
+                    continue
+            
+            # 表の終了
+            table = None
+            if len(rows) >= min_table_rows:
+                table_data = _table_data(rows, delimiter)
+                if table_data is None:
+                    for stripped_line, _ in rows:
+                        yield stripped_line, False
+                else:
+                    for table_line in _render_markdown_table(table_data):
+                        yield table_line, True
+            else:
+                # 表でなかった場合、先頭行をそのまま出力し、残りを再判定する
+                yield raw_lines[0], False
+                pending.appendleft(line)
+                pending.extendleft(reversed(raw_lines[1:]))
+                continue
+        
+        if line is _END:
+            break
+        
+        # 表の先頭行の候補か判定
+        delimiter = _detect_delimiter(stripped, conversion_level) if len(stripped) >= 3 else None
+        if delimiter is None:
+            yield line, False
+            continue
+        
+        columns = _split_columns(stripped, delimiter)
+        table = (delimiter, len(columns), [line], [(stripped, columns)])
 
-def detect_table_candidate(lines, start_index, conversion_level):
+def _detect_delimiter(line, conversion_level):
     """
-    表の候補となる連続した行を検出する
+    行の区切り文字を検出する
     
     Parameters:
     -----------
-    lines : list
-        テキストの行のリスト
-    start_index : int
-        検出を開始する行のインデックス
+    line : str
+        前後の空白を除いた行
     conversion_level : str
         変換の積極性レベル
     
     Returns:
     --------
-    list or None
-        表の候補となる行のリスト、または表でない場合はNone
+    str or None
+        区切り文字（スペース区切りの場合は 'space'）、または見つからない場合はNone
     """
-    if start_index >= len(lines):
-        return None
-    
-    # 最小行数（ヘッダー行 + 区切り行 + データ行）
-    min_table_rows = 3
-    
-    # 表の候補となる行の特徴
-    # 1. 複数の列を持つ（区切り文字やスペースで区切られている）
-    # 2. 各行の列数が一致または近い
-    # 3. 各列の幅が一定または近い
-    
-    # 表の候補となる行を収集
-    candidate_lines = []
-    current_index = start_index
-    
-    # 最初の行が表のヘッダーの可能性があるか確認
-    first_line = lines[current_index].strip()
-    
-    # 表の区切り文字を検出
-    delimiters = ['\t', '|', ',']
-    delimiter = None
-    columns = None
-    
-    # 区切り文字で分割してみる
-    for delim in delimiters:
-        if delim in first_line:
-            columns = first_line.split(delim)
-            if len(columns) >= 2:  # 少なくとも2列以上
-                delimiter = delim
-                break
+    for delimiter in _DELIMITERS:
+        if delimiter in line:
+            return delimiter
     
     # 区切り文字が見つからない場合、スペースで区切られた列を検出
-    if not delimiter and conversion_level != 'conservative':
-        # スペースが3つ以上連続している部分を区切りとみなす
-        columns = re.split(r'\s{3,}', first_line)
-        if len(columns) >= 2:
-            delimiter = 'space'
-    
-    # 表の候補が見つからない場合
-    if not delimiter or not columns or len(columns) < 2:
-        return None
-    
-    # 列数
-    column_count = len(columns)
-    
-    # 表の候補となる行を収集
-    while current_index < len(lines) and len(candidate_lines) < 20:  # 最大20行まで
-        line = lines[current_index].strip()
-        
-        # 空行または短すぎる行で表が終了
-        if not line or len(line) < 3:
-            break
-        
-        # 区切り文字で分割
-        if delimiter == 'space':
-            cols = re.split(r'\s{3,}', line)
-        else:
-            cols = line.split(delimiter)
-        
-        # 列数が大きく異なる場合は表の終了
-        if len(cols) < column_count - 1 or len(cols) > column_count + 1:
-            break
-        
-        candidate_lines.append(line)
-        current_index += 1
-    
-    # 表の候補が最小行数未満の場合
-    if len(candidate_lines) < min_table_rows and conversion_level == 'conservative':
-        return None
-    
-    # 表の候補が最小行数未満でも、moderateまたはaggressiveモードでは2行以上あれば許容
-    if len(candidate_lines) < 2 and conversion_level in ['moderate', 'aggressive']:
-        return None
+    if conversion_level != 'conservative' and _SPACE_DELIMITER_PATTERN.search(line):
+        return 'space'
     
-    return candidate_lines
+    return None
+
+def _split_columns(line, delimiter):
+    """行を区切り文字で列に分割する"""
+    if delimiter == 'space':
+        return _SPACE_DELIMITER_PATTERN.split(line)
+    return line.split(delimiter)
 
 def convert_to_markdown_table(table_lines, conversion_level):
     """
@@ -160,31 +186,41 @@ def convert_to_markdown_table(table_lines, conversion_level):
     if not table_lines:
         return ""
     
-    # 表の区切り文字を検出
-    delimiters = ['\t', '|', ',']
-    delimiter = None
+    # 最初の行で区切り文字を検出（見つからない場合はスペース区切り）
+    delimiter = _detect_delimiter(table_lines[0], 'aggressive') or 'space'
     
-    # 最初の行で区切り文字を検出
-    first_line = table_lines[0]
-    for delim in delimiters:
-        if delim in first_line:
-            delimiter = delim
-            break
+    rows = [(line, _split_columns(line.strip(), delimiter)) for line in table_lines]
+    return '\n'.join(_format_table(rows, delimiter))
+
+def _format_table(rows, delimiter):
+    """
+    分割済みの行をMarkdown形式の表の行に変換する
     
-    # 区切り文字が見つからない場合、スペースで区切られた列を検出
-    if not delimiter:
-        # スペースが3つ以上連続している部分を区切りとみなす
-        delimiter = 'space'
+    Parameters:
+    -----------
+    rows : list
+        (元の行, 列のリスト) のタプルのリスト
+    delimiter : str
+        区切り文字（スペース区切りの場合は 'space'）
     
-    # 各行を列に分割
+    Returns:
+    --------
+    list
+        Markdown形式の表の行のリスト（表にできない場合は元の行のリスト）
+    """
+    table_data = _table_data(rows, delimiter)
+    if table_data is None:
+        return [line for line, _ in rows]
+    return _render_markdown_table(table_data)
+
+def _table_data(rows, delimiter):
+    """分割済みの行から空の列を除いたセルのリストを作成する（表にできない場合はNone）"""
     table_data = []
     max_columns = 0
     
-    for line in table_lines:
-        if delimiter == 'space':
-            columns = re.split(r'\s{3,}', line.strip())
-        else:
-            columns = [col.strip() for col in line.split(delimiter)]
+    for _, columns in rows:
+        if delimiter != 'space':
+            columns = [col.strip() for col in columns]
         
         # 空の列を削除
         columns = [col for col in columns if col]
@@ -195,27 +231,279 @@ def convert_to_markdown_table(table_lines, conversion_level):
     
     # 表データが空の場合
     if not table_data or max_columns < 2:
-        return '\n'.join(table_lines)
+        return None
+    
+    return table_data
+
+def _render_markdown_table(table_data):
+    """
+    セルのテキストの2次元リストをMarkdown形式の表の行に変換する
+    
+    Parameters:
+    -----------
+    table_data : list
+        行ごとのセルのテキストのリスト（先頭行はヘッダー）
+    
+    Returns:
+    --------
+    list
+        Markdown形式の表の行のリスト
+    """
+    max_columns = max(len(columns) for columns in table_data)
     
     # 各行の列数を揃える
-    for i in range(len(table_data)):
-        while len(table_data[i]) < max_columns:
-            table_data[i].append('')
+    for columns in table_data:
+        columns.extend([''] * (max_columns - len(columns)))
     
     # Markdown形式の表を生成
     markdown_table = []
     
     # ヘッダー行
-    header = '| ' + ' | '.join(table_data[0]) + ' |'
-    markdown_table.append(header)
+    markdown_table.append('| ' + ' | '.join(table_data[0]) + ' |')
     
     # 区切り行
-    separator = '| ' + ' | '.join(['---'] * max_columns) + ' |'
-    markdown_table.append(separator)
+    markdown_table.append('| ' + ' | '.join(['---'] * max_columns) + ' |')
     
     # データ行
-    for row in table_data[1:]:
-        data_row = '| ' + ' | '.join(row) + ' |'
-        markdown_table.append(data_row)
+    for columns in table_data[1:]:
+        markdown_table.append('| ' + ' | '.join(columns) + ' |')
+    
+    return markdown_table
+
+def split_observations_by_table(observations, conversion_level='conservative',
+                                row_tolerance=0.5, column_tolerance=0.02):
+    """
+    観測値の位置情報から表を検出し、表とそれ以外の部分に分割する
+    
+    区切り文字を含まないOCR結果でも表を検出できるよう、バウンディングボックスの
+    座標を使用する。行は縦方向の中心座標を1次元クラスタリングし、表のセルらしい行が連続する範囲の中で
+    セルの左端のX座標をクラスタリングして、同じ列の組み合わせにそろった行が連続する範囲を表とみなす
+    （detect_tables_from_observations を参照）。
+    
+    Parameters:
+    -----------
+    observations : list
+        位置情報を含む観測値（辞書）のリスト（OCRの出現順）
+    conversion_level : str
+        変換の積極性レベル ('conservative', 'moderate', 'aggressive')
+    row_tolerance : float
+        同じ行とみなす縦方向の間隔（観測値の高さの中央値に対する比率）
+    column_tolerance : float
+        同じ列とみなす左端の間隔（正規化座標）
+    
+    Returns:
+    --------
+    list
+        ('text', 観測値のリスト) または ('table', Markdown形式の表) のタプルのリスト。
+        表は、その表に含まれる最初の観測値の位置に置かれる
+    """
+    tables = detect_tables_from_observations(observations, conversion_level, row_tolerance, column_tolerance)
+    if not tables:
+        return [('text', list(observations))] if observations else []
+    
+    # 観測値のインデックス -> 表の番号
+    owner = {}
+    for table_index, (indices, _) in enumerate(tables):
+        for index in indices:
+            owner[index] = table_index
+    
+    segments = []
+    current = []
+    emitted = set()
+    for index, observation in enumerate(observations):
+        table_index = owner.get(index)
+        if table_index is None:
+            current.append(observation)
+            continue
+        if table_index in emitted:
+            continue
+        if current:
+            segments.append(('text', current))
+            current = []
+        segments.append(('table', tables[table_index][1]))
+        emitted.add(table_index)
+    if current:
+        segments.append(('text', current))
+    
+    return segments
+
+def detect_tables_from_observations(observations, conversion_level='conservative',
+                                    row_tolerance=0.5, column_tolerance=0.02):
+    """
+    観測値の位置情報から表を検出する
+    
+    行ごとに、隣り合う観測値をセル（間隔が _CELL_GAP 未満のものは1つのセル）にまとめ、
+    表のセルらしい行（セルの幅が列の間隔に比べて十分に狭く、文字数が少ない行）が連続する範囲を
+    表の候補とする。段組みの文章は、各段の行が列の間隔のほぼ全体を占め、文字数も多いため、
+    候補にならない。列は候補の範囲ごとに、その範囲のセルの左端だけでクラスタリングする
+    （ページの他の部分の左端で、別の列がつながらないようにするため）。
     
-    return '\n'.join(markdown_table)
+    Parameters:
+    -----------
+    observations : list
+        位置情報を含む観測値（辞書）のリスト
+    conversion_level : str
+        変換の積極性レベル
+        conservativeは3列3行以上、moderate/aggressiveは2列2行以上を表とみなす
+    row_tolerance : float
+        同じ行とみなす縦方向の間隔（観測値の高さの中央値に対する比率）
+    column_tolerance : float
+        同じ列とみなす左端の間隔（正規化座標）
+    
+    Returns:
+    --------
+    list
+        (表に含まれる観測値のインデックスのリスト, Markdown形式の表) のタプルのリスト
+    """
+    if conversion_level == 'conservative':
+        min_rows, min_columns = 3, 3
+    else:
+        min_rows, min_columns = 2, 2
+    
+    if len(observations) < min_rows * min_columns:
+        return []
+    
+    # NumPyは位置情報から表を検出する場合にだけ読み込む（インポート時間を短くするため）
+    import numpy as np
+    
+    x = np.fromiter((o['x'] for o in observations), dtype=np.float64, count=len(observations))
+    y = np.fromiter((o['y'] for o in observations), dtype=np.float64, count=len(observations))
+    width = np.fromiter((o['width'] for o in observations), dtype=np.float64, count=len(observations))
+    height = np.fromiter((o['height'] for o in observations), dtype=np.float64, count=len(observations))
+    
+    # 行のクラスタリング（左下原点のため、中心座標の降順が上から下の順）
+    row_labels = _cluster_1d(-(y + height / 2), row_tolerance * float(np.median(height)))
+    row_count = int(row_labels.max()) + 1
+    
+    # 行ごとに、左から順に観測値をセルにまとめる
+    cells = _group_cells(observations, x, width, row_labels)
+    row_cells = [[] for _ in range(row_count)]
+    for cell in cells:
+        row_cells[cell['row']].append(cell)
+    
+    # 表のセルらしい行が連続する範囲ごとに、列をクラスタリングして表を求める
+    is_candidate = [_is_table_row(cells_in_row, min_columns) for cells_in_row in row_cells]
+    tables = []
+    start = None
+    for row in range(row_count + 1):
+        if row < row_count and is_candidate[row]:
+            if start is None:
+                start = row
+            continue
+        if start is not None and row - start >= min_rows:
+            tables.extend(_detect_region_tables(observations, x, row_cells[start:row],
+                                                min_rows, min_columns, column_tolerance))
+        start = None
+    
+    return tables
+
+def _group_cells(observations, x, width, row_labels):
+    """
+    行ごとに左から順に観測値を並べ、間隔が _CELL_GAP 未満の観測値を1つのセルにまとめる
+    
+    Returns:
+    --------
+    list
+        セルの辞書（'row', 'left', 'right', 'chars', 'indices'）のリスト（行の順、行の中では左から順）
+    """
+    import numpy as np
+    cells = []
+    current = None
+    for index in np.lexsort((x, row_labels)):
+        row = int(row_labels[index])
+        left = float(x[index])
+        right = left + float(width[index])
+        if current is None or current['row'] != row or left - current['right'] >= _CELL_GAP:
+            current = {'row': row, 'left': left, 'right': right, 'chars': 0, 'indices': []}
+            cells.append(current)
+        current['right'] = max(current['right'], right)
+        current['chars'] += len(observations[index]['text'].strip())
+        current['indices'].append(int(index))
+    return cells
+
+def _is_table_row(cells, min_columns):
+    """
+    行が表の行らしいかどうか（セルの数が十分で、セルが列の間隔に比べて狭く、文字数が少ない）
+    
+    セルの占める割合は、セルの幅を次のセルの左端までの距離（最後のセルは、行の列の間隔の中央値）で
+    割った値で判定する。中央値が _MAX_CELL_FILL 以下で、どのセルも _MAX_CELL_FILL_ANY 以下の行だけを
+    表の行とみなす（段落の最後の短い行が並んでも、もう一方の段の行が段を埋めていれば除外される）。
+    """
+    if len(cells) < min_columns:
+        return False
+    pitches = [following['left'] - cell['left'] for cell, following in zip(cells, cells[1:])]
+    pitches.append(_median(sorted(pitches)))
+    fills = sorted((cell['right'] - cell['left']) / pitch for cell, pitch in zip(cells, pitches))
+    chars = sorted(cell['chars'] for cell in cells)
+    return (_median(fills) <= _MAX_CELL_FILL and fills[-1] <= _MAX_CELL_FILL_ANY
+            and _median(chars) <= _MAX_CELL_CHARS)
+
+def _median(values):
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+def _detect_region_tables(observations, x, rows, min_rows, min_columns, column_tolerance):
+    """
+    表の候補の範囲（行ごとのセルのリスト）の中で列をクラスタリングし、
+    十分な列を持ち、前の行と十分な列を共有している行が min_rows 行以上連続する部分を表として返す
+    """
+    import numpy as np
+    cells = [cell for cells_in_row in rows for cell in cells_in_row]
+    column_labels = _cluster_1d(np.array([cell['left'] for cell in cells]), column_tolerance)
+    
+    occupied = np.zeros((len(rows), int(column_labels.max()) + 1), dtype=bool)
+    position = 0
+    for row, cells_in_row in enumerate(rows):
+        for cell in cells_in_row:
+            cell['column'] = int(column_labels[position])
+            occupied[row, cell['column']] = True
+            position += 1
+    
+    is_tabular = occupied.sum(axis=1) >= min_columns
+    shares_columns = np.zeros(len(rows), dtype=bool)
+    shares_columns[1:] = (occupied[1:] & occupied[:-1]).sum(axis=1) >= min_columns
+    
+    tables = []
+    start = None
+    for row in range(len(rows) + 1):
+        continues = row < len(rows) and is_tabular[row] and (start is not None and shares_columns[row])
+        if continues:
+            continue
+        if start is not None and row - start >= min_rows:
+            tables.append(_build_geometry_table(observations, x, rows[start:row], occupied[start:row]))
+        start = row if row < len(rows) and is_tabular[row] else None
+    return tables
+
+def _cluster_1d(values, tolerance):
+    """
+    1次元の値を、間隔が tolerance を超える位置で区切ってクラスタリングする
+    
+    Returns:
+    --------
+    numpy.ndarray
+        各値のクラスタ番号（値の小さい順に0から振られる）
+    """
+    import numpy as np
+    order = np.argsort(values, kind='stable')
+    gaps = np.diff(values[order]) > tolerance
+    labels = np.empty(len(values), dtype=np.intp)
+    labels[order] = np.concatenate(([0], np.cumsum(gaps)))
+    return labels
+
+def _build_geometry_table(observations, x, rows, occupied):
+    """検出した行の範囲（行ごとのセルのリスト）から、観測値のインデックスとMarkdown形式の表を作成する"""
+    import numpy as np
+    # 表で使われている列だけを残す
+    columns = np.flatnonzero(occupied.any(axis=0))
+    column_position = {int(column): position for position, column in enumerate(columns)}
+    
+    # 同じセル（同じ列）に複数の観測値がある場合は左から順に連結する
+    indices = []
+    table_data = []
+    for cells_in_row in rows:
+        texts = [[] for _ in columns]
+        for cell in cells_in_row:
+            texts[column_position[cell['column']]].extend(observations[index]['text'] for index in cell['indices'])
+            indices.extend(cell['indices'])
+        table_data.append([' '.join(cell_texts) for cell_texts in texts])
+    return sorted(indices), '\n'.join(_render_markdown_table(table_data))
@@ -0,0 +1,310 @@
+"""
+タイル分割OCRモジュール
+
+ポスターや縦に長いスクリーンショットなどの大きな画像を、重なりを持つタイルに分割して
+並列に認識し、観測値を画像全体の座標に戻して統合する機能を提供します。
+タイルの重なり部分で重複して認識された観測値は、空間インデックスを使って取り除き、
+タイルの境界で分断された行は、重なり部分のテキストを手掛かりに連結します。
+"""
+
+import statistics
+from difflib import SequenceMatcher
+
+from .backend import OCRBackend
+
+# タイルの一辺の既定の大きさ（ピクセル）
+DEFAULT_TILE_SIZE = 2048
+
+# 隣り合うタイルの重なりの既定の幅（ピクセル）
+DEFAULT_TILE_OVERLAP = 256
+
+def plan_tiles(width, height, tile_size=DEFAULT_TILE_SIZE, overlap=DEFAULT_TILE_OVERLAP):
+    """
+    画像を重なりを持つタイルに分割する
+
+    最後の列・行のタイルは画像の端に揃えるため、隣のタイルとの重なりは overlap 以上になる。
+
+    Parameters:
+    -----------
+    width : int
+        画像の幅（ピクセル）
+    height : int
+        画像の高さ（ピクセル）
+    tile_size : int
+        タイルの一辺の大きさ（ピクセル）
+    overlap : int
+        隣り合うタイルの重なりの幅（ピクセル）
+
+    Returns:
+    --------
+    list
+        (x, y, 幅, 高さ) のタプルのリスト（左下原点のピクセル座標、上の行から順）
+    """
+    if overlap >= tile_size:
+        raise ValueError("タイルの重なりはタイルの大きさより小さくしてください")
+    xs = _tile_starts(width, tile_size, overlap)
+    ys = _tile_starts(height, tile_size, overlap)
+    return [(x, y, min(tile_size, width - x), min(tile_size, height - y))
+            for y in reversed(ys) for x in xs]
+
+def _tile_starts(length, tile_size, overlap):
+    """一方向のタイルの開始位置を返す"""
+    if length <= tile_size:
+        return [0]
+    step = tile_size - overlap
+    starts = list(range(0, length - tile_size, step))
+    starts.append(length - tile_size)
+    return starts
+
+def map_tile_observations(observations, tile, width, height):
+    """
+    タイル内の正規化座標の観測値を、画像全体の正規化座標に変換する
+
+    Parameters:
+    -----------
+    observations : list
+        タイルの観測値（辞書）のリスト
+    tile : tuple
+        (x, y, 幅, 高さ) のタプル（左下原点のピクセル座標）
+    width : int
+        画像全体の幅（ピクセル）
+    height : int
+        画像全体の高さ（ピクセル）
+
+    Returns:
+    --------
+    list
+        変換した観測値（辞書）のリスト
+    """
+    tile_x, tile_y, tile_width, tile_height = tile
+    return [dict(observation,
+                 x=(tile_x + observation['x'] * tile_width) / width,
+                 y=(tile_y + observation['y'] * tile_height) / height,
+                 width=observation['width'] * tile_width / width,
+                 height=observation['height'] * tile_height / height)
+            for observation in observations]
+
+class SpatialIndex:
+    """
+    矩形を一様なグリッドに登録し、近くにある矩形を検索する空間インデックス
+
+    矩形は (x, y, 幅, 高さ) のタプルで、重なっているすべてのセルに登録される。
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self._cells = {}
+
+    def _cells_for(self, box):
+        x, y, width, height = box
+        size = self.cell_size
+        for cell_x in range(int(x // size), int((x + width) // size) + 1):
+            for cell_y in range(int(y // size), int((y + height) // size) + 1):
+                yield cell_x, cell_y
+
+    def insert(self, item, box):
+        """矩形を項目とともに登録する"""
+        for cell in self._cells_for(box):
+            self._cells.setdefault(cell, []).append(item)
+
+    def query(self, box):
+        """矩形と同じセルに登録されている項目の集合を返す（重なりの判定は呼び出し側で行う）"""
+        found = set()
+        for cell in self._cells_for(box):
+            found.update(self._cells.get(cell, ()))
+        return found
+
+def merge_tile_observations(tile_results, width, height, overlap_threshold=0.6, similarity_threshold=0.8):
+    """
+    タイルごとの観測値を画像全体の観測値に統合する
+
+    同じ行の観測値が重なり部分で左右に分断されている場合は、1つの観測値に連結する。
+    重なり部分で同じテキストが複数のタイルから認識された場合は、タイルの境界で
+    切れていない可能性が高い大きい観測値（同じ大きさなら信頼度の高い観測値）を残す。
+
+    Parameters:
+    -----------
+    tile_results : iterable
+        (タイル, タイル内の正規化座標の観測値のリスト) のタプル
+    width : int
+        画像全体の幅（ピクセル）
+    height : int
+        画像全体の高さ（ピクセル）
+    overlap_threshold : float
+        重複とみなす矩形の重なりの割合（小さい方の矩形の面積に対する割合）
+    similarity_threshold : float
+        重複とみなすテキストの一致の割合（短い方のテキストの長さに対する共通部分の割合）
+
+    Returns:
+    --------
+    list
+        統合した観測値（辞書）のリスト（読み順）
+    """
+    candidates = []  # (観測値, タイルの内側の境界に接しているかどうか)
+    for tile, observations in tile_results:
+        tile_x, tile_y, tile_width, tile_height = tile
+        # 画像の端ではないタイルの境界（これに接する観測値は途中で切れている可能性がある）
+        left = tile_x / width if tile_x > 0 else None
+        right = (tile_x + tile_width) / width if tile_x + tile_width < width else None
+        bottom = tile_y / height if tile_y > 0 else None
+        top = (tile_y + tile_height) / height if tile_y + tile_height < height else None
+        for observation in map_tile_observations(observations, tile, width, height):
+            # 境界との距離が文字1つ分（行の高さ）未満なら、境界で切れた文字を含んでいるとみなす
+            margin_x = observation['height'] * height / width
+            margin_y = observation['height'] / 2
+            at_edge = ((left is not None and observation['x'] - left < margin_x)
+                       or (right is not None and right - observation['x'] - observation['width'] < margin_x)
+                       or (bottom is not None and observation['y'] - bottom < margin_y)
+                       or (top is not None and top - observation['y'] - observation['height'] < margin_y))
+            candidates.append((observation, at_edge))
+    if not candidates:
+        return []
+
+    candidates.sort(key=lambda c: (c[0]['width'] * c[0]['height'], c[0]['confidence']), reverse=True)
+
+    # セルの大きさは文字の高さの数倍にして、1つの観測値が登録されるセルの数を抑える
+    cell_size = min(max(statistics.median(c[0]['height'] for c in candidates) * 4, 0.005), 0.25)
+    index = SpatialIndex(cell_size)
+    kept = []
+
+    for observation, at_edge in candidates:
+        box = _box(observation)
+        merged = False
+        for i in sorted(index.query(box)):
+            other = kept[i]
+            stitched = _stitch(other, observation)
+            if stitched is not None:
+                # 連結後の矩形でも検索できるよう、同じ番号で登録し直す
+                kept[i] = stitched
+                index.insert(i, _box(stitched))
+                merged = True
+                break
+            if _is_duplicate(other, observation, overlap_threshold, similarity_threshold, at_edge):
+                merged = True
+                break
+        if not merged:
+            index.insert(len(kept), box)
+            kept.append(observation)
+
+    return sort_reading_order(kept)
+
+def sort_reading_order(observations):
+    """
+    観測値を読み順（上の行から、同じ行は左から）に並べ替える
+
+    Parameters:
+    -----------
+    observations : list
+        観測値（辞書）のリスト
+
+    Returns:
+    --------
+    list
+        並べ替えた観測値のリスト
+    """
+    lines = []  # [行の中心のy座標, 行の高さ, 観測値のリスト]
+    for observation in sorted(observations, key=lambda o: o['y'] + o['height'] / 2, reverse=True):
+        center = observation['y'] + observation['height'] / 2
+        if lines and lines[-1][0] - center <= min(lines[-1][1], observation['height']) / 2:
+            lines[-1][2].append(observation)
+        else:
+            lines.append([center, observation['height'], [observation]])
+    return [observation for _, _, line in lines for observation in sorted(line, key=lambda o: o['x'])]
+
+def _box(observation):
+    return observation['x'], observation['y'], observation['width'], observation['height']
+
+def _overlap(a, b):
+    """2つの観測値の矩形が重なる部分の幅と高さを返す"""
+    overlap_x = min(a['x'] + a['width'], b['x'] + b['width']) - max(a['x'], b['x'])
+    overlap_y = min(a['y'] + a['height'], b['y'] + b['height']) - max(a['y'], b['y'])
+    return max(0.0, overlap_x), max(0.0, overlap_y)
+
+def _is_duplicate(a, b, overlap_threshold, similarity_threshold, at_edge=False):
+    """
+    2つの観測値が、同じテキストを別々のタイルから認識したものかどうか
+
+    b がタイルの境界で切れている場合は、テキストが一致しなくても（切れた文字を誤認識していても）重複とみなす。
+    """
+    overlap_x, overlap_y = _overlap(a, b)
+    smaller = min(a['width'] * a['height'], b['width'] * b['height'])
+    if smaller <= 0 or overlap_x * overlap_y / smaller < overlap_threshold:
+        return False
+    if at_edge:
+        return True
+    text_a, text_b = a['text'].strip(), b['text'].strip()
+    shorter = min(len(text_a), len(text_b))
+    if shorter == 0:
+        return True
+    match = SequenceMatcher(None, text_a, text_b, autojunk=False).find_longest_match(
+        0, len(text_a), 0, len(text_b))
+    return match.size / shorter >= similarity_threshold
+
+def _stitch(a, b):
+    """
+    タイルの境界で左右に分断された同じ行の観測値を連結する（連結できない場合はNone）
+
+    左側の観測値の末尾と右側の観測値の先頭が、重なり部分で同じテキストになっている場合に連結する。
+    """
+    overlap_x, overlap_y = _overlap(a, b)
+    if overlap_x <= 0 or overlap_y < min(a['height'], b['height']) * 0.5:
+        return None
+    left, right = (a, b) if a['x'] <= b['x'] else (b, a)
+    if left['x'] + left['width'] >= right['x'] + right['width']:
+        return None
+
+    left_text, right_text = left['text'], right['text']
+    match = SequenceMatcher(None, left_text, right_text, autojunk=False).find_longest_match(
+        0, len(left_text), 0, len(right_text))
+    # 境界で切れた1文字は誤認識されることがあるため、前後1文字のずれを許容する
+    if match.size == 0 or match.a + match.size < len(left_text) - 1 or match.b > 1:
+        return None
+
+    x = left['x']
+    y = min(left['y'], right['y'])
+    return dict(left,
+                text=left_text[:match.a] + right_text[match.b:],
+                x=x,
+                y=y,
+                width=right['x'] + right['width'] - x,
+                height=max(left['y'] + left['height'], right['y'] + right['height']) - y,
+                confidence=min(left['confidence'], right['confidence']))
+
+class TiledBackend(OCRBackend):
+    """
+    大きな画像をタイルに分割して認識するバックエンド
+
+    画像の幅または高さが tile_size を超える場合だけ、画像をタイルに分割して
+    内側のバックエンドの recognize_tiles() で並列に認識し、結果を統合する。
+    それ以外の画像や、大きさが分からない画像は、そのまま内側のバックエンドで認識する。
+    """
+
+    def __init__(self, backend, tile_size=DEFAULT_TILE_SIZE, overlap=DEFAULT_TILE_OVERLAP, max_workers=None):
+        if overlap >= tile_size:
+            raise ValueError("タイルの重なりはタイルの大きさより小さくしてください")
+        self.backend = backend
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.max_workers = max_workers
+
+    def settings(self):
+        return dict(self.backend.settings(), tile_size=self.tile_size, tile_overlap=self.overlap)
+
+    def warm_up(self):
+        self.backend.warm_up()
+
+    def page_count(self, image_path):
+        return self.backend.page_count(image_path)
+
+    def image_size(self, image_path, page=None):
+        return self.backend.image_size(image_path, page)
+
+    def recognize(self, image_path, page=None):
+        size = self.backend.image_size(image_path, page)
+        if size is None or (size[0] <= self.tile_size and size[1] <= self.tile_size):
+            return self.backend.recognize(image_path, page)
+
+        width, height = size
+        tiles = plan_tiles(width, height, self.tile_size, self.overlap)
+        results = self.backend.recognize_tiles(image_path, tiles, page, self.max_workers)
+        return merge_tile_observations(zip(tiles, results), width, height)
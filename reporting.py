@@ -0,0 +1,251 @@
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import sys
+import threading
+import time
+
+# 出力先が端末でない場合（ファイルやパイプ）に、進捗をログに記録する間隔（秒）
+PLAIN_PROGRESS_INTERVAL = 10.0
+
+def format_duration(seconds):
+    """秒数を H:MM:SS（1時間未満の場合は M:SS）の形式にする"""
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+def format_progress(completed, total, failed, elapsed, total_known=True):
+    """
+    進捗の1行を作成する
+
+    Parameters:
+    -----------
+    completed : int
+        完了した画像の数
+    total : int
+        画像の総数（探索中の場合はそれまでに見つかった数）
+    failed : int
+        処理に失敗した画像の数
+    elapsed : float
+        開始からの経過時間（秒）
+    total_known : bool
+        画像の探索が完了し、総数が確定しているかどうか
+
+    Returns:
+    --------
+    str
+        進捗の表示（例: "[120/500] 24% 3.2件/秒 残り 1:58"）
+    """
+    rate = completed / elapsed if elapsed > 0 else 0.0
+    if total_known:
+        percent = completed * 100 // total if total else 100
+        parts = [f"[{completed}/{total}]", f"{percent}%"]
+    else:
+        parts = [f"[{completed}/{total}+]"]
+    parts.append(f"{rate:.1f}件/秒")
+    if failed:
+        parts.append(f"失敗 {failed}")
+    if total_known and rate > 0 and completed < total:
+        parts.append(f"残り {format_duration((total - completed) / rate)}")
+    elif not total_known:
+        parts.append("探索中")
+    return " ".join(parts)
+
+class ProgressLine:
+    """
+    進捗を1行で表示する
+
+    出力先が端末の場合は最終行を書き換えて表示し、更新は interval 秒に1回までに制限する。
+    端末でない場合は、plain_interval 秒に1回、進捗をログに記録する。
+    ログのメッセージは ConsoleHandler が進捗の行を消してから出力し、出力後に再表示する。
+    """
+
+    def __init__(self, stream, enabled=True, interval=0.2, plain_interval=PLAIN_PROGRESS_INTERVAL):
+        self.stream = stream
+        self.enabled = enabled
+        self.interactive = enabled and hasattr(stream, 'isatty') and stream.isatty()
+        self.interval = interval if self.interactive else plain_interval
+        self.lock = threading.RLock()
+        self.started_at = time.time()
+        self._text = ""
+        self._shown = False
+        self._updated_at = self.started_at
+
+    def update(self, completed, total, failed=0, total_known=True, force=False):
+        """
+        進捗を更新する（前回の更新から interval 秒経過していない場合は何もしない）
+
+        Parameters:
+        -----------
+        completed, total, failed, total_known
+            format_progress() を参照
+        force : bool
+            経過時間にかかわらず更新する
+        """
+        if not self.enabled:
+            return
+        now = time.time()
+        if not force and now - self._updated_at < self.interval:
+            return
+        self._updated_at = now
+        text = format_progress(completed, total, failed, now - self.started_at, total_known)
+        if self.interactive:
+            with self.lock:
+                self._text = text
+                self._draw()
+        else:
+            logging.getLogger(__name__).info(text)
+
+    def clear(self):
+        """表示中の進捗の行を消す（lock を取得した状態で呼び出す）"""
+        if self._shown:
+            self.stream.write("\r\x1b[K")
+            self._shown = False
+
+    def restore(self):
+        """clear() で消した進捗の行を再表示する（lock を取得した状態で呼び出す）"""
+        if self._text:
+            self._draw()
+
+    def close(self):
+        """進捗の行を確定し、以降のメッセージを次の行から出力する"""
+        with self.lock:
+            if self._shown:
+                self.stream.write("\n")
+                self.stream.flush()
+            self._text = ""
+            self._shown = False
+
+    def _draw(self):
+        self.stream.write("\r\x1b[K" + self._text)
+        self.stream.flush()
+        self._shown = True
+
+class ConsoleHandler(logging.StreamHandler):
+    """進捗の行と重ならないように、ログのメッセージを出力するハンドラ"""
+
+    def __init__(self, stream, progress=None):
+        super().__init__(stream)
+        self.progress = progress
+
+    def emit(self, record):
+        if self.progress is None or not self.progress.interactive:
+            super().emit(record)
+            return
+        with self.progress.lock:
+            self.progress.clear()
+            super().emit(record)
+            self.progress.restore()
+
+class EventStream:
+    """
+    ジョブ管理などのプログラム向けに、処理のイベントをJSONL形式（1行に1イベント）で出力する
+
+    各イベントは 'time'（UNIX時刻）と 'event'（イベントの種類）に、イベントごとの項目を加えたJSONオブジェクト。
+    path に '-' を指定した場合は標準出力に出力する。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = sys.stdout if path == '-' else open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        line = json.dumps(dict({'time': round(time.time(), 3), 'event': event}, **fields), ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        if self._file is not sys.stdout:
+            self._file.close()
+
+class EventHandler(logging.Handler):
+    """警告以上のログを 'log' イベントとして EventStream に出力するハンドラ"""
+
+    def __init__(self, events, level=logging.WARNING):
+        super().__init__(level)
+        self.events = events
+
+    def emit(self, record):
+        try:
+            self.events.emit('log', level=record.levelname, logger=record.name, message=record.getMessage())
+        except Exception:
+            self.handleError(record)
+
+class Reporter:
+    """
+    ログ・進捗・イベントの出力をまとめて管理する
+
+    メインプロセスのログは直接出力し、ワーカープロセスのログは log_queue を通して
+    メインプロセスのリスナースレッドで出力する（複数のプロセスが同時に出力に書き込まない）。
+    ワーカーでは initialize_worker_logging(reporter.log_queue, reporter.level) を呼び出す。
+
+    Parameters:
+    -----------
+    quiet : bool
+        警告とエラーだけを出力し、進捗を表示しない
+    verbose : bool
+        画像ごとのメッセージも出力する
+    events_path : str
+        イベントを出力するJSONLファイル（'-' の場合は標準出力、Noneの場合は出力しない）
+    context : multiprocessing.context.BaseContext
+        ワーカープロセスの起動に使用するコンテキスト（log_queue は同じコンテキストで作成する必要がある）
+    """
+
+    def __init__(self, quiet=False, verbose=False, events_path=None, context=None):
+        if quiet:
+            self.level = logging.WARNING
+        elif verbose:
+            self.level = logging.DEBUG
+        else:
+            self.level = logging.INFO
+        self.events = EventStream(events_path) if events_path else None
+        # イベントを標準出力に出力する場合、人が読むための出力は標準エラー出力に分ける
+        stream = sys.stderr if events_path == '-' else sys.stdout
+        self.progress = ProgressLine(stream, enabled=not quiet)
+
+        console = ConsoleHandler(stream, self.progress)
+        console.setFormatter(logging.Formatter('%(message)s'))
+        self._handlers = [console]
+        if self.events:
+            self._handlers.append(EventHandler(self.events))
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        for handler in self._handlers:
+            root.addHandler(handler)
+        root.setLevel(self.level)
+
+        self.log_queue = (context or multiprocessing).Queue()
+        self._listener = logging.handlers.QueueListener(self.log_queue, *self._handlers, respect_handler_level=True)
+        self._listener.start()
+
+    def event(self, event, **fields):
+        """イベントを出力する（イベントの出力が無効な場合は何もしない）"""
+        if self.events:
+            self.events.emit(event, **fields)
+
+    def close(self):
+        """ワーカーから受け取ったログをすべて出力し、進捗の表示とイベントの出力を終了する"""
+        self._listener.stop()
+        self.progress.close()
+        if self.events:
+            self.events.close()
+
+def initialize_worker_logging(log_queue, level=logging.INFO):
+    """
+    ワーカープロセスのログを、キューを通してメインプロセスに送るよう設定する
+
+    level 未満のログはワーカー内で破棄され、キューには送られない。
+    """
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
@@ -0,0 +1,364 @@
+import concurrent.futures
+import functools
+import http.server
+import json
+import logging
+import os
+import socketserver
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs
+
+from ocr.core import recognize_page
+from ocr.backend import OCRBackendError
+from ocr.metrics import MetricsAggregator, RESERVOIR_SIZE
+
+logger = logging.getLogger(__name__)
+
+# 受け付ける画像のデータの最大サイズ（バイト）
+MAX_BODY_BYTES = 100 * 1024 * 1024
+
+# 画像のデータの Content-Type と、一時ファイルの拡張子の対応
+CONTENT_TYPE_EXTENSIONS = {
+    'image/png': '.png',
+    'image/jpeg': '.jpg',
+    'image/tiff': '.tiff',
+    'image/heic': '.heic',
+    'image/gif': '.gif',
+    'image/bmp': '.bmp',
+    'application/pdf': '.pdf'
+}
+
+# 結果の形式
+RESULT_FORMATS = ('markdown', 'observations')
+
+class RequestError(Exception):
+    """リクエストの内容が正しくない場合のエラー（HTTPのステータスコードを持つ）"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def recognize_batch(items):
+    """
+    まとめて届いたリクエストの画像を順に認識する関数（ワーカープロセスで実行する）
+
+    Parameters:
+    -----------
+    items : list
+        'image_path', 'page', 'format' と後処理の設定を含む辞書のリスト
+
+    Returns:
+    --------
+    list
+        項目ごとの結果の辞書のリスト（'markdown' または 'observations'、失敗した場合は 'error' と 'status'）。
+        いずれも 'worker_ms'（ワーカーでの処理時間）を含む
+    """
+    results = []
+    for item in items:
+        started_at = time.perf_counter()
+        try:
+            page = recognize_page(item['image_path'], page=item['page'])
+            if item['format'] == 'observations':
+                result = {'observations': page.observations()}
+            else:
+                result = {'markdown': page.render(item['format_text'], item['detect_tables'],
+                                                  item['analyze_layout'], item['conversion_level'])}
+        except OCRBackendError as e:
+            result = {'error': str(e), 'status': 422}
+        except Exception as e:
+            logger.error(f"エラー: 画像 {os.path.basename(item['image_path'])} の処理中に例外が発生しました: {str(e)}")
+            result = {'error': str(e), 'status': 500}
+        result['worker_ms'] = round((time.perf_counter() - started_at) * 1000, 3)
+        results.append(result)
+    return results
+
+def warm_up_worker(seconds):
+    """
+    ワーカーの起動を待つための関数（ワーカープロセスで実行する）
+
+    このモジュールもワーカーで読み込まれるため、最初のリクエストで読み込みを待たずに済む。
+    """
+    time.sleep(seconds)
+
+class OCRService:
+    """
+    リクエストを MicroBatcher に渡し、結果とリクエストごとの遅延を管理する
+
+    画像のデータで届いたリクエストは一時ファイルに保存してから認識し、応答後に削除する
+    （タイムアウトした時点で認識中だった場合は、認識が終わってから削除する）。
+    リクエストごとの遅延（受信から応答の作成まで）は 'request' 段階として集計する。
+    長時間動作するため、集計に保持する値は RESERVOIR_SIZE 個までの標本に制限する。
+
+    Parameters:
+    -----------
+    batcher : MicroBatcher
+        認識を実行する MicroBatcher（fn は recognize_batch）
+    defaults : dict
+        リクエストで指定されなかった場合の後処理の設定（'format_text', 'detect_tables',
+        'analyze_layout', 'conversion_level'）
+    request_timeout : float
+        1つのリクエストの結果を待つ最大の秒数
+    """
+
+    def __init__(self, batcher, defaults, request_timeout=300.0):
+        self.batcher = batcher
+        self.defaults = defaults
+        self.request_timeout = request_timeout
+        self.metrics = MetricsAggregator(RESERVOIR_SIZE)
+        self.started_at = time.time()
+        self.requests = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._temp_dir = tempfile.mkdtemp(prefix='apple-ocr-serve-')
+
+    def parse_options(self, query, body=None):
+        """
+        クエリ文字列（とJSONの本文）から、認識と後処理の設定を作成する
+
+        Raises:
+        -------
+        RequestError
+            設定の値が正しくない場合
+        """
+        options = dict(self.defaults, format='markdown', page=None)
+        values = {name: values[-1] for name, values in query.items()}
+        if body:
+            values.update({name: value for name, value in body.items() if name != 'path'})
+        for name, value in values.items():
+            if name in ('format_text', 'detect_tables', 'analyze_layout'):
+                options[name] = _parse_bool(name, value)
+            elif name == 'raw':
+                options['format_text'] = not _parse_bool(name, value)
+            elif name == 'conversion_level':
+                if value not in ('conservative', 'moderate', 'aggressive'):
+                    raise RequestError(f"conversion_level の値が正しくありません: {value}")
+                options[name] = value
+            elif name == 'format':
+                if value not in RESULT_FORMATS:
+                    raise RequestError(f"format には {' または '.join(RESULT_FORMATS)} を指定してください: {value}")
+                options[name] = value
+            elif name == 'page':
+                try:
+                    options['page'] = int(value) - 1 if value not in (None, '') else None
+                except (TypeError, ValueError):
+                    raise RequestError(f"page の値が正しくありません: {value}")
+                if options['page'] is not None and options['page'] < 0:
+                    raise RequestError(f"page には1以上の値を指定してください: {value}")
+        return options
+
+    def recognize(self, options, image_path=None, data=None, extension='.png'):
+        """
+        画像を認識し、応答の (ステータスコード, 辞書) を返す
+
+        Parameters:
+        -----------
+        options : dict
+            parse_options() の戻り値
+        image_path : str
+            サーバーから読み込める画像のパス（data を指定する場合はNone）
+        data : bytes
+            画像のデータ
+        extension : str
+            data を保存する一時ファイルの拡張子
+        """
+        started_at = time.perf_counter()
+        temp_path = None
+        remove_later = False
+        try:
+            if data is not None:
+                fd, temp_path = tempfile.mkstemp(suffix=extension, dir=self._temp_dir)
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                image_path = temp_path
+            future = self.batcher.submit(dict(options, image_path=image_path))
+            try:
+                result = future.result(timeout=self.request_timeout)
+            except concurrent.futures.TimeoutError:
+                # まだバッチに含まれていない項目は取り消す。認識中の場合は、終わってから一時ファイルを削除する
+                if not future.cancel() and temp_path is not None:
+                    future.add_done_callback(functools.partial(_remove_temp_file, temp_path))
+                    remove_later = True
+                result = {'error': "タイムアウトしました", 'status': 504}
+            except Exception as e:
+                logger.error(f"エラー: 処理結果の取得中に例外が発生しました: {str(e)}")
+                result = {'error': str(e), 'status': 500}
+        finally:
+            if temp_path is not None and not remove_later:
+                os.remove(temp_path)
+
+        elapsed = time.perf_counter() - started_at
+        self.metrics.add_stage('request', elapsed)
+        status = result.pop('status', 200)
+        with self._lock:
+            self.requests += 1
+            if status != 200:
+                self.failed += 1
+        if status == 200 and temp_path is None:
+            result['path'] = image_path
+        result['elapsed_ms'] = round(elapsed * 1000, 3)
+        return status, result
+
+    def stats(self):
+        """処理したリクエストの数、遅延の集計結果、マイクロバッチの統計を返す"""
+        summary = self.metrics.summary()
+        with self._lock:
+            requests, failed = self.requests, self.failed
+        return {
+            'uptime_seconds': round(time.time() - self.started_at, 3),
+            'requests': requests,
+            'failed': failed,
+            'latency': summary['stages'].get('request'),
+            'batching': self.batcher.stats()
+        }
+
+    def close(self):
+        """一時ファイルのディレクトリを削除する"""
+        try:
+            os.rmdir(self._temp_dir)
+        except OSError as e:
+            logger.warning(f"警告: 一時ディレクトリを削除できませんでした: {self._temp_dir}: {str(e)}")
+
+class OCRRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    OCRサーバーのHTTPリクエストを処理する
+
+    - POST /ocr : 画像を認識する。JSONの本文（{"path": "..."}）で画像のパスを、
+      それ以外の本文では画像のデータ（Content-Type は image/png など）を受け付ける。
+      後処理の設定（format, detect_tables, analyze_layout, conversion_level, raw, page）は
+      クエリ文字列またはJSONの本文で指定する
+    - GET /health : サーバーの状態を返す
+    - GET /stats : リクエストの数と遅延（p50 / p95 / 最大）、マイクロバッチの統計を返す
+    """
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'AppleOCR'
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        elif path == '/stats':
+            self._send_json(200, self.server.service.stats())
+        else:
+            self._send_json(404, {'error': f"見つかりません: {path}"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/ocr':
+            self._discard_body()
+            self._send_json(404, {'error': f"見つかりません: {url.path}"})
+            return
+        service = self.server.service
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            if length <= 0:
+                raise RequestError("本文（画像のパスまたはデータ）がありません")
+            if length > MAX_BODY_BYTES:
+                raise RequestError(f"本文が大きすぎます（上限: {MAX_BODY_BYTES}バイト）", 413)
+            content_type = (self.headers.get('Content-Type') or '').split(';')[0].strip().lower()
+            data = self.rfile.read(length)
+            query = parse_qs(url.query)
+            if content_type == 'application/json':
+                try:
+                    body = json.loads(data.decode('utf-8'))
+                except ValueError:
+                    raise RequestError("JSONの本文を解析できませんでした")
+                if not isinstance(body, dict) or not body.get('path'):
+                    raise RequestError("JSONの本文には \"path\" を指定してください")
+                options = service.parse_options(query, body)
+                status, result = service.recognize(options, image_path=body['path'])
+            else:
+                options = service.parse_options(query)
+                extension = query.get('ext', [None])[-1] or CONTENT_TYPE_EXTENSIONS.get(content_type, '.png')
+                if not extension.startswith('.'):
+                    extension = '.' + extension
+                status, result = service.recognize(options, data=data, extension=extension)
+        except RequestError as e:
+            status, result = e.status, {'error': str(e)}
+        self._send_json(status, result)
+
+    def _discard_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if 0 < length <= MAX_BODY_BYTES:
+            self.rfile.read(length)
+        else:
+            self.close_connection = True
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 413:
+            self.close_connection = True
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unixドメインソケットの場合、クライアントのアドレスはない
+        if isinstance(self.client_address, tuple) and self.client_address:
+            return str(self.client_address[0])
+        return 'unix'
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unixドメインソケットで待ち受けるHTTPサーバー（リクエストごとにスレッドで処理する）"""
+
+    daemon_threads = True
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        # BaseHTTPRequestHandler が参照する属性
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+def create_server(service, host='127.0.0.1', port=8765, socket_path=None):
+    """
+    OCRサーバーを作成する
+
+    Parameters:
+    -----------
+    service : OCRService
+        リクエストを処理するサービス
+    host, port : str, int
+        待ち受けるアドレスとポート（socket_path を指定しない場合）
+    socket_path : str
+        待ち受けるUnixドメインソケットのパス（既存のファイルは置き換える）
+
+    Returns:
+    --------
+    socketserver.BaseServer
+        serve_forever() で待ち受けを開始するサーバー
+    """
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, OCRRequestHandler)
+    else:
+        server = http.server.ThreadingHTTPServer((host, port), OCRRequestHandler)
+        server.daemon_threads = True
+    server.service = service
+    return server
+
+def _remove_temp_file(path, _future=None):
+    """一時ファイルを削除する（タイムアウトしたリクエストの認識が終わった時点で呼び出す）"""
+    try:
+        os.remove(path)
+    except OSError as e:
+        logger.warning(f"警告: 一時ファイルを削除できませんでした: {path}: {str(e)}")
+
+def _parse_bool(name, value):
+    """クエリ文字列やJSONの真偽値を解析する"""
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ('1', 'true', 'yes', 'on'):
+        return True
+    if text in ('0', 'false', 'no', 'off', ''):
+        return False
+    raise RequestError(f"{name} の値が正しくありません: {value}")
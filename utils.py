@@ -1,14 +1,82 @@
+import logging
 import os
+from fnmatch import fnmatch
+
+logger = logging.getLogger(__name__)
+
+# 対象とする画像の拡張子（小文字）
+IMAGE_EXTENSIONS = frozenset(['.png', '.jpg', '.jpeg', '.tiff'])
+
+# 複数ページを含む可能性のある画像の拡張子（ページ単位に分割して処理する）
+MULTI_PAGE_EXTENSIONS = frozenset(['.tiff'])
+
+# 再帰的に探索する場合に除外するディレクトリ（出力先や処理済み画像の移動先）
+EXCLUDED_DIR_NAMES = frozenset(['_output_texts', '_processed'])
 
 def get_image_files(directory):
     """
     指定されたディレクトリ内の画像ファイルを取得する
     """
-    image_extensions = ['.png', '.jpg', '.jpeg', '.tiff']
-    image_files = []
-    
-    for file in os.listdir(directory):
-        if any(file.lower().endswith(ext) for ext in image_extensions):
-            image_files.append(os.path.join(directory, file))
-    
-    return sorted(image_files)
+    return sorted(iter_image_files(directory))
+
+def iter_image_files(directory, recursive=False, include=None, exclude=None, exclude_dirs=None):
+    """
+    指定されたディレクトリ内の画像ファイルを、見つかった順に返す
+
+    os.scandir で走査するため、ディレクトリ全体の一覧を待たずに処理を開始できる。
+    返される順序はファイルシステムに依存するため、順序が必要な場合は呼び出し側で並べ替えること。
+
+    Parameters:
+    -----------
+    directory : str
+        探索するディレクトリ
+    recursive : bool
+        サブディレクトリも探索するかどうか
+        （隠しディレクトリ、_output_texts、_processed は探索しない）
+    include : list
+        対象とするファイルのパターン（directory からの相対パスに対するfnmatch形式）
+    exclude : list
+        除外するファイル・ディレクトリのパターン（同上）
+    exclude_dirs : list
+        探索しないディレクトリのパス
+
+    Yields:
+    -------
+    str
+        画像ファイルのパス
+    """
+    excluded = {os.path.abspath(path) for path in exclude_dirs or ()}
+    stack = [(directory, '')]
+
+    while stack:
+        current, relative_dir = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    name = entry.name
+                    relative = relative_dir + name
+                    if exclude and any(fnmatch(relative, pattern) for pattern in exclude):
+                        continue
+
+                    try:
+                        is_dir = recursive and entry.is_dir()
+                    except OSError:
+                        continue
+                    if is_dir:
+                        if (not name.startswith('.') and name not in EXCLUDED_DIR_NAMES
+                                and os.path.abspath(entry.path) not in excluded):
+                            stack.append((entry.path, relative + '/'))
+                        continue
+
+                    if name[name.rfind('.'):].lower() not in IMAGE_EXTENSIONS:
+                        continue
+                    if include and not any(fnmatch(relative, pattern) for pattern in include):
+                        continue
+                    try:
+                        if not entry.is_file():
+                            continue
+                    except OSError:
+                        continue
+                    yield entry.path
+        except OSError as e:
+            logger.warning(f"警告: ディレクトリを読み込めませんでした: {current}: {str(e)}")
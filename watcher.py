@@ -0,0 +1,104 @@
+import json
+import logging
+import os
+import time
+
+from utils import get_image_files
+
+logger = logging.getLogger(__name__)
+
+class FolderWatcher:
+    """
+    ディレクトリをポーリングし、新規または変更された画像ファイルを検出する
+
+    各ファイルの (サイズ, 更新時刻) を記録したインデックスを持ち、
+    処理済みのファイルと同じ状態のファイルは再度返さない。
+    書き込み中のファイルを処理しないよう、状態が settle_seconds の間
+    変化しなかったファイルだけを返す。
+    インデックスはJSONファイルに保存され、再起動後も引き継がれる。
+    """
+
+    def __init__(self, directory, index_path, settle_seconds=2.0):
+        self.directory = directory
+        self.index_path = index_path
+        self.settle_seconds = settle_seconds
+        self._index = self._load_index()
+        self._changing = {}     # パス -> (状態, 最初にその状態を確認した時刻)
+        self._submitted = {}    # パス -> 処理中の状態
+        self._dirty = False
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return {path: tuple(key) for path, key in json.load(f).items()}
+        except (OSError, ValueError) as e:
+            logger.warning(f"警告: 監視インデックスを読み込めませんでした: {str(e)}")
+            return {}
+
+    def save(self):
+        """インデックスに変更があれば保存する"""
+        if not self._dirty:
+            return
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f, ensure_ascii=False)
+        os.replace(temp_path, self.index_path)
+        self._dirty = False
+
+    def poll(self):
+        """
+        ディレクトリを走査し、処理を開始してよいファイルを返す
+
+        Returns:
+        --------
+        list
+            (画像ファイルのパス, 状態) のタプルのリスト
+        """
+        now = time.time()
+        ready = []
+        seen = set()
+
+        for path in get_image_files(self.directory):
+            seen.add(path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            key = (stat.st_size, stat.st_mtime_ns)
+
+            # 処理済み、または処理中のファイル
+            if self._index.get(path) == key or self._submitted.get(path) == key:
+                self._changing.pop(path, None)
+                continue
+
+            # 書き込みが完了するまで（状態が一定時間変化しなくなるまで）待つ
+            previous = self._changing.get(path)
+            if previous is None or previous[0] != key:
+                self._changing[path] = (key, now)
+                continue
+            if now - previous[1] < self.settle_seconds:
+                continue
+
+            del self._changing[path]
+            self._submitted[path] = key
+            ready.append((path, key))
+
+        # 削除・移動されたファイルをインデックスから取り除く
+        for path in [path for path in self._index if path not in seen and path not in self._submitted]:
+            del self._index[path]
+            self._dirty = True
+        for path in [path for path in self._changing if path not in seen]:
+            del self._changing[path]
+
+        return ready
+
+    def mark_done(self, path, key):
+        """
+        ファイルの処理が終わったことを記録する（失敗した場合も、変更されるまで再処理しない）
+        """
+        if self._submitted.get(path) == key:
+            del self._submitted[path]
+        self._index[path] = key
+        self._dirty = True
@@ -0,0 +1,252 @@
+import datetime
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 書き込みキューの終端を示す番兵
+_STOP = object()
+
+def build_markdown_document(image_file, text, now):
+    """
+    個別ファイル用のMarkdown（YAMLフロントマター付き）を作成する（nowがNoneの場合は現在時刻）
+    """
+    if now is None:
+        now = datetime.datetime.now()
+    base_name = os.path.splitext(os.path.basename(image_file))[0]
+    return f"""---
+title: {base_name}
+date: {now.strftime("%Y-%m-%d %H:%M:%S")}
+source: {image_file}
+---
+
+{text}
+"""
+
+class ResultWriter:
+    """
+    OCR結果を専用のI/Oスレッドで保存する
+
+    put() で渡された結果は、到着した順に個別ファイルへ保存され、
+    必要に応じて画像が処理済みディレクトリに移動される。
+    統合ファイルには、並べ替えバッファを通して元の順序（インデックス順）で追記される。
+    そのため、すべての結果をメモリに保持せずに、OCR処理と並行して出力できる。
+
+    統合ファイルを使用する場合、0から始まるすべてのインデックスについて
+    put() を呼び出すこと（失敗した画像は text=None で渡す）。
+
+    sort_combined=True の場合は、インデックスではなく画像のパス順で統合する。
+    入力の順序が処理開始時に決まらない場合（ファイルを探索しながら処理する場合）に使用する。
+    結果は一時ファイルに書き出しておき、close() の時点でパス順に統合ファイルへ書き込む。
+    そのため、統合ファイルのヘッダー（combined_header）は close() までに変更できる。
+
+    relative_to を指定した場合、出力ファイルと移動先の画像は、relative_to からの
+    相対ディレクトリ構成を保って保存される（サブディレクトリを探索した場合の名前の衝突を防ぐ）。
+    put() に relative_dir を指定した場合は、画像のパスではなく relative_dir を相対ディレクトリとして使用する。
+
+    metrics（MetricsAggregator）を指定した場合、結果ごとの書き込み時間を 'write' 段階として記録する。
+    events（EventStream）を指定した場合、結果ごとに保存後に 'image' イベントを出力する。
+    """
+
+    def __init__(self, output_dir, now, processed_dir=None, combined_file=None, combined_header="",
+                 with_headers=False, with_separators=False, max_queue_size=256, sort_combined=False,
+                 relative_to=None, metrics=None, events=None):
+        self.output_dir = output_dir
+        self.now = now
+        self.processed_dir = processed_dir
+        self.combined_file = combined_file
+        self.combined_header = combined_header
+        self.with_headers = with_headers
+        self.with_separators = with_separators
+        self.sort_combined = sort_combined
+        self.relative_to = relative_to
+        self.metrics = metrics
+        self.events = events
+        self.saved_count = 0
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._pending = {}  # 統合ファイルの並べ替えバッファ（インデックス -> 結果）
+        self._next_index = 0
+        self._combined_count = 0
+        self._combined = None
+        self._spool = None
+        self._spooled = []  # (画像のパス, 一時ファイル内の位置, 長さ) のリスト
+        self._thread = threading.Thread(target=self._run, name="ResultWriter", daemon=True)
+
+    def start(self):
+        """I/Oスレッドを開始する"""
+        if self.combined_file and self.sort_combined:
+            self._spool = tempfile.TemporaryFile(dir=self.output_dir)
+        elif self.combined_file:
+            try:
+                self._combined = open(self.combined_file, 'w', encoding='utf-8')
+                self._combined.write(self.combined_header)
+            except Exception as e:
+                logger.error(f"エラー: 統合ファイルの作成中に例外が発生しました: {str(e)}")
+                self._combined = None
+        self._thread.start()
+        return self
+
+    def put(self, index, image_file, text, relative_dir=None):
+        """
+        保存する結果を書き込みキューに追加する
+
+        Parameters:
+        -----------
+        index : int
+            元の順序を示すインデックス
+        image_file : str
+            画像ファイルのパス
+        text : str or None
+            OCR結果のテキスト（処理に失敗した場合はNone）
+        relative_dir : str
+            保存先の相対ディレクトリ（指定しない場合は relative_to からの画像の相対ディレクトリ）
+        """
+        self._queue.put((index, image_file, text, relative_dir))
+
+    def close(self):
+        """
+        キューに残っている結果をすべて書き込み、I/Oスレッドを終了する
+
+        Returns:
+        --------
+        int
+            保存した個別ファイルの数
+        """
+        self._queue.put(_STOP)
+        self._thread.join()
+        return self.saved_count
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            index, image_file, text, relative_dir = item
+            started_at = time.perf_counter()
+            output_file = None
+            if text is not None:
+                output_file = self._save(image_file, text, relative_dir)
+            if self._spool and text is not None:
+                self._spool_combined(image_file, text)
+            elif self._combined:
+                self._pending[index] = (image_file, text)
+                self._flush_combined()
+            if self.metrics is not None:
+                self.metrics.add_stage('write', time.perf_counter() - started_at)
+            if self.events is not None:
+                self.events.emit('image', index=index, path=image_file,
+                                 status='ok' if text is not None else 'failed', output=output_file)
+
+        if self._spool:
+            self._write_sorted_combined()
+
+        # 欠番があった場合も、残りを元の順序で書き込む
+        if self._combined:
+            for index in sorted(self._pending):
+                self._append_combined(*self._pending.pop(index))
+            self._close_combined()
+
+    def _save(self, image_file, text, relative_dir=None):
+        """個別ファイルを保存し、保存したファイルのパスを返す（保存に失敗した場合はNone）"""
+        try:
+            # 個別ファイルへの保存
+            base_name = os.path.splitext(os.path.basename(image_file))[0]
+            output_file = os.path.join(self._target_dir(self.output_dir, image_file, relative_dir),
+                                       f"{base_name}.md")
+
+            with open(output_file, 'w', encoding='utf-8') as f:
+                f.write(build_markdown_document(image_file, text, self.now))
+
+            self.saved_count += 1
+            logger.debug(f"保存完了: {output_file}")
+
+            # 処理済み画像の移動
+            if self.processed_dir:
+                try:
+                    dest_file = os.path.join(self._target_dir(self.processed_dir, image_file, relative_dir),
+                                             os.path.basename(image_file))
+                    shutil.move(image_file, dest_file)
+                    logger.debug(f"画像を移動しました: {dest_file}")
+                except Exception as e:
+                    logger.warning(f"警告: 画像の移動中にエラーが発生しました: {str(e)}")
+
+            return output_file
+        except Exception as e:
+            logger.error(f"エラー: ファイル保存中に例外が発生しました: {str(e)}")
+            return None
+
+    def _target_dir(self, base_dir, image_file, relative_dir=None):
+        """保存先のディレクトリを返す（relative_to または relative_dir が指定されている場合は相対ディレクトリを再現する）"""
+        if relative_dir is None:
+            if not self.relative_to:
+                return base_dir
+            relative_dir = os.path.relpath(os.path.dirname(image_file), self.relative_to)
+        if relative_dir == os.curdir:
+            return base_dir
+        target_dir = os.path.join(base_dir, relative_dir)
+        os.makedirs(target_dir, exist_ok=True)
+        return target_dir
+
+    def _spool_combined(self, image_file, text):
+        """統合ファイル用のテキストを一時ファイルに書き出す"""
+        data = text.encode('utf-8')
+        self._spooled.append((image_file, self._spool.tell(), len(data)))
+        self._spool.write(data)
+
+    def _write_sorted_combined(self):
+        """一時ファイルのテキストを、画像のパス順に統合ファイルへ書き込む"""
+        try:
+            self._combined = open(self.combined_file, 'w', encoding='utf-8')
+            self._combined.write(self.combined_header)
+        except Exception as e:
+            logger.error(f"エラー: 統合ファイルの作成中に例外が発生しました: {str(e)}")
+            self._combined = None
+        if self._combined:
+            self._spooled.sort()
+            for image_file, offset, length in self._spooled:
+                self._spool.seek(offset)
+                self._append_combined(image_file, self._spool.read(length).decode('utf-8'))
+        self._spool.close()
+        self._spooled = []
+
+    def _flush_combined(self):
+        """並べ替えバッファから、次のインデックスの結果を順に統合ファイルへ追記する"""
+        if self._next_index not in self._pending:
+            return
+        while self._next_index in self._pending:
+            self._append_combined(*self._pending.pop(self._next_index))
+            self._next_index += 1
+        self._combined.flush()
+
+    def _append_combined(self, image_file, text):
+        if text is None:
+            return
+        try:
+            # 2件目以降は、前のテキストとの間にセパレータ（Markdown形式の水平線）または空行を入れる
+            if self._combined_count > 0:
+                self._combined.write("\n\n---\n\n" if self.with_separators else "\n\n")
+
+            # ファイル名のヘッダーを追加（オプション）
+            if self.with_headers:
+                base_name = os.path.splitext(os.path.basename(image_file))[0]
+                self._combined.write(f"# {base_name}\n\n")
+
+            self._combined.write(text)
+            self._combined_count += 1
+        except Exception as e:
+            logger.error(f"エラー: 統合ファイルの保存中に例外が発生しました: {str(e)}")
+
+    def _close_combined(self):
+        try:
+            if self._combined_count > 0:
+                self._combined.write("\n\n")
+            self._combined.close()
+            logger.info(f"\n統合ファイルを保存しました: {self.combined_file}")
+        except Exception as e:
+            logger.error(f"エラー: 統合ファイルの保存中に例外が発生しました: {str(e)}")